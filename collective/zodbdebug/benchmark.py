@@ -0,0 +1,545 @@
+# coding=utf8
+u"""Synthetic databases and benchmarks, to compare the performance of revisions.
+
+`generate_database()` writes a `FileStorage` with a blob directory. Its contents only depend on a
+`Scale` and a seed:
+
+- A tree of folders, `depth` levels deep with `fanout` subfolders each, and a chain of
+  `chain_depth` nested folders, which has very long OID paths.
+- A folder with `btree_items` items in its `OOBTree`, which is split in many buckets.
+- An intid utility referencing every folder and item from an `IOBTree`, like `zope.intid`, so
+  every object has another path from the root.
+- `relations` relations, each one held by an item and referencing one of the first
+  `relation_targets` items, which get many back references.
+- `blobs` items with a blob of `blob_size` bytes, one in ten with the same contents as another.
+- `updates` small transactions modifying a few items.
+
+`run_benchmark()` times an operation of `BENCHMARKS` on such a database. Each benchmark runs in a
+new process, so it starts cold and its peak memory usage (`ru_maxrss`) is its own. The caches of
+`ZODBInfo` are kept in the directory of the database. See the `zodbdebug-benchmark` command.
+
+`run_check()` runs a consistency check of `CHECKS` on such a database, e.g. that a reference graph
+updated incrementally is the graph built from scratch. Checks which commit transactions work on a
+copy of the database.
+"""
+from .core import ENGINE_SCAN
+from .core import ENGINE_TRAVERSE
+from .core import ZODBInfo
+from .graph import NODE_ATTRIBUTES
+from .scripts.scan_blobs import diagnose_blobs
+from .scripts.show_transactions import diagnose_transactions
+from BTrees.IOBTree import IOBTree
+from BTrees.OOBTree import OOBTree
+from ZODB.DB import DB
+from ZODB.FileStorage import FileStorage
+from ZODB.blob import Blob
+from persistent import Persistent
+from rbco.caseclasses import case
+import binascii
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import transaction
+
+# Number of objects added by each transaction of `generate_database()`.
+_COMMIT_SIZE = 1000
+
+_PARAMETERS_FILE_NAME = 'benchmark.json'
+
+
+@case
+class Scale(object):
+    u"""Size of a synthetic database, see the module docstring."""
+
+    def __init__(
+        self, depth=6, fanout=3, chain_depth=100, btree_items=10000, relations=2000,
+        relation_targets=10, blobs=500, blob_size=4096, updates=100,
+    ):
+        pass
+
+    def scaled(self, factor):
+        u"""Return (Scale) a scale with `factor` times the number of items, relations, blobs and
+        updates. The shape of the trees does not change.
+        """
+        return self.copy(
+            btree_items=int(self.btree_items * factor),
+            relations=int(self.relations * factor),
+            blobs=int(self.blobs * factor),
+            updates=int(self.updates * factor),
+        )
+
+
+class Folder(Persistent):
+
+    def __init__(self, id):
+        self.id = id
+        self.items = OOBTree()
+
+    def getId(self):
+        return self.id
+
+
+class Item(Persistent):
+
+    def __init__(self, id):
+        self.id = id
+        self.relations = []
+        self.counter = 0
+
+    def getId(self):
+        return self.id
+
+
+class Relation(Persistent):
+
+    def __init__(self, from_object, to_object):
+        self.from_object = from_object
+        self.to_object = to_object
+
+
+class IntIds(Persistent):
+
+    def __init__(self):
+        self.refs = IOBTree()
+
+    def register(self, obj):
+        obj.intid = len(self.refs) + 1
+        self.refs[obj.intid] = obj
+
+
+def generate_database(path, scale=None, seed=0):
+    u"""Write a synthetic database in a new directory.
+
+    Arguments:
+    path (str) -- Directory of the database, which must not exist. The storage is written to
+        `Data.fs` and the blobs to `blobs`.
+    scale (Optional[Scale]) -- Size of the database.
+    seed (int) -- Seed of the random generator.
+    """
+    scale = scale or Scale()
+    rng = random.Random(seed)
+    os.makedirs(path)
+    with open(os.path.join(path, _PARAMETERS_FILE_NAME), 'w') as f:
+        json.dump({'scale': scale.as_dict(), 'seed': seed}, f)
+
+    db = DB(FileStorage(os.path.join(path, 'Data.fs'), blob_dir=os.path.join(path, 'blobs')))
+    tm = transaction.TransactionManager()
+    connection = db.open(tm)
+    added = [0]
+
+    def add(container, obj):
+        container.items[obj.id] = obj
+        intids.register(obj)
+        added[0] += 1
+        if added[0] % _COMMIT_SIZE == 0:
+            tm.commit()
+        return obj
+
+    try:
+        root = connection.root()
+        root['app'] = app = Folder('app')
+        app.intids = intids = IntIds()
+
+        level = [add(app, Folder('tree'))]
+        for _ in xrange(scale.depth):
+            level = [
+                add(parent, Folder('folder{}'.format(i)))
+                for parent in level for i in xrange(scale.fanout)
+            ]
+
+        parent = add(app, Folder('chain'))
+        for i in xrange(scale.chain_depth):
+            parent = add(parent, Folder('level{}'.format(i)))
+
+        container = add(app, Folder('items'))
+        items = [add(container, Item('item{:07d}'.format(i))) for i in xrange(scale.btree_items)]
+        tm.commit()
+
+        targets = items[:scale.relation_targets]
+        for _ in xrange(scale.relations if targets else 0):
+            source = rng.choice(items)
+            source.relations.append(Relation(source, rng.choice(targets)))
+            source._p_changed = True
+        tm.commit()
+
+        container = add(app, Folder('files'))
+        contents = ''
+        for i in xrange(scale.blobs):
+            if i % 10 != 9:
+                contents = _random_bytes(rng, scale.blob_size)
+            item = add(container, Item('file{:07d}'.format(i)))
+            item.data = Blob()
+            with item.data.open('w') as f:
+                f.write(contents)
+            if i % 100 == 99:
+                tm.commit()
+        tm.commit()
+
+        for i in xrange(scale.updates if items else 0):
+            for item in rng.sample(items, min(3, len(items))):
+                item.counter += 1
+            tm.get().note(u'Update {}'.format(i))
+            tm.commit()
+    finally:
+        connection.close()
+        db.close()
+
+
+def read_parameters(path):
+    u"""Return (Dict[str, Any]) the scale and the seed of the database in `path`."""
+    with open(os.path.join(path, _PARAMETERS_FILE_NAME), 'r') as f:
+        return json.load(f)
+
+
+def run_benchmark(path, name, samples=1000, seed=0):
+    u"""Run a benchmark in a new process.
+
+    Arguments:
+    path (str) -- Directory of a database written by `generate_database()`.
+    name (str) -- One of `BENCHMARKS`.
+    samples (int) -- Number of objects whose paths are computed.
+    seed (int) -- Seed of the random generator choosing the objects.
+
+    Return (BenchmarkResult)
+    """
+    if name not in BENCHMARKS:
+        raise ValueError('Unknown benchmark: {}'.format(name))
+
+    pool = multiprocessing.Pool(1)
+    try:
+        (seconds, max_rss) = pool.apply(_run_benchmark, (path, name, samples, seed))
+    finally:
+        pool.terminate()
+        pool.join()
+    return BenchmarkResult(name=name, seconds=seconds, max_rss=max_rss)
+
+
+def _run_benchmark(path, name, samples, seed):
+    # `ZODBInfo` keeps its caches below the home directory.
+    os.environ['HOME'] = os.path.join(path, 'home')
+    storage = FileStorage(
+        os.path.join(path, 'Data.fs'), blob_dir=os.path.join(path, 'blobs'), read_only=True
+    )
+    db = DB(storage)
+    connection = db.open()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        seconds = globals()['_benchmark_' + name](connection, samples, random.Random(seed))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        connection.close()
+        db.close()
+    return (seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+# Benchmarks -----------------------------------------------------------------------------------
+# Each one returns the seconds spent in the measured operation only.
+
+def _benchmark_build_cold(connection, samples, rng, **kwargs):
+    zodb_info = ZODBInfo(connection, **kwargs)
+    shutil.rmtree(zodb_info._get_cache_dir(), ignore_errors=True)
+    start_time = time.time()
+    zodb_info.build_reference_maps()
+    return time.time() - start_time
+
+
+def _benchmark_build_cold_scan(connection, samples, rng):
+    return _benchmark_build_cold(connection, samples, rng, engine=ENGINE_SCAN)
+
+
+def _benchmark_build_cold_compact(connection, samples, rng):
+    return _benchmark_build_cold(connection, samples, rng, compact_graph=True)
+
+
+def _benchmark_build_cached(connection, samples, rng):
+    ZODBInfo(connection).build_reference_maps()
+    start_time = time.time()
+    ZODBInfo(connection).build_reference_maps()
+    return time.time() - start_time
+
+
+def _benchmark_get_oid_path(connection, samples, rng):
+    (zodb_info, oids) = _get_samples(connection, samples, rng)
+    start_time = time.time()
+    for oid in oids:
+        zodb_info.get_oid_path(oid)
+    return time.time() - start_time
+
+
+def _benchmark_get_id_path(connection, samples, rng):
+    (zodb_info, oids) = _get_samples(connection, samples, rng)
+    start_time = time.time()
+    for oid in oids:
+        zodb_info.get_id_path(oid)
+    return time.time() - start_time
+
+
+def _benchmark_get_oid_paths(connection, samples, rng):
+    (zodb_info, oids) = _get_samples(connection, samples, rng)
+    start_time = time.time()
+    zodb_info.get_oid_paths(oids)
+    return time.time() - start_time
+
+
+def _benchmark_scan_blobs(connection, samples, rng):
+    ZODBInfo(connection).build_reference_maps()
+    start_time = time.time()
+    diagnose_blobs(ZODBInfo(connection))
+    return time.time() - start_time
+
+
+def _benchmark_show_transactions(connection, samples, rng):
+    zodb_info = ZODBInfo(connection)
+    zodb_info.build_reference_maps()
+    zodb_info.get_transaction_index()
+    start_time = time.time()
+    diagnose_transactions(ZODBInfo(connection), 0, 100)
+    return time.time() - start_time
+
+
+def _benchmark_lookups(connection, samples, rng, **kwargs):
+    # A graph just built, served from memory unless it is compact.
+    zodb_info = ZODBInfo(connection, **kwargs)
+    shutil.rmtree(zodb_info._get_cache_dir(), ignore_errors=True)
+    zodb_info.build_reference_maps()
+    oids = rng.sample(sorted(zodb_info.oids), min(samples, len(zodb_info.oids)))
+    start_time = time.time()
+    for oid in oids:
+        zodb_info.get_references(oid)
+        zodb_info.get_back_references(oid)
+    return time.time() - start_time
+
+
+def _benchmark_lookups_compact(connection, samples, rng):
+    return _benchmark_lookups(connection, samples, rng, compact_graph=True)
+
+
+def _get_samples(connection, samples, rng):
+    zodb_info = ZODBInfo(connection)
+    zodb_info.build_reference_maps()
+    oids = sorted(zodb_info.oids)
+    return (zodb_info, rng.sample(oids, min(samples, len(oids))))
+
+
+def _random_bytes(rng, size):
+    return binascii.unhexlify('{:0{}x}'.format(rng.getrandbits(size * 8), size * 2))
+
+
+BENCHMARKS = (
+    'build_cold',
+    'build_cold_scan',
+    'build_cold_compact',
+    'build_cached',
+    'lookups',
+    'lookups_compact',
+    'get_oid_path',
+    'get_id_path',
+    'get_oid_paths',
+    'scan_blobs',
+    'show_transactions',
+)
+
+
+@case
+class BenchmarkResult(object):
+    u"""Result of a benchmark: the time of the measured operation, in seconds, and the peak
+    resident memory of the process, in KB.
+    """
+
+    def __init__(self, name, seconds, max_rss):
+        pass
+
+
+def run_check(path, name):
+    u"""Run a consistency check in a new process.
+
+    Arguments:
+    path (str) -- Directory of a database written by `generate_database()`.
+    name (str) -- One of `CHECKS`.
+
+    Return (List[str]) -- The problems found, empty if none.
+    """
+    if name not in CHECKS:
+        raise ValueError('Unknown check: {}'.format(name))
+
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(_run_check, (path, name))
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _run_check(path, name):
+    work_dir = tempfile.mkdtemp(prefix='zodbdebug-check-')
+    # `ZODBInfo` keeps its caches below the home directory.
+    os.environ['HOME'] = os.path.join(work_dir, 'home')
+    try:
+        return globals()['_check_' + name](path, work_dir)
+    except Exception as e:  # noqa
+        return ['{}: {}'.format(type(e).__name__, e)]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# Checks ---------------------------------------------------------------------------------------
+# Each one returns the problems found.
+
+def _check_incremental_update(path, work_dir):
+    u"""Cache the graph, commit transactions and compare the graph updated from the cache with a
+    graph built from scratch, with each engine and backend.
+
+    The transactions add objects, unlink objects, add an object and unlink it again, and reference
+    again objects unlinked before or after the graph was cached.
+    """
+    problems = []
+    for engine in (ENGINE_TRAVERSE, ENGINE_SCAN):
+        for compact_graph in (False, True):
+            copy_dir = os.path.join(work_dir, '{}_{}'.format(engine, int(compact_graph)))
+            os.makedirs(copy_dir)
+            label = 'engine={} compact_graph={}: '.format(engine, compact_graph)
+            problems.extend(label + p for p in _check_replay(
+                path, copy_dir, engine=engine, compact_graph=compact_graph
+            ))
+    return problems
+
+
+def _check_replay(path, work_dir, **kwargs):
+    db = _open_copy(path, work_dir)
+    try:
+        tm = transaction.TransactionManager()
+        connection = db.open(tm)
+        app = connection.root()['app']
+        tree = app.items['tree']
+        folders = sorted(tree.items.keys())
+        # Stored, but not in the cached graph with the traverse engine.
+        unlinked_before = tree.items[folders[0]]
+        del tree.items[folders[0]]
+        tm.commit()
+
+        ZODBInfo(connection, **kwargs).build_reference_maps()
+
+        app.items['added'] = added = Folder('added')
+        added.items['item'] = Item('item')
+        unlinked_after = tree.items[folders[1]]
+        del tree.items[folders[1]]
+        app.items['temporary'] = temporary = Item('temporary')
+        tm.commit()
+        del app.items['temporary']
+        temporary.counter += 1
+        tm.commit()
+        added.items[folders[0]] = unlinked_before
+        added.items[folders[1]] = unlinked_after
+        tm.commit()
+        connection.close()
+
+        connection = db.open()
+        zodb_info = ZODBInfo(connection, **kwargs)
+        zodb_info.build_reference_maps()
+        shutil.rmtree(zodb_info._get_cache_dir())
+        expected = ZODBInfo(connection, **kwargs)
+        expected.build_reference_maps()
+        return _compare_graphs(zodb_info, expected)
+    finally:
+        db.close()
+
+
+def _check_oid_paths(path, work_dir):
+    u"""Compare the OID paths of every object computed together by `ZODBInfo.get_oid_paths()` with
+    the ones computed one by one by `ZODBInfo.get_oid_path()`.
+    """
+    db = DB(FileStorage(
+        os.path.join(path, 'Data.fs'), blob_dir=os.path.join(path, 'blobs'), read_only=True
+    ))
+    try:
+        connection = db.open()
+        zodb_info = ZODBInfo(connection)
+        zodb_info.build_reference_maps()
+        oids = sorted(zodb_info.oids)
+        paths = zodb_info.get_oid_paths(oids)
+
+        expected = ZODBInfo(connection)
+        expected.build_reference_maps()
+        different = [oid for oid in oids if paths[oid] != expected.get_oid_path(oid)]
+        if not different:
+            return []
+        oid = different[0]
+        return ['{} of {} OID paths differ, e.g. {}: {} instead of {}'.format(
+            len(different), len(oids), zodb_info.oid_to_repr(oid),
+            ' '.join(zodb_info.oid_to_repr(o) for o in paths[oid]),
+            ' '.join(zodb_info.oid_to_repr(o) for o in expected.get_oid_path(oid)),
+        )]
+    finally:
+        db.close()
+
+
+def _open_copy(path, work_dir):
+    u"""Return (DB) a copy of the database in `path`, in `work_dir`."""
+    shutil.copy(os.path.join(path, 'Data.fs'), os.path.join(work_dir, 'Data.fs'))
+    shutil.copytree(os.path.join(path, 'blobs'), os.path.join(work_dir, 'blobs'))
+    return DB(FileStorage(
+        os.path.join(work_dir, 'Data.fs'), blob_dir=os.path.join(work_dir, 'blobs')
+    ))
+
+
+def _compare_graphs(zodb_info, expected):
+    u"""Return (List[str]) the differences of the graph of `zodb_info` with the `expected` one.
+
+    With `ENGINE_TRAVERSE` objects which became unreachable stay in a graph updated incrementally
+    (see `ZODBInfo.build_reference_maps()`), so only the objects reachable from the root are
+    compared.
+    """
+    descriptions = [
+        _describe_graph(z.graph, z.root_oid, reachable_only=(z.engine != ENGINE_SCAN))
+        for z in (zodb_info, expected)
+    ]
+    problems = []
+    for (name, actual_items, expected_items) in zip(
+        ('OIDs', 'references', 'node attributes', 'attribute names'), *descriptions
+    ):
+        if actual_items == expected_items:
+            continue
+        if isinstance(actual_items, dict):
+            different = sorted(
+                k for k in set(actual_items).union(expected_items)
+                if actual_items.get(k) != expected_items.get(k)
+            )
+        else:
+            different = sorted(set(actual_items).symmetric_difference(expected_items))
+        problems.append('{} {} differ, e.g. {}'.format(
+            len(different), name, ', '.join(repr(d) for d in different[:3])))
+    return problems
+
+
+def _describe_graph(graph, root_oid, reachable_only):
+    u"""Return (Tuple) the OIDs, references, node attributes and attribute names of `graph`,
+    comparable between graph backends. Missing values are `None`.
+    """
+    oids = set(graph.oids)
+    if reachable_only:
+        oids.difference_update(graph.get_unreachable(root_oid))
+    edges = {(source, target) for (source, target) in graph.iter_edges() if source in oids}
+    names = sorted(name for name in NODE_ATTRIBUTES if graph.has_attribute(name))
+    attributes = {
+        (row[0], name): value or None
+        for row in graph.iter_attributes(*names) if row[0] in oids
+        for (name, value) in zip(names, row[1:])
+    }
+    attr_names = {
+        edge: graph.get_edge_attribute('attr_name', *edge) or None for edge in edges
+    } if graph.has_edge_attribute('attr_name') else {}
+    return (oids, edges, attributes, attr_names)
+
+
+CHECKS = (
+    'incremental_update',
+    'oid_paths',
+)
@@ -0,0 +1,329 @@
+# coding=utf8
+u"""Scan the files of a blob directory.
+
+The blob directory is walked lazily and the files are hashed by a pool of threads, so memory usage
+does not grow with the number of blobs: at most `max_pending` files are queued or being hashed at
+any time. Hashing is mostly waiting for the disk (or the network, for NFS), so threads scale well
+despite the GIL, which `hashlib` also releases while hashing large chunks.
+
+- `iter_blob_paths()`: the paths of the blob files, in a stable order.
+- `hash_blobs()`: hash the files of an iterable of paths, yielding `BlobHash` items as soon as
+  they are ready, or in the order of the paths.
+- `find_duplicate_blobs()`: group the files with the same contents. Files are grouped by size
+  first, so only files with the same size as another one are hashed.
+"""
+from logging import getLogger
+from multiprocessing.pool import ThreadPool
+from rbco.caseclasses import case
+import Queue
+import collections
+import functools
+import hashlib
+import itertools
+import multiprocessing
+import os
+import time
+import walkdir
+import zlib
+
+log = getLogger(__name__)
+
+HASH_HEAD = 'head'
+HASH_FULL = 'full'
+HASH_MODES = (HASH_HEAD, HASH_FULL)
+
+# Size read by `HASH_HEAD`, in bytes.
+HEAD_SIZE = 1024
+
+# Checksums of `zlib`, much faster than the cryptographic hashes, but with more collisions.
+_CHECKSUMS = {
+    'crc32': zlib.crc32,
+    'adler32': zlib.adler32,
+}
+
+HASH_ALGORITHMS = ('md5', 'sha1') + tuple(sorted(_CHECKSUMS))
+
+_CHUNK_SIZE = 1 << 20
+
+
+def iter_blob_paths(base_dir):
+    u"""Return (Iterator[str]) the paths of the blob files below `base_dir`, sorted inside each
+    directory.
+
+    The directories are listed one at a time, as they are walked.
+    """
+    return walkdir.file_paths(walkdir.include_files(_sorted_walk(base_dir), '*.blob'))
+
+
+def _sorted_walk(top):
+    for (dir_path, dir_names, file_names) in os.walk(top):
+        # Sorting in place makes `os.walk()` visit the subdirectories in order.
+        dir_names.sort()
+        file_names.sort()
+        yield (dir_path, dir_names, file_names)
+
+
+def hash_file(path, mode=HASH_HEAD, algorithm='md5'):
+    u"""Hash the contents of a file.
+
+    Arguments:
+    path (str) -- Path of the file.
+    mode (str) -- `HASH_HEAD` to hash only the first `HEAD_SIZE` bytes, `HASH_FULL` to hash
+        everything.
+    algorithm (str) -- One of `HASH_ALGORITHMS`.
+
+    Return (str) -- Hex digest.
+    """
+    if mode not in HASH_MODES:
+        raise ValueError('Unknown hash mode: {}'.format(mode))
+
+    checksum = _CHECKSUMS.get(algorithm)
+    if checksum is None:
+        digest = hashlib.new(algorithm)
+    value = 0
+
+    with open(path, 'rb') as f:
+        size = HEAD_SIZE if (mode == HASH_HEAD) else _CHUNK_SIZE
+        while True:
+            data = f.read(size)
+            if not data:
+                break
+
+            if checksum is None:
+                digest.update(data)
+            else:
+                value = checksum(data, value)
+
+            if mode == HASH_HEAD:
+                break
+
+    if checksum is None:
+        return digest.hexdigest()
+    return '{:08x}'.format(value & 0xffffffff)
+
+
+def hash_blobs(
+    paths, mode=HASH_HEAD, algorithm='md5', threads=8, ordered=False, max_pending=None,
+):
+    u"""Hash many files using a pool of threads.
+
+    The paths are consumed lazily: at most `max_pending` files are waiting to be hashed or being
+    hashed, so `paths` can be a generator over millions of files.
+
+    Arguments:
+    paths (Iterable[str]) -- Paths of the files.
+    mode (str) -- See `hash_file()`.
+    algorithm (str) -- See `hash_file()`.
+    threads (int) -- Number of threads hashing files.
+    ordered (bool) -- Yield the results in the order of `paths`. Otherwise each result is yielded
+        as soon as it is ready, which keeps all threads busy when some files are slow.
+    max_pending (Optional[int]) -- Defaults to 4 times `threads`.
+
+    Return (Iterator[BlobHash])
+    """
+    if mode not in HASH_MODES:
+        raise ValueError('Unknown hash mode: {}'.format(mode))
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError('Unknown hash algorithm: {}'.format(algorithm))
+
+    function = functools.partial(_hash_blob, mode=mode, algorithm=algorithm)
+    return _map_in_threads(function, paths, threads, ordered, max_pending)
+
+
+def find_duplicate_blobs(paths, algorithm='md5', threads=8, get_owner=None):
+    u"""Find the files with the same contents, largest first.
+
+    The size of every file is read first, then only the files with the same size as another file
+    are hashed, in full.
+
+    Arguments:
+    paths (Iterable[str]) -- Paths of the files.
+    algorithm (str) -- See `hash_file()`.
+    threads (int) -- Number of threads reading and hashing files.
+    get_owner (Optional[Callable[[str], Hashable]]) -- Function returning the owner of a file,
+        e.g. the OID of a blob. Files with the same owner are not duplicates of each other, so
+        groups whose files all have the same owner are left out.
+
+    Return (List[DuplicateBlobs])
+    """
+    paths_by_size = collections.defaultdict(list)
+    for (path, size) in _map_in_threads(_get_size, paths, threads):
+        if size is not None:
+            paths_by_size[size].append(path)
+
+    candidates = itertools.chain.from_iterable(
+        p for p in paths_by_size.itervalues() if _has_several_owners(p, get_owner)
+    )
+    del paths_by_size
+    paths_by_hash = collections.defaultdict(list)
+    for blob_hash in hash_blobs(candidates, HASH_FULL, algorithm, threads):
+        if not blob_hash.error:
+            paths_by_hash[(blob_hash.size, blob_hash.digest)].append(blob_hash.path)
+
+    result = [
+        DuplicateBlobs(size=size, digest=digest, paths=tuple(sorted(p)))
+        for ((size, digest), p) in paths_by_hash.iteritems()
+        if _has_several_owners(p, get_owner)
+    ]
+    result.sort(key=lambda d: (-d.reclaimable_size, d.paths))
+    return result
+
+
+def _has_several_owners(paths, get_owner):
+    if get_owner is None:
+        return len(paths) > 1
+    owners = set()
+    for path in paths:
+        owners.add(get_owner(path))
+        if len(owners) > 1:
+            return True
+    return False
+
+
+def _map_in_threads(function, items, threads, ordered=False, max_pending=None):
+    u"""Like `itertools.imap()`, but calling `function` in a pool of threads.
+
+    At most `max_pending` items (by default 4 times `threads`) are taken from `items` before their
+    results are yielded.
+    """
+    max_pending = max_pending or (threads * 4)
+    pool = ThreadPool(threads)
+    try:
+        if ordered:
+            results = _map_ordered(pool, function, items, max_pending)
+        else:
+            results = _map_unordered(pool, function, items, max_pending)
+        for result in results:
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _map_ordered(pool, function, items, max_pending):
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.apply_async(function, (item,)))
+        while pending and ((len(pending) >= max_pending) or pending[0].ready()):
+            yield _get_result(pending.popleft())
+
+    while pending:
+        yield _get_result(pending.popleft())
+
+
+def _map_unordered(pool, function, items, max_pending):
+    # `function` must not raise, otherwise its result never reaches `done`.
+    done = Queue.Queue()
+    num_pending = 0
+    for item in items:
+        pool.apply_async(function, (item,), callback=done.put)
+        num_pending += 1
+        while num_pending >= max_pending:
+            yield _get_done(done)
+            num_pending -= 1
+        while True:
+            try:
+                result = done.get_nowait()
+            except Queue.Empty:
+                break
+            num_pending -= 1
+            yield result
+
+    while num_pending:
+        yield _get_done(done)
+        num_pending -= 1
+
+
+def _get_result(async_result):
+    # A timeout makes the wait interruptible with Ctrl+C.
+    while True:
+        try:
+            return async_result.get(timeout=1)
+        except multiprocessing.TimeoutError:
+            pass
+
+
+def _get_done(done):
+    while True:
+        try:
+            return done.get(timeout=1)
+        except Queue.Empty:
+            pass
+
+
+def _hash_blob(path, mode, algorithm):
+    # Errors are returned instead of raised, so a single unreadable file (e.g. removed by a pack
+    # while scanning) does not stop the scan, and the unordered results are not lost.
+    try:
+        return BlobHash(
+            path=path,
+            size=os.path.getsize(path),
+            digest=hash_file(path, mode, algorithm),
+        )
+    except (IOError, OSError) as e:
+        return BlobHash(path=path, error=str(e))
+
+
+def _get_size(path):
+    try:
+        return (path, os.path.getsize(path))
+    except OSError:
+        return (path, None)
+
+
+class ScanStats(object):
+    u"""Throughput of a blob scan, logged periodically."""
+
+    _LOG_INTERVAL = 10.0
+
+    def __init__(self):
+        self.blobs = 0
+        self.bytes = 0
+        self.errors = 0
+        self.start_time = time.time()
+        self._last_log_time = self.start_time
+
+    def add(self, blob_hash):
+        self.blobs += 1
+        self.bytes += blob_hash.size or 0
+        if blob_hash.error:
+            self.errors += 1
+
+    def log_progress(self, force=False):
+        now = time.time()
+        if force or (now - self._last_log_time >= self._LOG_INTERVAL):
+            self._last_log_time = now
+            elapsed = max(now - self.start_time, 1e-6)
+            log.info(
+                'Hashed {} blobs ({} bytes, {} errors) in {:.1f}s ({:.0f} blobs/s).'.format(
+                    self.blobs, self.bytes, self.errors, elapsed, self.blobs / elapsed,
+                )
+            )
+
+
+@case
+class BlobHash(object):
+    u"""Hash of a blob file.
+
+    `size` is in bytes. When the file could not be read `size` and `digest` are `None` and `error`
+    holds the message.
+    """
+
+    def __init__(self, path, size=None, digest=None, error=None):
+        pass
+
+
+@case
+class DuplicateBlobs(object):
+    u"""Blob files with the same contents.
+
+    `size` is the size of each file, in bytes, and `digest` the hash of the contents.
+    """
+
+    def __init__(self, size, digest, paths):
+        pass
+
+    @property
+    def reclaimable_size(self):
+        u"""(int) Bytes used by all files but one."""
+        return self.size * (len(self.paths) - 1)
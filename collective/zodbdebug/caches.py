@@ -0,0 +1,263 @@
+# coding=utf8
+u"""Bounded caches for the results of `ZODBInfo` methods.
+
+Up to version 0.0.1 results were memoized with `plone.memoize`, in dicts which grew without
+limit, keeping e.g. the string representation of every object ever loaded. Now each method
+decorated with `cached()` has its own cache, created by the `Caches` of the instance, which evicts
+entries once it holds `maxsize` of them:
+
+- `LRUCache` evicts the least recently used entries.
+- `LFUCache` evicts the least frequently used entries.
+
+Any callable taking `maxsize` and returning an object with the interface of `LRUCache` can be used
+as the policy of `Caches`. Every cache counts its hits, misses and evictions, see `CacheStats`.
+
+The contents of a cache can be stored with `write_cache_file()` and read back with
+`read_cache_file()`, see `ZODBInfo.store_caches()`.
+"""
+from .util import mkdirp
+from functools import wraps
+from rbco.caseclasses import case
+import heapq
+import marshal
+import os
+
+POLICY_LRU = 'lru'
+POLICY_LFU = 'lfu'
+
+# Default maximum number of entries of each cache.
+DEFAULT_SIZE = 100000
+
+# Default sizes of the caches whose entries are large.
+DEFAULT_SIZES = {
+    'get_obj_as_str': 10000,
+    'get_physical_path': 10000,
+    '_get_oid_info': 10000,
+}
+
+_MARKER = object()
+
+# Version of the format of the cache files.
+_FILE_VERSION = 1
+
+
+class LRUCache(object):
+    u"""Mapping which evicts the least recently used entries beyond `maxsize` entries.
+
+    Each entry holds the time it was last used, counted in lookups. Keeping the entries ordered on
+    every lookup is slow in Python, so when the cache is full the least recently used
+    `evict_fraction` of the entries are evicted at once instead.
+
+    Only `get()` counts hits and misses and marks entries as used, the other methods are for
+    callers which manage the cache themselves. `maxsize=None` never evicts.
+    """
+
+    policy = POLICY_LRU
+
+    def __init__(self, maxsize=DEFAULT_SIZE, evict_fraction=0.1):
+        self.maxsize = maxsize
+        self.evict_fraction = evict_fraction
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._clock = 0
+        # `[value, score]` by key, the entries with the lowest scores are evicted first.
+        self._data = {}
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._clock += 1
+        entry[1] = self._clock
+        return entry[0]
+
+    def __getitem__(self, key):
+        return self._data[key][0]
+
+    def __setitem__(self, key, value):
+        data = self._data
+        entry = data.get(key)
+        if entry is not None:
+            entry[0] = value
+            return
+
+        if (self.maxsize is not None) and (len(data) >= self.maxsize):
+            self._evict()
+        self._clock += 1
+        data[key] = [value, self._get_initial_score()]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def setdefault(self, key, value):
+        entry = self._data.get(key)
+        if entry is not None:
+            return entry[0]
+        self[key] = value
+        return value
+
+    def items(self):
+        return [(key, entry[0]) for (key, entry) in self._data.iteritems()]
+
+    def clear(self):
+        self._data.clear()
+
+    def get_stats(self, name):
+        u"""Return (CacheStats) the statistics of this cache, named `name`."""
+        return CacheStats(
+            name=name,
+            policy=self.policy,
+            maxsize=self.maxsize,
+            size=len(self),
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+    def _get_initial_score(self):
+        return self._clock
+
+    def _evict(self):
+        data = self._data
+        num_evicted = max(1, int(self.maxsize * self.evict_fraction))
+        for key in heapq.nsmallest(num_evicted, data, key=lambda k: data[k][1]):
+            del data[key]
+        self.evictions += num_evicted
+
+
+class LFUCache(LRUCache):
+    u"""Mapping which evicts the least frequently used entries beyond `maxsize` entries.
+
+    Like `LRUCache` the least used `evict_fraction` of the entries are evicted at once.
+    """
+
+    policy = POLICY_LFU
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        entry[1] += 1
+        return entry[0]
+
+    def _get_initial_score(self):
+        return 0
+
+
+POLICIES = {
+    POLICY_LRU: LRUCache,
+    POLICY_LFU: LFUCache,
+}
+
+
+class Caches(object):
+    u"""The named caches of an object, created on first use.
+
+    Arguments:
+    policy (Union[str, Callable[[Optional[int]], LRUCache]]) -- One of `POLICIES`, or a callable
+        creating a cache with the given `maxsize`.
+    sizes (Optional[Mapping[str, Optional[int]]]) -- Maximum number of entries by cache name, by
+        default `DEFAULT_SIZES`. `None` means unbounded.
+    default_size (Optional[int]) -- Maximum number of entries of the other caches.
+    """
+
+    def __init__(self, policy=POLICY_LRU, sizes=None, default_size=DEFAULT_SIZE):
+        if not callable(policy):
+            if policy not in POLICIES:
+                raise ValueError('Unknown cache policy: {}'.format(policy))
+            policy = POLICIES[policy]
+
+        self.policy = policy
+        self.sizes = dict(DEFAULT_SIZES)
+        self.sizes.update(sizes or {})
+        self.default_size = default_size
+        self._caches = {}
+
+    def get(self, name):
+        u"""Return (LRUCache) the cache named `name`."""
+        cache = self._caches.get(name)
+        if cache is None:
+            cache = self._caches[name] = self.policy(self.sizes.get(name, self.default_size))
+        return cache
+
+    def stats(self):
+        u"""Return (List[CacheStats]) the statistics of every cache, by name."""
+        return [self._caches[name].get_stats(name) for name in sorted(self._caches)]
+
+    def clear(self):
+        for cache in self._caches.itervalues():
+            cache.clear()
+
+
+def cached(f):
+    u"""Cache the results of a method in the cache of `self.caches` named after the method.
+
+    The positional arguments must be hashable. Calls with keyword arguments use other cache keys
+    than the same calls with positional arguments.
+    """
+    name = f.__name__
+
+    @wraps(f)
+    def new_f(self, *args, **kwargs):
+        cache = self.caches.get(name)
+        key = (args + (frozenset(kwargs.iteritems()),)) if kwargs else args
+        value = cache.get(key, _MARKER)
+        if value is _MARKER:
+            value = f(self, *args, **kwargs)
+            cache[key] = value
+        return value
+
+    return new_f
+
+
+def read_cache_file(path):
+    u"""Read the entries stored by `write_cache_file()`.
+
+    Return (Dict[str, List[Tuple[Any, Any]]]) -- `(key, value)` pairs by cache name, empty if the
+        file is missing or in an unknown format.
+    """
+    try:
+        with open(path, 'rb') as f:
+            (version, entries) = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return {}
+    return entries if (version == _FILE_VERSION) else {}
+
+
+def write_cache_file(path, entries):
+    u"""Store cache entries in a file, replacing it atomically.
+
+    Arguments:
+    path (str) -- Path of the file.
+    entries (Mapping[str, Iterable[Tuple[Any, Any]]]) -- `(key, value)` pairs by cache name. Keys
+        and values must be supported by `marshal`: strings, numbers, tuples and `None`.
+    """
+    mkdirp(os.path.dirname(path))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        marshal.dump((_FILE_VERSION, {name: list(e) for (name, e) in entries.iteritems()}), f)
+    os.rename(tmp_path, path)
+
+
+@case
+class CacheStats(object):
+    u"""Statistics of a cache: `size` is the number of entries, `maxsize` the maximum."""
+
+    def __init__(self, name, policy, maxsize, size, hits, misses, evictions):
+        pass
+
+    @property
+    def hit_rate(self):
+        u"""(Optional[float]) Fraction of the lookups which were hits."""
+        lookups = self.hits + self.misses
+        return (float(self.hits) / lookups) if lookups else None
@@ -0,0 +1,69 @@
+# coding=utf8
+u"""Find the objects of a class.
+
+The class of each record is read from the start of its pickle while the reference graph is built,
+without unpickling it, and stored in the graph as the `class_name` attribute (see
+`.graph.NODE_ATTRIBUTES`), with each class name stored once. So the questions below are answered
+from the graph, or from its cache file, without loading or activating any object:
+
+- `get_class_counts()`: the number of objects of each class.
+- `find_oids_by_class()`: the objects of the classes matching some patterns, e.g.
+  `*.RelationValue`.
+
+Graphs without class names, e.g. old caches, are supported by loading every record instead.
+"""
+from . import profiling
+from fnmatch import fnmatchcase
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+def get_class_counts(zodb_info):
+    u"""Get the number of objects of each class.
+
+    Every object in the reference maps with a record is counted, reachable or not.
+
+    Arguments:
+    zodb_info (ZODBInfo) -- With the reference maps built.
+
+    Return (Dict[str, int])
+    """
+    graph = zodb_info.graph
+    with profiling.timer('classes.count'):
+        if graph.has_attribute('class_name'):
+            return graph.get_attribute_counts('class_name')
+
+        log.warning('The reference graph has no class names, loading every record.')
+        counts = {}
+        for oid in graph.oids:
+            class_name = zodb_info.get_class_name(oid)
+            if class_name:
+                counts[class_name] = counts.get(class_name, 0) + 1
+        return counts
+
+
+def find_oids_by_class(zodb_info, patterns):
+    u"""Find the objects whose class matches one of `patterns`.
+
+    Arguments:
+    zodb_info (ZODBInfo) -- With the reference maps built.
+    patterns (Iterable[str]) -- Dotted class names, or `fnmatch` patterns of them, e.g.
+        `z3c.relationfield.relation.RelationValue` or `*.RelationValue`.
+
+    Return (List[str]) -- The OIDs, sorted.
+    """
+    patterns = list(patterns)
+    class_names = [
+        c for c in get_class_counts(zodb_info) if any(fnmatchcase(c, p) for p in patterns)
+    ]
+    log.info('Classes matching {}: {}'.format(
+        ', '.join(patterns), ', '.join(sorted(class_names)) or '(none)'))
+
+    graph = zodb_info.graph
+    with profiling.timer('classes.find'):
+        if graph.has_attribute('class_name'):
+            return graph.find_oids_by_attribute('class_name', class_names)
+
+        class_names = frozenset(class_names)
+        return sorted(oid for oid in graph.oids if zodb_info.get_class_name(oid) in class_names)
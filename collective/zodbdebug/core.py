@@ -1,18 +1,59 @@
 # coding=utf8
+from . import profiling
+from .blobs import iter_blob_paths
+from .caches import Caches
+from .caches import cached
+from .caches import read_cache_file
+from .caches import write_cache_file
 from .config import PACKAGE_NAME
+from .fsscan import is_file_storage
+from .fsscan import iter_current_records
+from .graph import CompactReferenceGraph
+from .graph import decode_external_references
+from .graph import encode_external_references
+from .graph import make_graph_builder
+from .graph import to_compact
+from .graph import to_reference_maps
+from .graphfile import GraphFileError
+from .graphfile import is_graph_file
+from .graphfile import read_sections
+from .graphfile import write_sections
+from .history import open_reference_history
+from .parallel import BuildStats
+from .parallel import StorageOpener
+from .parallel import build_graph_in_parallel
+from .pickles import get_class_name
+from .pickles import get_state_info
+from .transactions import TransactionInfo
+from .transactions import get_transaction_oids
+from .transactions import has_transaction
+from .transactions import open_transaction_index
 from .util import cache_get_oid_path
 from .util import mkdirp
 from .util import pairwise
 from ZODB.POSException import POSKeyError
-from ZODB.serialize import referencesf
 from ZODB.utils import oid_repr
+from ZODB.utils import p64
 from ZODB.utils import repr_to_oid
 from ZODB.utils import tid_repr
+from ZODB.utils import u64
+from array import array
 from logging import getLogger
-from plone.memoize import instance
 from rbco.caseclasses import case
+import collections
+import hashlib
+import itertools
 import os
-import walkdir
+import re
+
+
+ENGINE_TRAVERSE = 'traverse'
+ENGINE_SCAN = 'scan'
+ENGINES = (ENGINE_TRAVERSE, ENGINE_SCAN)
+
+# Fields of `OIDInfo`, in order. `oid_path` only needs the reference graph and so do `id` and
+# `id_path` when the graph holds the ids and attribute names, `obj` and `path` load the object.
+OID_INFO_FIELDS = ('oid', 'id', 'obj', 'path', 'oid_path', 'id_path')
 
 
 class ZODBInfo(object):
@@ -58,16 +99,86 @@ class ZODBInfo(object):
         containment relationship (i.e "parent -> child"). This means that multiple paths can exist
         for a given OID. This class tries its best to build "good" OID paths, prefering more
         structural relationships, such as the containment one.
+
+        To get the OID paths of many objects prefer `get_oid_paths()`, which finds the best back
+        reference of each object once and walks the parts the paths have in common once.
+
+        The ids and attribute names used to choose the references are read from the record states
+        while the maps are built, and the score of each reference is stored in the maps (see
+        `_store_reference_scores()`), so no object is loaded to compute OID paths or ID paths.
+
+    Reference graph backends:
+        The maps are Python dicts of sets of OIDs by default. When `compact_graph` is true a
+        `.graph.CompactReferenceGraph` is used instead, which stores OIDs as 64-bit integers and
+        edges as arrays. It uses an order of magnitude less memory, at the cost of slower lookups.
+        See `.graph` for details.
+
+    Parallel build:
+        When `workers` is greater than 1 the maps are built by a pool of worker processes, each one
+        with its own read-only storage (see `.parallel`). For a `FileStorage` this is automatic,
+        for other storages pass a `.parallel.StorageOpener` as `storage_opener`.
+
+    Build engines:
+        With the default engine (`ENGINE_TRAVERSE`) the maps are built by following the references
+        from the root object, so only reachable objects are included. With `ENGINE_SCAN` a
+        `FileStorage` is read sequentially (see `.fsscan`), which is faster and includes every
+        stored object, so `get_unreachable_oids()` can tell which ones are not reachable. The scan
+        engine is always single-process.
+
+    Multiple databases:
+        The maps only hold the objects of the database of `connection`. The references to objects
+        of other databases are kept as an attribute of their source (see
+        `get_external_references()`), and `.multidb.MultiDatabaseInfo` combines the maps of every
+        database.
+
+    Reference cache:
+        The maps are stored in a binary cache file (see `.graphfile`) named after the last
+        transaction. A graph found in the cache is served from the memory-mapped file, so opening
+        it takes constant time and memory usage only grows with the pages actually touched. A graph
+        just built or updated stays in memory, unless `compact_graph` is true: then it is served
+        from the file it was stored in too.
+
+    Result caches:
+        Results of slow methods are kept in bounded caches, one per method, evicting the least
+        recently or least frequently used entries (see `.caches`). Pass a `.caches.Caches` as
+        `caches` to choose the policy and the sizes. Evicted OID paths are computed again by
+        `get_oid_path()`, which may then choose another path of the same object.
+
+        The ids and attribute names read by activating objects, when the graph does not hold them,
+        can be stored in the cache directory with `store_caches()` and loaded by a later run with
+        `load_caches()`.
     """
 
-    _EMPTY_FROZENSET = frozenset()
     _EMPTY_TUPLE = tuple()
+    _TRANSACTION_INDEX_DIR_NAME = 'transactions'
+    _REFERENCE_HISTORY_DIR_NAME = 'history'
+    _NAMES_CACHE_PREFIX = 'names_'
+    # Caches stored by `store_caches()`, all keyed by OIDs.
+    _STORED_CACHES = ('_load_id', '_load_attr_name')
+    _REFERENCE_CACHE_PREFIXES = {
+        ENGINE_TRAVERSE: 'zodb_references_',
+        ENGINE_SCAN: 'zodb_references_scan_',
+    }
+
+    def __init__(
+        self, connection, compact_graph=False, workers=1, storage_opener=None,
+        engine=ENGINE_TRAVERSE, caches=None,
+    ):
+        if engine not in ENGINES:
+            raise ValueError('Unknown engine: {}'.format(engine))
 
-    def __init__(self, connection):
         self.connection = connection
-        self._oids = None
-        self._reference_map = None
-        self._back_reference_map = None
+        self.engine = engine
+        self.compact_graph = compact_graph
+        self.workers = workers
+        self.storage_opener = storage_opener
+        self.caches = caches or Caches()
+        self._root_oid = None
+        self._graph = None
+        self._oid_paths_cache = self.caches.get('get_oid_path')
+        self._look_ahead_scores = {}
+        self._transaction_index = None
+        self._reference_history = None
 
     @property
     def _logger(self):
@@ -81,11 +192,18 @@ class ZODBInfo(object):
         u"""(ZODB.interfaces.IStorage) Storage."""
         return self.connection.db().storage
 
+    @property
+    def database_name(self):
+        u"""(str) Name of the database in its multi-database, see `.multidb`."""
+        return self.connection.db().database_name
+
     # OID and OID repr -----------------------------------------------------------------------------
 
-    @instance.memoizedproperty
+    @property
     def root_oid(self):
-        return self.connection.root._root._p_oid
+        if self._root_oid is None:
+            self._root_oid = self.connection.root._root._p_oid
+        return self._root_oid
 
     def repr_to_oid(self, oid_repr):
         return repr_to_oid(oid_repr)
@@ -106,47 +224,105 @@ class ZODBInfo(object):
         u"""Get the object from its `oid'."""
         oid = self.oid_or_repr_to_oid(oid)
         obj = self.connection.get(oid)
-        obj._p_activate()
+        with profiling.timer('object.activate'):
+            obj._p_activate()
         return obj
 
-    @instance.memoize
+    @cached
     def get_obj_as_str(self, oid):
         try:
             return str(self.get_obj(oid))
         except Exception:
             return '<error>'
 
-    @instance.memoize
+    @cached
     def get_physical_path(self, oid):
         try:
             return self.get_obj(oid).getPhysicalPath()
         except Exception:
             return None
 
-    @instance.memoize
     def get_id(self, oid):
-        obj = self.get_obj(oid)
+        u"""Get the id of an object.
 
-        if oid == self.root_oid:
-            return 'Root'
-
-        getId = getattr(obj, 'getId', None)
-        if getId:
-            try:
-                return getId()
-            except:  # noqa
-                pass
-        return getattr(obj, 'id', None)
+        Uses the ids stored in the reference maps when available (see `.pickles.get_state_info()`),
+        otherwise activates the object.
+        """
+        return self._get_id(self.oid_or_repr_to_oid(oid))
 
-    @instance.memoize
     def get_attr_name(self, oid, parent_oid):
+        u"""Get the name of the attribute of `parent_oid` which holds `oid`.
+
+        Uses the attribute names stored in the reference maps when available, otherwise activates
+        both objects.
+        """
+        return self._get_attr_name(
+            self.oid_or_repr_to_oid(oid), self.oid_or_repr_to_oid(parent_oid)
+        )
+
+    def get_record_size(self, oid):
+        u"""Get the size of the pickle of the current record of `oid`, in bytes.
+
+        Uses the sizes stored in the reference maps when available, otherwise loads the record.
+
+        Arguments:
+        oid (str) -- OID or OID representation.
+
+        Return (Optional[int]) -- `None` if the object has no current record.
+        """
         oid = self.oid_or_repr_to_oid(oid)
-        obj = self.get_obj(oid)
-        parent = self.get_obj(parent_oid)
-        names_and_values = ((name, getattr(parent, name, None)) for name in dir(parent))
-        return next((name for (name, value) in names_and_values if value is obj), None)
+        if (self._graph is not None) and self._graph.has_attribute('size') and (
+            oid in self._graph.oids
+        ):
+            return self._graph.get_attribute('size', oid)
 
-    @instance.memoize
+        try:
+            return len(self._load_record(oid))
+        except POSKeyError:
+            return None
+
+    def get_record_tid(self, oid):
+        u"""Get the id of the transaction which wrote the current record of `oid`. Loads the
+        record.
+
+        Arguments:
+        oid (str) -- OID or OID representation.
+
+        Return (Optional[str]) -- `None` if the object has no current record.
+        """
+        oid = self.oid_or_repr_to_oid(oid)
+        try:
+            with profiling.timer('storage.load'):
+                (_, tid) = self.storage.load(oid)
+        except POSKeyError:
+            return None
+        return tid
+
+    def get_class_name(self, oid):
+        u"""Get the dotted name of the class of `oid`, read from the record without unpickling
+        the object state.
+
+        Uses the class names stored in the reference maps when available, otherwise loads the
+        record.
+
+        Arguments:
+        oid (str) -- OID or OID representation.
+
+        Return (Optional[str]) -- `None` if the object has no current record.
+        """
+        oid = self.oid_or_repr_to_oid(oid)
+        if (self._graph is not None) and self._graph.has_attribute('class_name'):
+            class_name = self._graph.get_attribute('class_name', oid)
+            if class_name:
+                return class_name
+
+        try:
+            p = self._load_record(oid)
+        except POSKeyError:
+            return None
+        return get_class_name(p) or None
+
+    @cached
     def get_id_or_attr_name(self, oid, parent_oid=None):
         identifier = self.get_id(oid)
         if identifier:
@@ -156,64 +332,79 @@ class ZODBInfo(object):
 
     # References -----------------------------------------------------------------------------------
 
+    @property
+    def graph(self):
+        u"""(Union[ReferenceMaps, CompactReferenceGraph]) The reference graph."""
+        if self._graph is None:
+            raise RuntimeError(u'Reference map is not built. Call `build_reference_maps()`.')
+        return self._graph
+
     @property
     def oids(self):
         u"""(Set[str]) Set of all OIDs."""
-        if not self._oids:
-            raise RuntimeError(u'Reference map is not built. Call `build_reference_maps()`.')
-        return self._oids
+        return self.graph.oids
 
     @property
     def reference_map(self):
         u"""(Mapping[str, Set[str]]) Mapping from OID to set of referenced oids."""
-        if not self._reference_map:
-            raise RuntimeError(u'Reference map is not built. Call `build_reference_maps()`.')
-        return self._reference_map
+        return self.graph.reference_map
 
     @property
     def back_reference_map(self):
         u"""(Mapping[str, Set[str]]) Mapping from OID to set of oids that references it."""
-        if not self._back_reference_map:
-            raise RuntimeError(
-                u'Reference map is not built. Call `build_back_reference_map()`.'
-            )
-        return self._back_reference_map
+        return self.graph.back_reference_map
 
     def build_reference_maps(self):
         u"""Build the forward and back reference maps for the ZODB.
 
         Looks in every record of every transaction. Results are available in the following
         properties: `oids`, `reference_map`, `back_reference_map`.
+
+        If there is no cache for the last transaction, but there is one for an earlier transaction,
+        only the transactions committed after it are read and the cached maps are patched. Objects
+        which became unreachable in those transactions are kept in the maps until the cache is
+        removed and the maps are built from scratch.
         """
+        with profiling.timer('graph.build'):
+            self._build_reference_maps()
+
+    def _build_reference_maps(self):
         self._logger.info('build_reference_maps: Entered.')
 
-        if self._reference_map or self._back_reference_map:
+        if self._graph is not None:
             raise RuntimeError('Found existing reference map!')
 
         cache_path = self._get_reference_cache_path()
         self._logger.info('build_reference_maps: Cache file path is {}'.format(cache_path))
+        self._move_legacy_reference_cache(cache_path)
 
         if os.path.exists(cache_path):
             self._logger.info('build_reference_maps: Loading reference maps from file...')
-            self._load_reference_cache(cache_path)
+            try:
+                self._load_reference_cache(cache_path)
+            except GraphFileError as e:
+                self._logger.warning('build_reference_maps: Ignoring cache file: {}'.format(e))
         else:
             self._logger.info('build_reference_maps: Cache file not found.')
+            self._update_reference_maps_from_previous_cache(cache_path)
+
+        if self._graph is None:
             self._logger.info('build_reference_maps: Building maps from scratch...')
             self._build_reference_maps_from_scratch()
 
+            self._logger.info('build_reference_maps: Computing reference scores...')
+            self._store_reference_scores()
+
             self._logger.info('build_reference_maps: Storing reference cache to file...')
             self._store_reference_cache(cache_path)
+            self._serve_stored_reference_cache(cache_path)
 
         self._logger.info('build_reference_maps: Done!')
         self._logger.info(
-            'build_reference_maps: len(self._reference_map) == {}'.format(len(self._reference_map))
+            'build_reference_maps: len(self.oids) == {}'.format(len(self._graph))
         )
         self._logger.info(
-            'build_reference_maps: len(self._back_reference_map) == {}'.format(
-                len(self._back_reference_map))
-        )
-        self._logger.info(
-            'build_reference_maps: len(self.oids) == {}'.format(len(self.oids))
+            'build_reference_maps: number of references == {}'.format(self._graph.num_edges)
         )
 
     def get_references(self, oid):
@@ -225,7 +416,17 @@ class ZODBInfo(object):
         Return (Set[str])
         """
         oid = self.oid_or_repr_to_oid(oid)
-        return self.reference_map.get(oid, self._EMPTY_FROZENSET)
+        return self.graph.get_references(oid)
+
+    def get_unreachable_oids(self):
+        u"""Get the OIDs in the reference maps which are not reachable from the root.
+
+        The maps only contain unreachable objects when they are built with the `ENGINE_SCAN`
+        engine, or when objects became unreachable in a transaction applied incrementally.
+
+        Return (Set[str])
+        """
+        return self.graph.get_unreachable(self.root_oid)
 
     def get_back_references(self, oid):
         u"""Get the OIDs which references the given `oid`.
@@ -236,9 +437,26 @@ class ZODBInfo(object):
         Return (Set[str])
         """
         oid = self.oid_or_repr_to_oid(oid)
-        return self.back_reference_map.get(oid, self._EMPTY_FROZENSET)
+        return self.graph.get_back_references(oid)
 
-    @instance.memoize
+    def get_external_references(self, oid):
+        u"""Get the objects of other databases referenced by the given `oid`, see `.multidb`.
+
+        Graphs cached by older versions do not hold them, see `has_external_references()`.
+
+        Arguments:
+        oid (str) -- OID or OID representation.
+
+        Return (Set[Tuple[str, str]]) -- `(database name, OID)` pairs.
+        """
+        oid = self.oid_or_repr_to_oid(oid)
+        return decode_external_references(self.graph.get_attribute('xrefs', oid))
+
+    def has_external_references(self):
+        u"""Return (bool) whether the graph holds the references to objects of other databases."""
+        return self.graph.has_attribute('xrefs')
+
+    @cached
     def get_identified_back_references(self, oid):
         u"""Get the OIDs which references the given `oid` together with the attribute name and
         score.
@@ -252,7 +470,7 @@ class ZODBInfo(object):
             (
                 br,
                 self.get_attr_name(oid, parent_oid=br),
-                self._get_reference_score(source=br, target=oid),
+                self._get_reference_score(br, oid),
             )
             for br
             in self.get_back_references(oid)
@@ -276,21 +494,89 @@ class ZODBInfo(object):
         ))
 
         oid = self.oid_or_repr_to_oid(oid)
+        cache = self._oid_paths_cache
+
+        # Follow the best back references, without recursion: OID paths inside large BTrees can
+        # be thousands of items long.
+        path = [oid]
+        forbidden = set(preceding_path)
+        forbidden.add(oid)
+        with profiling.timer('paths.get_oid_path'):
+            while True:
+                bref = self._get_best_back_reference(path[-1], forbidden=forbidden)
+                if not bref:
+                    break
+
+                cached_path = cache.get(bref)
+                if cached_path and set(cached_path).isdisjoint(forbidden):
+                    path.extend(cached_path)
+                    break
+
+                path.append(bref)
+                forbidden.add(bref)
+
+        return tuple(path)
+
+    def get_oid_paths(self, oids):
+        u"""Given many OIDs return their OID paths, computed together.
+
+        Each path is the one given by `get_oid_path()`. The best back reference of every object in
+        the paths is found once, walking the back references breadth-first from all the OIDs
+        together (see `get_parent_indexes()`). The paths are then followed along these parents, in
+        the order of the OIDs, and every walk stops at the first object whose path is already
+        known, whose path is reused, so the parts shared by many paths, e.g. the inner nodes of a
+        BTree, are walked once. A path whose parents form a cycle is computed by `get_oid_path()`,
+        which avoids it. The paths are stored in the cache used by `get_oid_path()`, so later calls
+        for these OIDs (e.g. by `get_oid_info()`) are cache hits.
 
-        path = (oid,)
-        preceding_path += path
+        Arguments:
+        oids (Iterable[str]) -- OIDs or OID representations.
 
-        bref = self._get_best_back_reference(oid, forbidden=preceding_path)
+        Return (Dict[str, Tuple[str]]) -- OID paths by OID.
+        """
+        with profiling.timer('paths.get_oid_paths'):
+            targets = sorted({self.oid_or_repr_to_oid(o) for o in oids})
+            (nodes, indexes, parents) = self.get_parent_indexes(targets)
+            cache = self._oid_paths_cache
+            result = {}
+            for oid in targets:
+                path = cache.get(oid)
+                if not path:
+                    path = self._follow_parents(oid, nodes, indexes, parents)
+                result[oid] = path
+            return result
+
+    def get_parent_indexes(self, oids):
+        u"""Find the parents of objects in the containment tree, i.e. their best back reference
+        other than themselves, the first step of their OID paths, and the parents of the parents,
+        breadth-first. The back references of each object are scored once.
 
-        if not bref:
-            return path
+        Arguments:
+        oids (Iterable[str]) -- OIDs, without repetitions.
 
-        return (
-            path if (not bref)
-            else (path + self.get_oid_path(bref, preceding_path=preceding_path))
-        )
+        Return (Tuple[List[str], Dict[str, int], array]) -- The OIDs found, starting with `oids`,
+            their indexes in this list, and the index of the parent of each one, -1 for the
+            objects without back references.
+        """
+        nodes = list(oids)
+        indexes = {oid: i for (i, oid) in enumerate(nodes)}
+        parents = array('l')
+        with profiling.timer('paths.get_parent_indexes'):
+            # `nodes` is the queue of the breadth-first walk, iterated while it grows.
+            for oid in nodes:
+                parent = self._get_parent(oid)
+                if parent is None:
+                    parents.append(-1)
+                    continue
 
-    @instance.memoize
+                i = indexes.get(parent)
+                if i is None:
+                    i = indexes[parent] = len(nodes)
+                    nodes.append(parent)
+                parents.append(i)
+        return (nodes, indexes, parents)
+
+    @cached
     def get_id_path(self, oid):
         u"""Given an `oid` return an ID path.
 
@@ -308,23 +594,42 @@ class ZODBInfo(object):
 
     # OIDInfo --------------------------------------------------------------------------------------
 
-    @instance.memoize
-    def get_oid_info(self, oid):
+    def get_oid_info(self, oid, fields=None):
         u"""Try to get info about an object from its `oid`.
 
+        Only the selected fields are computed, so e.g. getting only the OID path never loads the
+        object (see `OID_INFO_FIELDS`).
+
         Arguments:
         oid (str) -- OID or OID representation.
+        fields (Optional[Iterable[str]]) -- Names of the fields to get, of `OID_INFO_FIELDS`. The
+            other fields are `None`, except `oid` which is always set. By default all of them.
 
         Return (OIDInfo)
         """
-        oid = self.oid_or_repr_to_oid(oid)
+        if fields is None:
+            fields = OID_INFO_FIELDS
+        fields = frozenset(fields)
+        unknown = fields.difference(OID_INFO_FIELDS)
+        if unknown:
+            raise ValueError('Unknown OIDInfo fields: {}'.format(', '.join(sorted(unknown))))
+
+        return self._get_oid_info(self.oid_or_repr_to_oid(oid), fields)
+
+    @cached
+    def _get_oid_info(self, oid, fields):
         info = OIDInfo(oid=self.oid_to_repr(oid))
         try:
-            info.obj = self.get_obj_as_str(oid)[:50]
-            info.oid_path = self.get_oid_path(oid)
-            info.id_path = self.get_id_path(oid)
-            info.id = self.get_id(oid)
-            info.path = self.get_physical_path(oid)
+            if 'obj' in fields:
+                info.obj = self.get_obj_as_str(oid)[:50]
+            if 'oid_path' in fields:
+                info.oid_path = self.get_oid_path(oid)
+            if 'id_path' in fields:
+                info.id_path = self.get_id_path(oid)
+            if 'id' in fields:
+                info.id = self.get_id(oid)
+            if 'path' in fields:
+                info.path = self.get_physical_path(oid)
         except POSKeyError:
             pass
 
@@ -340,46 +645,264 @@ class ZODBInfo(object):
 
     def get_oids_modified_by_last_transaction(self):
         """Return a sequence of OIDs modified by the last transaction."""
-        return list(self.iter_oids_modified_by_each_transaction())[-1]
+        index = self.get_transaction_index()
+        return self.get_oids_modified_by_transaction(index[-1]) if len(index) else []
+
+    def get_transaction_index(self):
+        u"""Get the index of the transactions, for random access to the transaction log.
+
+        The index is stored in the cache directory and updated with the transactions committed
+        since, see `.transactions`.
+
+        Return (TransactionIndex)
+        """
+        if self._transaction_index is None:
+            with profiling.timer('cache.transaction_index'):
+                self._transaction_index = open_transaction_index(
+                    self.storage,
+                    os.path.join(self._get_cache_dir(), self._TRANSACTION_INDEX_DIR_NAME),
+                )
+        return self._transaction_index
+
+    def get_reference_history(self):
+        u"""Get the index of the history of the references, to find the references of an object
+        at any transaction and when each one was added or removed.
+
+        The index is stored in the cache directory and updated with the transactions committed
+        since, see `.history`. Building it reads every record of the storage once.
+
+        Return (ReferenceHistory)
+        """
+        if self._reference_history is None:
+            with profiling.timer('cache.reference_history'):
+                self._reference_history = open_reference_history(
+                    self.storage,
+                    os.path.join(self._get_cache_dir(), self._REFERENCE_HISTORY_DIR_NAME),
+                )
+        return self._reference_history
+
+    def get_oids_modified_by_transaction(self, transaction):
+        u"""Get the OIDs modified by a transaction.
+
+        Arguments:
+        transaction (Union[TransactionInfo, str]) -- The transaction, from the transaction index,
+            or its id.
+
+        Return (List[str])
+        """
+        if not isinstance(transaction, TransactionInfo):
+            index = self.get_transaction_index()
+            i = index.find(transaction)
+            if i is None:
+                raise KeyError('Transaction not found: {}'.format(tid_repr(transaction)))
+            transaction = index[i]
+        return get_transaction_oids(self.storage, transaction)
+
+    # Result caches --------------------------------------------------------------------------------
+
+    def load_caches(self):
+        u"""Load the ids and attribute names stored by `store_caches()`.
+
+        Entries stored for an earlier transaction are loaded too, except the ones of the objects
+        modified since, found with the transaction index.
+
+        Return (int) -- Number of entries loaded.
+        """
+        found = self._find_names_cache()
+        if found is None:
+            return 0
+
+        (path, tid) = found
+        modified_oids = set()
+        if tid != self.connection.db().lastTransaction():
+            index = self.get_transaction_index()
+            for transaction in index.get_tid_range(start_tid=p64(u64(tid) + 1)):
+                modified_oids.update(self.get_oids_modified_by_transaction(transaction))
+
+        num_loaded = 0
+        with profiling.timer('cache.names.load'):
+            stored = read_cache_file(path)
+        for (name, entries) in stored.iteritems():
+            if name not in self._STORED_CACHES:
+                continue
+
+            cache = self.caches.get(name)
+            for (key, value) in entries:
+                if modified_oids.isdisjoint(key):
+                    cache[key] = value
+                    num_loaded += 1
+
+        self._logger.info('load_caches: Loaded {} entries from {}'.format(num_loaded, path))
+        return num_loaded
+
+    def store_caches(self):
+        u"""Store the ids and attribute names read by activating objects in the cache directory,
+        replacing the ones stored for earlier transactions.
+        """
+        last_tid = self.connection.db().lastTransaction()
+        path = os.path.join(
+            self._get_cache_dir(), '{}{}'.format(self._NAMES_CACHE_PREFIX, tid_repr(last_tid))
+        )
+        # Only text can be stored, ids are usually strings but `getId()` may return anything.
+        with profiling.timer('cache.names.store'):
+            write_cache_file(path, {
+                name: [(k, v) for (k, v) in self.caches.get(name).items() if _is_storable(v)]
+                for name in self._STORED_CACHES
+            })
+
+        found = self._find_names_cache(before=last_tid)
+        while found is not None:
+            os.remove(found[0])
+            found = self._find_names_cache(before=last_tid)
 
     # Blobs ----------------------------------------------------------------------------------------
 
     def blob_path_to_oid(self, path):
         return self.storage.fshelper.getOIDForPath(os.path.dirname(path))
 
+    def blob_path_to_tid(self, path):
+        u"""Return (str) the id of the transaction which wrote the blob file `path`."""
+        (_, tid) = self.storage.fshelper.splitBlobFilename(path)
+        return tid
+
     def iter_blob_paths(self):
-        for path in walkdir.file_paths(walkdir.filtered_walk(
-            self.storage.fshelper.base_dir,
-            included_files=['*.blob'],
-        )):
-            yield path
+        u"""Return (Iterator[str]) the paths of the blob files, walking the blob directory lazily
+        (see `.blobs.iter_blob_paths()`).
+        """
+        return iter_blob_paths(self.storage.fshelper.base_dir)
 
     # Internal -------------------------------------------------------------------------------------
 
-    @instance.memoize
+    def _load_record(self, oid):
+        u"""Return (str) the pickle of the current record of `oid`."""
+        with profiling.timer('storage.load'):
+            (p, _) = self.storage.load(oid)
+        profiling.count('storage.load.bytes', len(p))
+        return p
+
+    def _has_state_info(self):
+        u"""Return (bool) whether the graph holds the ids and attribute names of the objects."""
+        graph = self._graph
+        return (graph is not None) and graph.has_attribute('id') and (
+            graph.has_edge_attribute('attr_name')
+        )
+
+    def _get_id(self, oid):
+        if oid == self.root_oid:
+            return 'Root'
+
+        if self._has_state_info() and (oid in self._graph.oids):
+            return self._graph.get_attribute('id', oid)
+
+        return self._load_id(oid)
+
+    @cached
+    def _load_id(self, oid):
+        obj = self.get_obj(oid)
+        getId = getattr(obj, 'getId', None)
+        if getId:
+            try:
+                return getId()
+            except:  # noqa
+                pass
+        return getattr(obj, 'id', None)
+
+    def _get_attr_name(self, oid, parent_oid):
+        if self._has_state_info() and self._graph.has_reference(parent_oid, oid):
+            return self._graph.get_edge_attribute('attr_name', parent_oid, oid)
+
+        return self._load_attr_name(oid, parent_oid)
+
+    @cached
+    def _load_attr_name(self, oid, parent_oid):
+        obj = self.get_obj(oid)
+        parent = self.get_obj(parent_oid)
+        with profiling.timer('attr_name.dir_scan'):
+            names_and_values = ((name, getattr(parent, name, None)) for name in dir(parent))
+            return next((name for (name, value) in names_and_values if value is obj), None)
+
+    def _get_parent(self, target):
+        u"""Return (Optional[str]) the best back reference of `target` other than itself, like the
+        first one of `_get_sorted_back_references()` but without sorting them.
+        """
+        back_references = [br for br in self.get_back_references(target) if br != target]
+        if not back_references:
+            return None
+        return min(back_references, key=lambda br: self._get_reference_score(br, target))
+
+    def _follow_parents(self, oid, nodes, indexes, parents):
+        u"""Return (Tuple[str]) the OID path of `oid` like `get_oid_path()`, following the parents
+        found by `get_parent_indexes()` instead of sorting the back references.
+        """
+        cache = self._oid_paths_cache
+        path = [oid]
+        forbidden = {oid}
+        i = parents[indexes[oid]]
+        while i >= 0:
+            bref = nodes[i]
+            if bref in forbidden:
+                # `get_oid_path()` takes the next best back reference instead, to avoid the cycle.
+                return self.get_oid_path(oid)
+
+            cached_path = cache.get(bref)
+            if cached_path and set(cached_path).isdisjoint(forbidden):
+                path.extend(cached_path)
+                break
+
+            path.append(bref)
+            forbidden.add(bref)
+            i = parents[i]
+
+        path = tuple(path)
+        for j in xrange(len(path)):
+            # Do not overwrite existing entries in the cache, like `get_oid_path()`.
+            cache.setdefault(path[j], path[j:])
+        return path
+
     def _get_best_back_reference(self, target, forbidden=()):
+        return next(
+            (br for br in self._get_sorted_back_references(target) if br not in forbidden), None
+        )
 
-        def sort_key(back_reference):
-            return self._get_reference_score(
-                source=back_reference,
-                target=target,
-            )
+    @cached
+    def _get_sorted_back_references(self, target):
+        u"""Return (Tuple[str]) the back references of `target`, best score first."""
 
-        back_references = (br for br in self.get_back_references(target) if br not in forbidden)
-        sorted_back_references = sorted(back_references, key=sort_key)
+        def sort_key(back_reference):
+            return self._get_reference_score(back_reference, target)
 
-        return sorted_back_references[0] if sorted_back_references else None
+        return tuple(sorted(self.get_back_references(target), key=sort_key))
 
-    @instance.memoize
-    def _get_reference_score(self, source, target, allowed_look_ahead_depth=3):
+    @cached
+    def _get_reference_score(self, source, target):
         u"""Calculate a score for a reference.
 
         The score is an attempt to classify references to a target object in order
         to choose the most likely to be in the ideal OID path, i.e an OID path consisting
         of a chain of parent/child relationships (see class docstring for more info).
 
+        When the graph is built from scratch the scores of all references are computed and stored
+        in it (see `_store_reference_scores()`), so they are only computed here for graphs without
+        them, e.g. loaded from an old cache file.
+
         Return (int): Number from 0 to 100, lower is better.
         """
+        if self.graph.has_edge_attribute('score'):
+            score = self.graph.get_edge_attribute('score', source, target)
+            if score:
+                return score
+
+        return self._compute_reference_score(source, target, self._look_ahead_scores)
+
+    def _compute_reference_score(
+        self, source, target, look_ahead_scores, allowed_look_ahead_depth=3,
+    ):
+        u"""Compute the score of a reference, see `_get_reference_score()`.
+
+        Arguments:
+        look_ahead_scores (Dict[Tuple[str, int], int]) -- Cache of the best score of the back
+            references of an OID, by OID and look ahead depth.
+        """
 
         # WARNING: The code bellow is very fragile regarding the results it produces in achieving
         # optimal OID paths. It is based in empirical testing. Don't try to change without
@@ -390,11 +913,11 @@ class ZODBInfo(object):
         # to BTrees are good.
 
         # Avoid bidirectional references, i.e z3c.relationfield.relation.RelationValue objects.
-        if source in self.get_references(target):
+        if self.graph.has_reference(target, source):
             return 90
 
         # Prefer things with IDs, but avoid bad IDs.
-        identifier = self.get_id(source)
+        identifier = self._get_id(source)
         if identifier:
             if identifier == 'ldapauth':
                 return 20
@@ -404,7 +927,7 @@ class ZODBInfo(object):
                 return 10
 
         # Avoid things without attr name.
-        attr_name = self.get_attr_name(target, parent_oid=source)
+        attr_name = self._get_attr_name(target, parent_oid=source)
 
         # Bad attribute names.
         if attr_name in ('ids', 'refs', '_next'):
@@ -416,30 +939,57 @@ class ZODBInfo(object):
 
         if (not attr_name) or (attr_name == '_firstbucket'):
             if allowed_look_ahead_depth > 0:
-                next_ref_scores = [
-                    (
-                        bbr,
-                        self._get_reference_score(
+                key = (source, allowed_look_ahead_depth - 1)
+                if key not in look_ahead_scores:
+                    look_ahead_scores[key] = min([
+                        self._compute_reference_score(
                             source=bbr,
                             target=source,
-                            allowed_look_ahead_depth=allowed_look_ahead_depth - 1
+                            look_ahead_scores=look_ahead_scores,
+                            allowed_look_ahead_depth=allowed_look_ahead_depth - 1,
                         )
-                    )
-                    for bbr
-                    in self.get_back_references(source)
-                ]
-                if next_ref_scores:
-                    next_ref_scores.sort(key=lambda x: x[1])
-                    (ref, score) = next_ref_scores[0]
-                    if score <= 50:
-                        return 30
+                        for bbr
+                        in self.get_back_references(source)
+                    ] or [None])
+                score = look_ahead_scores[key]
+                if (score is not None) and (score <= 50):
+                    return 30
 
             return 70  # Default score for refs without attr name.
 
         # Default score.
         return 50
 
-    @instance.memoize
+    def _store_reference_scores(self, edges=None):
+        u"""Compute the scores of the references and store them in the graph, as the `score` edge
+        attribute.
+
+        Only done when the graph holds the ids and attribute names, so no object is activated.
+
+        Arguments:
+        edges (Optional[Iterable[Tuple[str, str]]]) -- Only compute the scores of these
+            `(source, target)` references, the other references keep their scores. All the scores
+            are computed by default.
+        """
+        if not self._has_state_info():
+            return
+
+        look_ahead_scores = {}
+        graph = self._graph
+        if edges is None:
+            scores = (
+                self._compute_reference_score(source, target, look_ahead_scores)
+                for (source, target) in graph.iter_edges()
+            )
+            self._graph = graph.with_edge_attribute('score', values=scores)
+        else:
+            scores = {
+                (source, target): self._compute_reference_score(source, target, look_ahead_scores)
+                for (source, target) in edges
+            }
+            self._graph = graph.with_edge_attribute('score', updates=scores)
+
+    @cached
     def _oid_path_to_id_path(self, oid_path):
         result = tuple(
             self.get_id_or_attr_name(child, parent_oid=parent)
@@ -450,59 +1000,343 @@ class ZODBInfo(object):
         self._logger.info('_oid_path_to_id_path: {}'.format(result))
 
     def _build_reference_maps_from_scratch(self):
-        self._reference_map = {}
-        self._back_reference_map = {}
-        self._oids = set()
+        builder = make_graph_builder(compact=self.compact_graph)
+        if self.engine == ENGINE_SCAN:
+            self._build_reference_maps_by_scanning(builder)
+            return
+
+        if self.workers > 1:
+            storage_opener = self.storage_opener or StorageOpener.for_storage(self.storage)
+            stats = build_graph_in_parallel(builder, self.root_oid, storage_opener, self.workers)
+            profiling.count('graph.records', stats.records)
+            self._graph = builder.build()
+            return
+
+        stats = BuildStats(workers=1)
+        visited = set()
         next_oids = {self.root_oid}
 
         while next_oids:
             current_oid = next_oids.pop()
-            if current_oid in self._oids:
+            if current_oid in visited:
                 continue
 
-            self._oids.add(current_oid)
+            visited.add(current_oid)
 
-            (p, _) = self.storage.load(current_oid)
-            refs = set(referencesf(p))
-            if not refs:
+            try:
+                p = self._load_record(current_oid)
+            except POSKeyError:
+                # A dangling reference, see `.dangling`. The OID stays in the graph, without a
+                # record.
+                stats.missing += 1
                 continue
+            refs = _add_record(builder, current_oid, p)
+            next_oids.update(refs)
 
-            if current_oid in self._reference_map:
-                raise RuntimeError(
-                    'OID {} already in reference map!'.format(self.oid_to_repr(current_oid))
-                )
+            stats.records += 1
+            stats.references += len(refs)
+            stats.log_progress()
 
-            next_oids.update(refs)
-            self._reference_map[current_oid] = refs
-            for r in refs:
-                self._back_reference_map.setdefault(r, set()).add(current_oid)
+        stats.log_progress(force=True)
+        self._graph = builder.build()
+
+    def _update_reference_maps_from_previous_cache(self, cache_path):
+        previous = self._find_previous_reference_cache()
+        if not previous:
+            return
+
+        (previous_path, previous_tid) = previous
+        if not has_transaction(self.storage, previous_tid):
+            # E.g. the database was replaced by another one with the same file name.
+            self._logger.warning(
+                'build_reference_maps: Ignoring cache file of a transaction which is not in the '
+                'storage: {}'.format(previous_path)
+            )
+            return
+
+        self._logger.info(
+            'build_reference_maps: Updating maps from previous cache file {}...'.format(
+                previous_path)
+        )
+        try:
+            self._load_reference_cache(previous_path)
+        except GraphFileError as e:
+            self._logger.warning('build_reference_maps: Ignoring cache file: {}'.format(e))
+            return
+
+        self._update_reference_maps(start=p64(u64(previous_tid) + 1))
+
+        self._logger.info('build_reference_maps: Storing reference cache to file...')
+        self._store_reference_cache(cache_path)
+        self._serve_stored_reference_cache(cache_path)
+        os.remove(previous_path)
+
+    def _update_reference_maps(self, start):
+        u"""Patch the reference maps with the records of the transactions starting at `start`."""
+        graph = to_compact(self._graph)
+        updates = {}
+        attributes = {name: {} for name in _RECORD_ATTRIBUTES}
+        attr_names = {}
+
+        def read_record(oid, p):
+            (refs, record_attributes, record_attr_names) = get_record_info(p)
+            for (name, value) in record_attributes.iteritems():
+                attributes[name][oid] = value
+            attr_names[oid] = record_attr_names
+            updates[oid] = refs
+            return refs
+
+        num_transactions = 0
+        for transaction in self.storage.iterator(start=start):
+            num_transactions += 1
+            for record in transaction:
+                read_record(record.oid, record.data)
+
+        self._logger.info(
+            '_update_reference_maps: {} transactions, {} modified objects.'.format(
+                num_transactions, len(updates))
+        )
+
+        # Newly referenced objects which are not in the graph yet, nor modified, must be loaded.
+        referenced = set()
+        for refs in updates.itervalues():
+            referenced.update(refs)
+        next_oids = {r for r in referenced if (r not in updates) and (r not in graph.oids)}
+        while next_oids:
+            current_oid = next_oids.pop()
+            try:
+                p = self._load_record(current_oid)
+            except POSKeyError:
+                p = None
+            refs = read_record(current_oid, p)
+            referenced.update(refs)
+            next_oids.update(r for r in refs if (r not in updates) and (r not in graph.oids))
+
+        # Skip new objects which are not referenced by anything, unless all objects are included,
+        # e.g. an object added and unlinked again. Their attributes are skipped too.
+        if self.engine != ENGINE_SCAN:
+            updates = {
+                oid: refs for (oid, refs) in updates.iteritems()
+                if (oid in referenced) or (oid in graph.oids)
+            }
+            attributes = {
+                name: {oid: v for (oid, v) in values.iteritems() if oid in updates}
+                for (name, values) in attributes.iteritems()
+            }
+            attr_names = {oid: v for (oid, v) in attr_names.iteritems() if oid in updates}
+        self._graph = graph.patched(
+            updates, attributes=attributes, edge_attributes={'attr_name': attr_names},
+        )
+        if graph.has_edge_attribute('score'):
+            self._store_reference_scores(edges=self._get_edges_to_rescore(graph, updates))
+
+    def _get_edges_to_rescore(self, old_graph, updates):
+        u"""Return (Set[Tuple[str, str]]) the references whose score may be changed by `updates`.
+
+        The score of a reference depends on its source and target, and on the back references of
+        the source up to the look ahead depth of `_compute_reference_score()`. So the references
+        of the objects up to that depth from a changed object, or from an object whose back
+        references changed, must be scored again, as well as the references to changed objects.
+        """
+        changed = set(updates)
+        for (oid, refs) in updates.iteritems():
+            changed.update(refs)
+            changed.update(old_graph.get_references(oid))
+
+        sources = set(changed)
+        next_oids = changed
+        for _ in xrange(3):
+            next_oids = {
+                r for oid in next_oids for r in self._graph.get_references(oid)
+                if r not in sources
+            }
+            sources.update(next_oids)
+
+        edges = {
+            (source, target) for source in sources for target in self._graph.get_references(source)
+        }
+        edges.update(
+            (source, oid) for oid in updates for source in self._graph.get_back_references(oid)
+        )
+        return edges
+
+    def _build_reference_maps_by_scanning(self, builder):
+        if not is_file_storage(self.storage):
+            raise RuntimeError(
+                'The {} engine only supports FileStorage.'.format(ENGINE_SCAN)
+            )
+
+        stats = BuildStats(workers=1)
+        for (oid, p) in iter_current_records(self.storage):
+            refs = _add_record(builder, oid, p)
+            stats.records += 1
+            stats.references += len(refs)
+            stats.log_progress()
+
+        stats.log_progress(force=True)
+        self._graph = builder.build()
+
+    def _get_cache_dir(self):
+        u"""Return (str) the directory of the cache files of this database.
+
+        Each storage gets its own directory, so caches of different databases are never mixed.
+        """
+        storage_key = hashlib.sha1(self.storage.getName()).hexdigest()[:16]
+        return os.path.join(
+            os.path.expanduser('~'), '.cache', PACKAGE_NAME, 'storage_' + storage_key
+        )
+
+    def _get_reference_cache_dir(self):
+        return self._get_cache_dir()
 
     def _get_reference_cache_path(self):
-        cache_dir = os.path.join(os.path.expanduser('~'), '.cache', PACKAGE_NAME)
         last_tid = tid_repr(self.connection.db().lastTransaction())
-        return os.path.join(cache_dir, 'zodb_references_{}'.format(last_tid))
+        return os.path.join(
+            self._get_reference_cache_dir(),
+            '{}{}'.format(self._REFERENCE_CACHE_PREFIXES[self.engine], last_tid)
+        )
+
+    def _move_legacy_reference_cache(self, cache_path):
+        u"""Up to version 0.0.1 the cache files of all databases were stored in the same directory.
+        Move a cache file for the last transaction from there.
+        """
+        legacy_path = os.path.join(
+            os.path.dirname(self._get_cache_dir()), os.path.basename(cache_path)
+        )
+        if (self.engine == ENGINE_TRAVERSE) and os.path.isfile(legacy_path) and (
+            not os.path.exists(cache_path)
+        ):
+            self._logger.info(
+                'build_reference_maps: Moving cache file from {}...'.format(legacy_path)
+            )
+            mkdirp(os.path.dirname(cache_path))
+            os.rename(legacy_path, cache_path)
+
+    def _find_previous_reference_cache(self):
+        u"""Find the cache file of the most recent transaction before the last one.
+
+        Return (Optional[Tuple[str, str]]) -- `(path, tid)` or `None` if no cache file is found.
+        """
+        return self._find_cache_file(
+            self._get_reference_cache_dir(),
+            self._REFERENCE_CACHE_PREFIXES[self.engine],
+            self.connection.db().lastTransaction(),
+        )
+
+    def _find_names_cache(self, before=None):
+        u"""Find the file stored by `store_caches()` for the most recent transaction up to the last
+        one, or before `before`.
+        """
+        if before is None:
+            before = p64(u64(self.connection.db().lastTransaction()) + 1)
+        return self._find_cache_file(self._get_cache_dir(), self._NAMES_CACHE_PREFIX, before)
+
+    def _find_cache_file(self, cache_dir, prefix, before):
+        u"""Find the cache file named `prefix` and the most recent transaction before `before`.
+
+        Return (Optional[Tuple[str, str]]) -- `(path, tid)` or `None` if no cache file is found.
+        """
+        if not os.path.isdir(cache_dir):
+            return None
+
+        name_re = re.compile('^{}(0x[0-9a-f]+)$'.format(re.escape(prefix)))
+        candidates = []
+        for name in os.listdir(cache_dir):
+            match = name_re.match(name)
+            if not match:
+                continue
+            tid = repr_to_oid(match.group(1))
+            if tid < before:
+                candidates.append((tid, os.path.join(cache_dir, name)))
+
+        if not candidates:
+            return None
+
+        (tid, path) = max(candidates)
+        return (path, tid)
+
+    def _open_reference_cache(self, path):
+        with profiling.timer('cache.references.open'):
+            return CompactReferenceGraph.from_sections(read_sections(path))
 
     def _load_reference_cache(self, path):
-        self._reference_map = {}
-        self._back_reference_map = {}
+        if is_graph_file(path):
+            self._graph = self._open_reference_cache(path)
+            return
+
+        self._logger.info('build_reference_maps: Upgrading text cache file to binary format...')
+        self._load_text_reference_cache(path)
+        self._store_reference_cache(path)
+        self._serve_stored_reference_cache(path)
+
+    def _serve_stored_reference_cache(self, path):
+        u"""Serve the graph just stored in the cache file `path` from the memory-mapped file if
+        `compact_graph` is true, otherwise from dicts of sets, whose lookups are much faster.
+        """
+        if self.compact_graph:
+            self._graph = self._open_reference_cache(path)
+        else:
+            self._graph = to_reference_maps(self._graph)
+
+    def _load_text_reference_cache(self, path):
+        u"""Load a cache file in the format used up to version 0.0.1: one "source target" line,
+        with OID representations, for each reference.
+        """
+        builder = make_graph_builder(compact=self.compact_graph)
         with open(path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                (source, target) = (self.repr_to_oid(r) for r in line.split())
-                self._reference_map.setdefault(source, set()).add(target)
-                self._back_reference_map.setdefault(target, set()).add(source)
-        self._oids = set(self._reference_map)
-        self._oids.update(self._back_reference_map)
+            lines = itertools.ifilter(None, (line.split() for line in f))
+            edges = ((self.repr_to_oid(s), self.repr_to_oid(t)) for (s, t) in lines)
+            # Lines are sorted by source OID.
+            for (source, group) in itertools.groupby(edges, key=lambda e: e[0]):
+                builder.add_references(source, (t for (_, t) in group))
+        self._graph = builder.build()
 
     def _store_reference_cache(self, path):
         mkdirp(os.path.dirname(path))
-        with open(path, 'w') as f:
-            for (source, targets) in sorted(self.reference_map.iteritems(), key=lambda i: i[0]):
-                source_repr = self.oid_to_repr(source)
-                for target in sorted(targets):
-                    f.write('{} {}\n'.format(source_repr, self.oid_to_repr(target)))
+        with profiling.timer('cache.references.store'):
+            write_sections(path, to_compact(self.graph).sections())
+
+
+def _is_storable(value):
+    return (value is None) or isinstance(value, basestring)
+
+
+# Node attributes read from each record, see `get_record_info()`.
+_RECORD_ATTRIBUTES = ('size', 'class_name', 'id', 'xrefs')
+
+
+def get_record_info(p):
+    u"""Read a record without unpickling it.
+
+    Arguments:
+    p (Optional[str]) -- Pickle of the record, `None` if the object was deleted.
+
+    Return (Tuple[Set[str], Dict[str, Union[int, str]], Dict[str, str]]) -- The referenced OIDs,
+        the node attributes of the record (see `_RECORD_ATTRIBUTES`) and the name of the attribute
+        holding each referenced OID.
+    """
+    if not p:
+        return (set(), {'size': 0, 'class_name': '', 'id': '', 'xrefs': ''}, {})
+
+    profiling.count('state.bytes', len(p))
+    with profiling.timer('state.read'):
+        class_name = get_class_name(p)
+        (refs, identifier, attr_names, external_refs) = get_state_info(p, class_name)
+    attributes = {
+        'size': len(p),
+        'class_name': class_name,
+        'id': identifier or '',
+        'xrefs': encode_external_references(external_refs),
+    }
+    return (set(refs), attributes, attr_names)
+
+
+def _add_record(builder, oid, p):
+    u"""Add a record to a graph builder. Return (Set[str]) the referenced OIDs."""
+    (refs, attributes, attr_names) = get_record_info(p)
+    builder.add_references(oid, refs, edge_attributes={'attr_name': attr_names}, **attributes)
+    profiling.count('graph.records')
+    return refs
 
 
 @case
@@ -520,9 +1354,25 @@ class OIDInfo(object):
         pass
 
     def __str__(self):
+        return self.to_str()
+
+    def to_str(self, fields=None):
+        u"""Return (str) the fields named in `fields`, by default all of them, one per line."""
+        return '\n'.join(
+            '{}: {}'.format(k, v) for (k, v) in self.as_str_dict(fields).iteritems()
+        )
+
+    def as_str_dict(self, fields=None):
+        u"""Return (OrderedDict) the fields as printed by `__str__()`, e.g. paths as strings.
+
+        Arguments:
+        fields (Optional[Container[str]]) -- Names of the fields, by default all of them.
+        """
         # `as_dict()` returns an OrderedDict.
-        parts = ((k, self._field_to_str(k, v)) for (k, v) in self.as_dict().iteritems())
-        return '\n'.join('{}: {}'.format(k, v) for (k, v) in parts)
+        return collections.OrderedDict(
+            (k, self._field_to_str(k, v)) for (k, v) in self.as_dict().iteritems()
+            if (fields is None) or (k in fields)
+        )
 
     def __unicode__(self):
         return self.__str__().decode('utf8')
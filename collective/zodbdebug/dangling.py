@@ -0,0 +1,104 @@
+# coding=utf8
+u"""Find the references to objects which have no current record.
+
+Loading such an object raises a `POSKeyError`. The reference graph is built anyway: an OID whose
+record cannot be loaded stays in the graph as the target of its back references, without a record
+of its own, so its size is 0 (see `.core.ZODBInfo.build_reference_maps()`). These OIDs are the
+candidates, and only them are loaded again to confirm that their record is missing, since the
+graph may be a cache built before the record was e.g. removed by undoing its transaction.
+
+With `check_all=True` every OID of the graph is checked instead, for graphs without sizes or when
+the cache cannot be trusted, e.g. after a pack. The OIDs are checked in worker processes over
+ranges of OIDs when `ZODBInfo` has more than one worker (see `.parallel.find_missing_records()`).
+
+With `with_history=True` the reference history (see `.history`) tells the first transaction in
+which each dangling reference was made: the record was missing in it or was removed later.
+"""
+from . import profiling
+from .parallel import StorageOpener
+from .parallel import find_missing_records
+from ZODB.POSException import POSKeyError
+from logging import getLogger
+from rbco.caseclasses import case
+
+log = getLogger(__name__)
+
+
+def get_missing_oids(zodb_info, check_all=False):
+    u"""Get the OIDs in the reference graph which have no current record.
+
+    Arguments:
+    zodb_info (ZODBInfo) -- With the reference maps built.
+    check_all (bool) -- Check every OID, not only the OIDs without a record in the graph.
+
+    Return (List[str]) -- The missing OIDs, sorted.
+    """
+    graph = zodb_info.graph
+    if check_all or not graph.has_attribute('size'):
+        candidates = list(graph.oids)
+    else:
+        candidates = [oid for (oid, size) in graph.iter_attributes('size') if not size]
+    log.info('Checking the records of {} objects...'.format(len(candidates)))
+
+    with profiling.timer('dangling.check'):
+        if (zodb_info.workers > 1) and (len(candidates) > 1):
+            storage_opener = zodb_info.storage_opener or StorageOpener.for_storage(
+                zodb_info.storage
+            )
+            return find_missing_records(candidates, storage_opener, zodb_info.workers)
+
+        missing = []
+        for oid in sorted(candidates):
+            try:
+                zodb_info.storage.load(oid)
+            except POSKeyError:
+                missing.append(oid)
+        return missing
+
+
+def get_dangling_references(zodb_info, check_all=False, with_history=False):
+    u"""Get the references to objects which have no current record.
+
+    Arguments:
+    zodb_info (ZODBInfo) -- With the reference maps built.
+    check_all (bool) -- See `get_missing_oids()`.
+    with_history (bool) -- Find the first transaction of each reference in the reference history,
+        which is built on first use.
+
+    Return (List[DanglingReference]) -- Sorted by target, then source.
+    """
+    missing = get_missing_oids(zodb_info, check_all=check_all)
+    history = zodb_info.get_reference_history() if (with_history and missing) else None
+
+    result = []
+    for target in missing:
+        for source in sorted(zodb_info.get_back_references(target)):
+            result.append(DanglingReference(
+                source=source,
+                target=target,
+                class_name=zodb_info.get_class_name(source),
+                attr_name=_get_attr_name(zodb_info, target, source),
+                first_tid=history.get_first_reference_tid(source, target) if history else None,
+            ))
+    return result
+
+
+def _get_attr_name(zodb_info, target, source):
+    # Without the attribute names in the graph the target is loaded, which fails.
+    try:
+        return zodb_info.get_attr_name(target, source)
+    except POSKeyError:
+        return None
+
+
+@case
+class DanglingReference(object):
+    u"""Reference from `source` to `target`, which has no current record.
+
+    `class_name` is the class of `source` and `attr_name` the name of its attribute holding the
+    reference, if known. `first_tid` is the first transaction in which `source` referenced
+    `target`, if the reference history was used.
+    """
+
+    def __init__(self, source, target, class_name=None, attr_name=None, first_tid=None):
+        pass
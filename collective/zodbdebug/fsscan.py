@@ -0,0 +1,142 @@
+# coding=utf8
+u"""Read the current revision of every object of a `FileStorage` in one sequential pass.
+
+Building the reference graph by traversal makes a random access `storage.load()` for each object.
+On a `FileStorage` this means an index lookup and a seek per record. This module streams `Data.fs`
+from front to back with large buffered reads instead. A data record is the current revision of its
+object when the storage index points to it, so old revisions are skipped without keeping any
+extra state.
+
+Since every stored object is seen, not only the reachable ones, a graph built this way also
+contains the objects which are not reachable from the root.
+
+`iter_transaction_headers()` reads only the headers of the transactions and of their data
+records, seeking over the pickles, to index the transactions (see `.transactions`).
+"""
+from ZODB.FileStorage.format import DATA_HDR
+from ZODB.FileStorage.format import DATA_HDR_LEN
+from ZODB.FileStorage.format import TRANS_HDR
+from ZODB.FileStorage.format import TRANS_HDR_LEN
+import struct
+
+DEFAULT_BUFFER_SIZE = 16 * 1024 * 1024
+
+# Status of a transaction which is not committed yet.
+_CHECKPOINT_STATUS = 'c'
+
+_TRANS_HDR = struct.Struct(TRANS_HDR)
+_DATA_HDR = struct.Struct(DATA_HDR)
+
+
+def is_file_storage(storage):
+    u"""Return (bool) whether `storage` can be read by `iter_current_records()`."""
+    return all(hasattr(storage, a) for a in ('_file_name', '_index', '_pos'))
+
+
+def iter_current_records(storage, buffer_size=DEFAULT_BUFFER_SIZE):
+    u"""Iterate over the current revision of each object, in file order.
+
+    Objects whose creation was undone have no current revision and are skipped.
+
+    Arguments:
+    storage (ZODB.FileStorage.FileStorage) -- The storage.
+    buffer_size (int) -- Size of the read buffer.
+
+    Return (Iterator[Tuple[str, str]]) -- `(oid, pickle)` pairs.
+    """
+    if not is_file_storage(storage):
+        raise ValueError('Not a FileStorage: {}'.format(type(storage).__name__))
+
+    index = storage._index
+    end = storage._pos
+    pos = storage._metadata_size
+
+    with open(storage._file_name, 'rb', buffer_size) as f:
+        f.read(pos)
+        while pos < end:
+            (_, tlen, status, ulen, dlen, elen) = _TRANS_HDR.unpack(f.read(TRANS_HDR_LEN))
+            if status == _CHECKPOINT_STATUS:
+                break
+
+            tend = pos + tlen
+            record_pos = pos + TRANS_HDR_LEN + ulen + dlen + elen
+            f.read(ulen + dlen + elen)
+
+            while record_pos < tend:
+                (oid, _, _, _, vlen, plen) = _DATA_HDR.unpack(f.read(DATA_HDR_LEN))
+                if vlen:
+                    raise ValueError(
+                        'Records with versions are not supported (position {}).'.format(
+                            record_pos)
+                    )
+
+                # Without a pickle the record has a back pointer instead.
+                data = f.read(plen) if plen else None
+                back = None if plen else f.read(8)
+
+                if index.get(oid) == record_pos:
+                    if data is not None:
+                        yield (oid, data)
+                    elif back != '\0' * 8:
+                        # Undo or copy of an earlier revision: rare, let the storage follow it.
+                        yield (oid, storage.load(oid)[0])
+
+                record_pos += DATA_HDR_LEN + (plen or 8)
+
+            # Redundant transaction length.
+            f.read(8)
+            pos = tend + 8
+
+
+def iter_transaction_headers(storage, pos=None):
+    u"""Iterate over the committed transactions, in file order, without reading the pickles.
+
+    Arguments:
+    storage (ZODB.FileStorage.FileStorage) -- The storage.
+    pos (Optional[int]) -- Position of the first transaction, the first one in the file by
+        default.
+
+    Return (Iterator[Tuple[int, str, int, str, str, int]]) -- `(position, tid, length, user,
+        description, number of records)` tuples. The length includes the header but not the
+        redundant length after the transaction.
+    """
+    if not is_file_storage(storage):
+        raise ValueError('Not a FileStorage: {}'.format(type(storage).__name__))
+
+    end = storage._pos
+    if pos is None:
+        pos = storage._metadata_size
+
+    with open(storage._file_name, 'rb') as f:
+        while pos < end:
+            f.seek(pos)
+            (tid, tlen, status, ulen, dlen, elen) = _TRANS_HDR.unpack(f.read(TRANS_HDR_LEN))
+            if status == _CHECKPOINT_STATUS:
+                break
+
+            user = f.read(ulen)
+            description = f.read(dlen)
+            tend = pos + tlen
+            record_pos = pos + TRANS_HDR_LEN + ulen + dlen + elen
+            num_records = 0
+            while record_pos < tend:
+                f.seek(record_pos)
+                (_, _, _, _, vlen, plen) = _DATA_HDR.unpack(f.read(DATA_HDR_LEN))
+                num_records += 1
+                # Records written with versions by old ZODB versions have two more pointers.
+                record_pos += DATA_HDR_LEN + ((16 + vlen) if vlen else 0) + (plen or 8)
+
+            yield (pos, tid, tlen, user, description, num_records)
+            pos = tend + 8
+
+
+def read_transaction_id(storage, pos):
+    u"""Return (Optional[str]) the id of the transaction at `pos`, `None` if there is none."""
+    if not (storage._metadata_size <= pos < storage._pos):
+        return None
+    with open(storage._file_name, 'rb') as f:
+        f.seek(pos)
+        header = f.read(TRANS_HDR_LEN)
+    if len(header) < TRANS_HDR_LEN:
+        return None
+    return _TRANS_HDR.unpack(header)[0]
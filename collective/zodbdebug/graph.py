@@ -0,0 +1,1118 @@
+# coding=utf8
+u"""Reference graph backends used by `ZODBInfo`.
+
+Two backends are provided, both exposing the same read-only interface (`oids`,
+`get_references()`, `get_back_references()`, `reference_map`, `back_reference_map`):
+
+- `ReferenceMaps`: the original dict-of-sets representation. Simple, but every OID and every edge
+  is a Python object, which costs well over 100 bytes per edge.
+
+- `CompactReferenceGraph`: OIDs are packed into 64-bit integers and kept in a sorted array. Edges
+  are stored in CSR ("compressed sparse row") form: for the node at index `i` the referenced nodes
+  are `targets[offsets[i]:offsets[i + 1]]`, where `targets` holds 32-bit node indexes. The reverse
+  edges are stored the same way. This costs about 8 bytes per node and 8 bytes per edge (4 for
+  each direction).
+
+Graphs are immutable. They are created using a builder (see `make_graph_builder()`).
+
+Node attributes:
+    Besides the references, an unsigned integer can be stored for each OID under a name listed in
+    `NODE_ATTRIBUTES`, e.g. the size of its record. An attribute is only kept when it is given for
+    every OID added to the builder.
+
+Edge attributes:
+    Likewise, a value can be stored for each reference under a name listed in `EDGE_ATTRIBUTES`,
+    e.g. the name of the attribute holding the reference. `CompactReferenceGraph` stores them in
+    arrays parallel to the forward edges.
+
+String attributes:
+    The values of the attributes listed in `STRING_ATTRIBUTES` are strings, e.g. class names.
+    `CompactReferenceGraph` stores the strings in a `StringTable` and an index in this table for
+    each OID or reference. Both backends share equal strings, so e.g. the class names form an
+    index of the OIDs by class, see `get_attribute_counts()` and `find_oids_by_attribute()`.
+"""
+from .util import pairwise
+from ZODB.utils import oid_repr
+from ZODB.utils import p64
+from ZODB.utils import u64
+from array import array
+from bisect import bisect_left
+import binascii
+import collections
+import itertools
+import sys
+
+UINT64_TYPECODE = 'L' if array('L').itemsize == 8 else 'Q'
+UINT32_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+UINT8_TYPECODE = 'B'
+
+_EMPTY_FROZENSET = frozenset()
+
+# Name and array typecode of each node attribute.
+NODE_ATTRIBUTES = {
+    'size': UINT32_TYPECODE,  # Size of the record pickle, in bytes.
+    'class_name': UINT32_TYPECODE,  # Dotted name of the class of the object.
+    'id': UINT32_TYPECODE,  # Id of the object, read from its state.
+    # References to objects of other databases, see `encode_external_references()`.
+    'xrefs': UINT32_TYPECODE,
+}
+
+# Name and array typecode of each edge attribute.
+EDGE_ATTRIBUTES = {
+    'attr_name': UINT32_TYPECODE,  # Name of the attribute of the source holding the target.
+    'score': UINT8_TYPECODE,  # Score of the reference, see `ZODBInfo._get_reference_score()`.
+}
+
+# Attributes whose values are strings.
+STRING_ATTRIBUTES = frozenset(['class_name', 'id', 'attr_name', 'xrefs'])
+
+
+def make_graph_builder(compact=False):
+    u"""Return a new builder for a reference graph.
+
+    Arguments:
+    compact (bool) -- If true build a `CompactReferenceGraph`, otherwise build `ReferenceMaps`.
+
+    Return (Union[ReferenceMapsBuilder, CompactReferenceGraphBuilder])
+    """
+    return CompactReferenceGraphBuilder() if compact else ReferenceMapsBuilder()
+
+
+def encode_external_references(refs):
+    u"""Encode references to objects of other databases as the `xrefs` node attribute.
+
+    Arguments:
+    refs (Iterable[Tuple[str, str]]) -- `(database name, OID)` pairs.
+
+    Return (str) -- A `<database name>:<OID in hexadecimal>` line per reference, sorted. Empty if
+        there are none, so most OIDs share the same string.
+    """
+    return '\n'.join(sorted(
+        '{}:{}'.format(_to_str(name), binascii.hexlify(oid)) for (name, oid) in set(refs)
+    ))
+
+
+def decode_external_references(value):
+    u"""Inverse of `encode_external_references()`. Return (Set[Tuple[str, str]])"""
+    if not value:
+        return set()
+    pairs = (line.rpartition(':') for line in value.split('\n'))
+    return {(name, binascii.unhexlify(oid_hex)) for (name, _, oid_hex) in pairs}
+
+
+def _to_str(value):
+    u"""Strings are stored UTF-8 encoded."""
+    return value.encode('utf8') if isinstance(value, unicode) else value
+
+
+# Dict of sets ------------------------------------------------------------------------------------
+
+class ReferenceMapsBuilder(object):
+    u"""Build a `ReferenceMaps` graph.
+
+    Each OID must be added only once, along with all the OIDs it references.
+    """
+
+    def __init__(self):
+        self._oids = set()
+        self._reference_map = {}
+        self._back_reference_map = {}
+        self._attributes = {name: {} for name in NODE_ATTRIBUTES}
+        self._edge_attributes = {name: {} for name in EDGE_ATTRIBUTES}
+        self._edge_attribute_records = dict.fromkeys(EDGE_ATTRIBUTES, 0)
+        self._strings = {}
+
+    def add_references(self, oid, refs, edge_attributes=None, **attributes):
+        u"""Add an `oid` and the OIDs referenced by it.
+
+        Arguments:
+        oid (str) -- OID.
+        refs (Iterable[str]) -- Referenced OIDs.
+        edge_attributes (Optional[Mapping[str, Mapping[str, Union[int, str]]]]) -- Edge attributes
+            of the references, by attribute name and referenced OID. See `EDGE_ATTRIBUTES`.
+        attributes (Union[int, str]) -- Node attributes of `oid`, see `NODE_ATTRIBUTES`.
+        """
+        if oid in self._reference_map:
+            raise RuntimeError('OID {} already in reference map!'.format(oid_repr(oid)))
+
+        self._oids.add(oid)
+        for (name, value) in attributes.iteritems():
+            self._attributes[name][oid] = self._share(name, value)
+
+        refs = set(refs)
+        for (name, values) in (edge_attributes or {}).iteritems():
+            self._edge_attribute_records[name] += 1
+            edge_values = self._edge_attributes[name]
+            for r in refs:
+                value = values.get(r)
+                if value:
+                    edge_values[(oid, r)] = self._share(name, value)
+
+        if not refs:
+            return
+
+        self._reference_map[oid] = refs
+        for r in refs:
+            self._back_reference_map.setdefault(r, set()).add(oid)
+
+    def build(self):
+        u"""Return (ReferenceMaps)"""
+        num_records = len(self._oids)
+        attributes = {
+            name: values for (name, values) in self._attributes.iteritems()
+            if len(values) == num_records
+        }
+        edge_attributes = {
+            name: values for (name, values) in self._edge_attributes.iteritems()
+            if self._edge_attribute_records[name] == num_records
+        }
+        self._oids.update(self._back_reference_map)
+        return ReferenceMaps(
+            self._oids, self._reference_map, self._back_reference_map, attributes,
+            edge_attributes,
+        )
+
+    def _share(self, name, value):
+        if name not in STRING_ATTRIBUTES:
+            return value
+        value = _to_str(value)
+        return self._strings.setdefault(value, value)
+
+
+class ReferenceMaps(object):
+    u"""Reference graph stored as Python dicts of sets of OIDs.
+
+    Edge attributes are stored in dicts keyed by `(source, target)` pairs.
+    """
+
+    def __init__(
+        self, oids, reference_map, back_reference_map, attributes=None, edge_attributes=None,
+    ):
+        self.oids = oids
+        self.reference_map = reference_map
+        self.back_reference_map = back_reference_map
+        self.attributes = attributes or {}
+        self.edge_attributes = edge_attributes or {}
+
+    def has_attribute(self, name):
+        return name in self.attributes
+
+    def get_attribute(self, name, oid):
+        u"""Return (Optional[Union[int, str]]) The node attribute `name` of `oid`, `None` if not
+        available.
+        """
+        value = self.attributes.get(name, {}).get(oid)
+        if (name in STRING_ATTRIBUTES) and (not value):
+            return None
+        return value
+
+    def iter_attributes(self, *names):
+        u"""Return (Iterator[Tuple]) `(oid, value, ...)` tuples with the node attributes `names`
+        of every OID, in no particular order. Missing values are `None`.
+        """
+        for oid in self.oids:
+            yield (oid,) + tuple(self.get_attribute(name, oid) for name in names)
+
+    def get_attribute_counts(self, name):
+        u"""Return (Dict[Union[int, str], int]) the number of OIDs with each value of the node
+        attribute `name`. OIDs without a value, 0 or the empty string, are not counted.
+        """
+        counts = collections.Counter(self.attributes.get(name, {}).itervalues())
+        counts.pop('' if (name in STRING_ATTRIBUTES) else 0, None)
+        return dict(counts)
+
+    def find_oids_by_attribute(self, name, values):
+        u"""Return (List[str]) the OIDs whose node attribute `name` is one of `values`, sorted."""
+        values = {_to_str(v) for v in values}
+        return sorted(
+            oid for (oid, v) in self.attributes.get(name, {}).iteritems() if v and (v in values)
+        )
+
+    def has_edge_attribute(self, name):
+        return name in self.edge_attributes
+
+    def get_edge_attribute(self, name, source, target):
+        u"""Return (Optional[Union[int, str]]) The edge attribute `name` of the reference from
+        `source` to `target`, `None` if not available.
+        """
+        values = self.edge_attributes.get(name)
+        if (values is None) or (not self.has_reference(source, target)):
+            return None
+        return values.get((source, target), None if name in STRING_ATTRIBUTES else 0)
+
+    def iter_edges(self):
+        u"""Return (Iterator[Tuple[str, str]]) `(source, target)` pairs, in a fixed order."""
+        for (oid, refs) in self.reference_map.iteritems():
+            for r in refs:
+                yield (oid, r)
+
+    def with_edge_attribute(self, name, values=None, updates=None):
+        u"""Return a copy of the graph with the numeric edge attribute `name` set.
+
+        Arguments:
+        values (Optional[Iterable[int]]) -- A value for every edge, in the order of `iter_edges()`.
+        updates (Optional[Mapping[Tuple[str, str], int]]) -- Values of some edges, by
+            `(source, target)` pair. Other edges keep their current value.
+
+        Return (ReferenceMaps)
+        """
+        if values is not None:
+            edge_values = dict(itertools.izip(self.iter_edges(), values))
+        else:
+            edge_values = dict(self.edge_attributes.get(name, {}))
+        edge_values.update(updates or {})
+
+        edge_attributes = dict(self.edge_attributes)
+        edge_attributes[name] = edge_values
+        return ReferenceMaps(
+            self.oids, self.reference_map, self.back_reference_map, self.attributes,
+            edge_attributes,
+        )
+
+    def __len__(self):
+        return len(self.oids)
+
+    @property
+    def num_edges(self):
+        return sum(len(refs) for refs in self.reference_map.itervalues())
+
+    def get_references(self, oid):
+        return self.reference_map.get(oid, _EMPTY_FROZENSET)
+
+    def get_back_references(self, oid):
+        return self.back_reference_map.get(oid, _EMPTY_FROZENSET)
+
+    def has_reference(self, source, target):
+        return target in self.get_references(source)
+
+    def iter_references(self):
+        u"""Return (Iterator[Tuple[str, Set[str]]]) `(oid, references)` pairs sorted by OID."""
+        for oid in sorted(self.reference_map):
+            yield (oid, self.reference_map[oid])
+
+    def get_unreachable(self, root_oid):
+        u"""Return (Set[str]) OIDs in the graph which are not reachable from `root_oid`."""
+        reachable = set()
+        next_oids = {root_oid}
+        while next_oids:
+            oid = next_oids.pop()
+            if oid not in reachable:
+                reachable.add(oid)
+                next_oids.update(self.get_references(oid))
+        return self.oids - reachable
+
+    @property
+    def nbytes(self):
+        u"""(int) Approximate memory used by the graph, in bytes."""
+        size = sys.getsizeof(self.oids) + sum(sys.getsizeof(o) for o in self.oids)
+        for mapping in (self.reference_map, self.back_reference_map):
+            size += sys.getsizeof(mapping)
+            size += sum(sys.getsizeof(s) for s in mapping.itervalues())
+        return size
+
+
+# CSR arrays --------------------------------------------------------------------------------------
+
+class CompactReferenceGraphBuilder(object):
+    u"""Build a `CompactReferenceGraph`.
+
+    Edges are accumulated in flat arrays and converted to CSR form by `build()`. Each OID must be
+    added only once, along with all the OIDs it references. This is not checked, to avoid keeping
+    a set of all OIDs in memory.
+    """
+
+    def __init__(self):
+        self._record_oids = array(UINT64_TYPECODE)
+        self._record_attributes = {
+            name: array(typecode) for (name, typecode) in NODE_ATTRIBUTES.iteritems()
+        }
+        self._string_tables = {name: StringTable() for name in STRING_ATTRIBUTES}
+        self._edge_records = array(UINT32_TYPECODE)
+        self._edge_targets = array(UINT64_TYPECODE)
+        self._edge_attributes = {
+            name: array(typecode) for (name, typecode) in EDGE_ATTRIBUTES.iteritems()
+        }
+
+    def add_references(self, oid, refs, edge_attributes=None, **attributes):
+        u"""Add an `oid` and the OIDs referenced by it.
+
+        Arguments:
+        oid (str) -- OID.
+        refs (Iterable[str]) -- Referenced OIDs.
+        edge_attributes (Optional[Mapping[str, Mapping[str, Union[int, str]]]]) -- Edge attributes
+            of the references, by attribute name and referenced OID. See `EDGE_ATTRIBUTES`.
+        attributes (Union[int, str]) -- Node attributes of `oid`, see `NODE_ATTRIBUTES`.
+        """
+        record = len(self._record_oids)
+        self._record_oids.append(u64(oid))
+        for (name, value) in attributes.iteritems():
+            self._record_attributes[name].append(self._to_int(name, value))
+
+        refs = list(set(refs))
+        for r in refs:
+            self._edge_records.append(record)
+            self._edge_targets.append(u64(r))
+        for (name, values) in (edge_attributes or {}).iteritems():
+            edge_values = self._edge_attributes[name]
+            for r in refs:
+                edge_values.append(self._to_int(name, values.get(r)))
+
+    def build(self):
+        u"""Return (CompactReferenceGraph)"""
+        nodes = array(UINT64_TYPECODE, sorted(set(self._record_oids).union(self._edge_targets)))
+
+        record_nodes = _to_node_indexes(nodes, self._record_oids)
+        attributes = {}
+        for (name, record_values) in self._record_attributes.iteritems():
+            if len(record_values) == len(self._record_oids):
+                values = attributes[name] = array(record_values.typecode, [0]) * len(nodes)
+                for (i, value) in itertools.izip(record_nodes, record_values):
+                    values[i] = value
+        edge_attributes = {
+            name: values for (name, values) in self._edge_attributes.iteritems()
+            if len(values) == len(self._edge_targets)
+        }
+        string_tables = {
+            name: table for (name, table) in self._string_tables.iteritems()
+            if (name in attributes) or (name in edge_attributes)
+        }
+        self._record_oids = self._record_attributes = self._string_tables = None
+        self._edge_attributes = None
+
+        sources = array(UINT32_TYPECODE, (record_nodes[r] for r in self._edge_records))
+        self._edge_records = None
+        targets = _to_node_indexes(nodes, self._edge_targets)
+        self._edge_targets = None
+
+        edge_names = sorted(edge_attributes)
+        (offsets, adjacency, edge_columns) = _to_csr(
+            len(nodes), sources, targets, [edge_attributes[name] for name in edge_names]
+        )
+        edge_attributes = dict(zip(edge_names, edge_columns))
+        (back_offsets, back_adjacency, _) = _to_csr(len(nodes), targets, sources)
+        return CompactReferenceGraph(
+            nodes, offsets, adjacency, back_offsets, back_adjacency, attributes, string_tables,
+            edge_attributes,
+        )
+
+    def _to_int(self, name, value):
+        if name in STRING_ATTRIBUTES:
+            return self._string_tables[name].index(value)
+        return value or 0
+
+
+class StringTable(object):
+    u"""Strings identified by their index.
+
+    The empty string always has index 0 and stands for a missing value. Strings added by `index()`
+    are not duplicated.
+
+    A table created from stored arrays (the bytes of the strings and their offsets) reads the
+    strings lazily, so opening a graph with millions of ids is cheap. New strings are kept in
+    memory.
+
+    Arguments:
+    data (Union[str, graphfile.MappedArray]) -- Bytes of the stored strings.
+    offsets (Optional[Sequence[int]]) -- Offset of each stored string in `data`, plus the end.
+    """
+
+    # Stored strings are only deduplicated when there are few of them.
+    _MAX_INDEXED = 100000
+
+    def __init__(self, data='', offsets=None):
+        self._data = data
+        self._offsets = offsets if (offsets is not None) else array(UINT64_TYPECODE, [0, 0])
+        self._num_stored = len(self._offsets) - 1
+        self._new = []
+        self._indexes = None
+
+    def arrays(self):
+        u"""Return (Tuple[array.array, array.array]) the bytes of the strings and their offsets,
+        the inverse of the constructor.
+        """
+        data = array(UINT8_TYPECODE)
+        data.fromstring(self._read(0, self._offsets[-1]))
+        offsets = _copy_array(self._offsets, UINT64_TYPECODE)
+        end = offsets[-1]
+        for s in self._new:
+            data.fromstring(s)
+            end += len(s)
+            offsets.append(end)
+        return (data, offsets)
+
+    def copy(self):
+        result = StringTable(self._data, self._offsets)
+        result._new = list(self._new)
+        result._indexes = None if (self._indexes is None) else dict(self._indexes)
+        return result
+
+    def index(self, s):
+        u"""Return (int) the index of `s`, which is added to the table if needed."""
+        if not s:
+            return 0
+
+        s = _to_str(s)
+        indexes = self._get_indexes()
+        i = indexes.get(s)
+        if i is None:
+            i = indexes[s] = len(self)
+            self._new.append(s)
+        return i
+
+    def find(self, s):
+        u"""Return (Optional[int]) the index of `s`, `None` if it is not in the table."""
+        if not s:
+            return 0
+
+        s = _to_str(s)
+        i = self._get_indexes().get(s)
+        if (i is None) and (self._num_stored > self._MAX_INDEXED):
+            # Only the new strings are indexed.
+            i = next((j for j in xrange(1, self._num_stored) if self[j] == s), None)
+        return i
+
+    def __getitem__(self, i):
+        if i < self._num_stored:
+            return self._read(self._offsets[i], self._offsets[i + 1])
+        return self._new[i - self._num_stored]
+
+    def __len__(self):
+        return self._num_stored + len(self._new)
+
+    def _get_indexes(self):
+        if self._indexes is None:
+            self._indexes = {}
+            if self._num_stored <= self._MAX_INDEXED:
+                for i in xrange(1, self._num_stored):
+                    self._indexes.setdefault(self[i], i)
+        return self._indexes
+
+    def _read(self, start, end):
+        data = self._data
+        return data[start:end] if isinstance(data, str) else data.tostring(start, end)
+
+
+def to_compact(graph):
+    u"""Return (CompactReferenceGraph) `graph` converted to a `CompactReferenceGraph`."""
+    if isinstance(graph, CompactReferenceGraph):
+        return graph
+
+    builder = CompactReferenceGraphBuilder()
+    names = [name for name in NODE_ATTRIBUTES if graph.has_attribute(name)]
+    edge_names = [name for name in EDGE_ATTRIBUTES if graph.has_edge_attribute(name)]
+    for oid in graph.oids:
+        refs = graph.get_references(oid)
+        attributes = {name: graph.get_attribute(name, oid) for name in names}
+        edge_attributes = {
+            name: {r: graph.get_edge_attribute(name, oid, r) for r in refs}
+            for name in edge_names
+        }
+        builder.add_references(oid, refs, edge_attributes, **attributes)
+    return builder.build()
+
+
+def to_reference_maps(graph):
+    u"""Return (ReferenceMaps) `graph` converted to `ReferenceMaps`, e.g. a graph read from a
+    cache file, whose lookups are slower.
+    """
+    if not isinstance(graph, CompactReferenceGraph):
+        return graph
+
+    builder = ReferenceMapsBuilder()
+    names = sorted(graph.attributes)
+    edge_names = sorted(graph.edge_attributes)
+    (oids, offsets, adjacency) = ([p64(o) for o in graph.nodes], graph.offsets, graph.adjacency)
+    for (i, row) in enumerate(graph.iter_attributes(*names)):
+        (start, end) = (offsets[i], offsets[i + 1])
+        refs = [oids[j] for j in adjacency[start:end]]
+        # Missing strings are `None`, stored as empty strings like in a new graph.
+        attributes = {
+            name: '' if (value is None) else value for (name, value) in zip(names, row[1:])
+        }
+        edge_attributes = {
+            name: dict(itertools.izip(refs, (
+                graph._to_value(name, v) for v in graph.edge_attributes[name][start:end]
+            )))
+            for name in edge_names
+        }
+        builder.add_references(row[0], refs, edge_attributes, **attributes)
+    return builder.build()
+
+
+def _to_node_indexes(nodes, oid_ints):
+    return array(UINT32_TYPECODE, (bisect_left(nodes, o) for o in oid_ints))
+
+
+def _to_csr(num_nodes, sources, targets, columns=()):
+    u"""Convert a list of edges (given as two parallel arrays of node indexes) to CSR form.
+
+    Rows are sorted, so the presence of an edge can be tested with a binary search. The items of
+    `columns`, arrays parallel to the edges, are reordered along with them.
+
+    Return (Tuple[array, array, List[array]]) -- Offsets, adjacency and reordered `columns`.
+    """
+    offsets = array(UINT64_TYPECODE, [0]) * (num_nodes + 1)
+    for s in sources:
+        offsets[s + 1] += 1
+    for i in xrange(num_nodes):
+        offsets[i + 1] += offsets[i]
+
+    adjacency = array(UINT32_TYPECODE, [0]) * len(sources)
+    new_columns = [array(c.typecode, [0]) * len(sources) for c in columns]
+    cursor = array(UINT64_TYPECODE, offsets)
+    for (edge, (s, t)) in enumerate(itertools.izip(sources, targets)):
+        position = cursor[s]
+        adjacency[position] = t
+        for (column, new_column) in itertools.izip(columns, new_columns):
+            new_column[position] = column[edge]
+        cursor[s] += 1
+
+    for i in xrange(num_nodes):
+        (start, end) = (offsets[i], offsets[i + 1])
+        if end - start <= 1:
+            continue
+        if not new_columns:
+            adjacency[start:end] = array(UINT32_TYPECODE, sorted(adjacency[start:end]))
+            continue
+        order = sorted(xrange(start, end), key=adjacency.__getitem__)
+        for a in [adjacency] + new_columns:
+            a[start:end] = array(a.typecode, [a[p] for p in order])
+
+    return (offsets, adjacency, new_columns)
+
+
+def _patch_csr(offsets, adjacency, remap, inserted, rows, num_nodes):
+    u"""Copy CSR arrays replacing some rows and inserting empty ones.
+
+    Arguments:
+    offsets, adjacency (Sequence[int]) -- The original CSR arrays.
+    remap (Optional[Sequence[int]]) -- Mapping from old to new node indexes, if they changed.
+    inserted (Sequence[int]) -- Sorted new indexes of the inserted nodes.
+    rows (Mapping[int, Sequence[int]]) -- Replaced rows, by new node index.
+    num_nodes (int) -- Number of nodes after the patch.
+
+    Return (Tuple[array, array]) -- The new offsets and adjacency arrays.
+    """
+    new_offsets = array(UINT64_TYPECODE, [0])
+    new_adjacency = array(UINT32_TYPECODE)
+    row = 0
+    for special in sorted(set(inserted).union(rows)) + [num_nodes]:
+        if row < special:
+            # Copy a run of unchanged rows.
+            old_start = row - bisect_left(inserted, row)
+            old_end = old_start + (special - row)
+            shift = len(new_adjacency) - offsets[old_start]
+            for (start, end) in _chunks(old_start + 1, old_end + 1):
+                new_offsets.extend([o + shift for o in offsets[start:end]])
+            for (start, end) in _chunks(offsets[old_start], offsets[old_end]):
+                values = adjacency[start:end]
+                new_adjacency.extend(map(remap.__getitem__, values) if remap else values)
+
+        if special < num_nodes:
+            new_adjacency.extend(rows.get(special, ()))
+            new_offsets.append(len(new_adjacency))
+        row = special + 1
+
+    return (new_offsets, new_adjacency)
+
+
+def _patch_column(offsets, column, inserted, rows, num_nodes, typecode):
+    u"""Like `_patch_csr()`, for an array parallel to `adjacency`.
+
+    `rows` maps new node indexes to the values of the replaced rows.
+    """
+    new_column = array(typecode)
+    row = 0
+    for special in sorted(set(inserted).union(rows)) + [num_nodes]:
+        if row < special:
+            old_start = row - bisect_left(inserted, row)
+            old_end = old_start + (special - row)
+            for (start, end) in _chunks(offsets[old_start], offsets[old_end]):
+                new_column.extend(column[start:end])
+
+        if special < num_nodes:
+            new_column.extend(rows.get(special, ()))
+        row = special + 1
+
+    return new_column
+
+
+def _insert(values, insertion_points, inserted_values, typecode):
+    u"""Return (array.array) a copy of `values` with `inserted_values[i]` inserted before the
+    item at `insertion_points[i]` (an index in the original `values`).
+    """
+    result = array(typecode)
+    for (i, (start, end)) in enumerate(pairwise([0] + insertion_points, len(values))):
+        result.extend(values[start:end])
+        if i < len(inserted_values):
+            result.append(inserted_values[i])
+    return result
+
+
+def _copy_array(values, typecode):
+    if isinstance(values, array):
+        return array(typecode, values)
+    result = array(typecode)
+    for (start, end) in _chunks(0, len(values)):
+        result.extend(values[start:end])
+    return result
+
+
+def _chunks(start, end, size=1 << 20):
+    return ((i, min(i + size, end)) for i in xrange(start, end, size))
+
+
+class CompactReferenceGraph(object):
+    u"""Reference graph stored in CSR arrays.
+
+    Arguments:
+    nodes (Sequence[int]) -- Sorted OIDs, as integers.
+    offsets (Sequence[int]) -- Forward row offsets, `len(nodes) + 1` items.
+    adjacency (Sequence[int]) -- Forward edges, as node indexes.
+    back_offsets (Sequence[int]) -- Reverse row offsets, `len(nodes) + 1` items.
+    back_adjacency (Sequence[int]) -- Reverse edges, as node indexes.
+    attributes (Mapping[str, Sequence[int]]) -- Node attributes, one value per node.
+    string_tables (Mapping[str, StringTable]) -- Strings of the string attributes, indexed by the
+        values in `attributes` and `edge_attributes`.
+    edge_attributes (Mapping[str, Sequence[int]]) -- Edge attributes, parallel to `adjacency`.
+    """
+
+    _SECTION_NAMES = ('nodes', 'offsets', 'adjacency', 'back_offsets', 'back_adjacency')
+    _ATTRIBUTE_SECTION_PREFIX = 'node.'
+    _EDGE_ATTRIBUTE_SECTION_PREFIX = 'edge.'
+    _STRING_DATA_SECTION_PREFIX = 'sd.'
+    _STRING_OFFSETS_SECTION_PREFIX = 'so.'
+
+    def __init__(
+        self, nodes, offsets, adjacency, back_offsets, back_adjacency, attributes=None,
+        string_tables=None, edge_attributes=None,
+    ):
+        self.nodes = nodes
+        self.offsets = offsets
+        self.adjacency = adjacency
+        self.back_offsets = back_offsets
+        self.back_adjacency = back_adjacency
+        self.attributes = attributes or {}
+        self.string_tables = string_tables or {}
+        self.edge_attributes = edge_attributes or {}
+
+        # A string attribute without its table is useless.
+        for name in STRING_ATTRIBUTES.difference(self.string_tables):
+            self.attributes.pop(name, None)
+            self.edge_attributes.pop(name, None)
+
+    @classmethod
+    def from_sections(cls, sections):
+        u"""Create a graph from a mapping of section name to array, see `sections()`."""
+
+        def get_sections(prefix, names):
+            return {
+                name[len(prefix):]: values for (name, values) in sections.iteritems()
+                if name.startswith(prefix) and (name[len(prefix):] in names)
+            }
+
+        string_data = get_sections(cls._STRING_DATA_SECTION_PREFIX, STRING_ATTRIBUTES)
+        string_offsets = get_sections(cls._STRING_OFFSETS_SECTION_PREFIX, STRING_ATTRIBUTES)
+        string_tables = {
+            name: StringTable(data, string_offsets[name])
+            for (name, data) in string_data.iteritems() if name in string_offsets
+        }
+        return cls(
+            *(sections[name] for name in cls._SECTION_NAMES),
+            attributes=get_sections(cls._ATTRIBUTE_SECTION_PREFIX, NODE_ATTRIBUTES),
+            string_tables=string_tables,
+            edge_attributes=get_sections(cls._EDGE_ATTRIBUTE_SECTION_PREFIX, EDGE_ATTRIBUTES)
+        )
+
+    def sections(self):
+        u"""Return (Sequence[Tuple[str, Sequence[int]]]) The arrays of the graph, by name.
+
+        Used to store the graph in a file (see `.graphfile`).
+        """
+        result = [(name, getattr(self, name)) for name in self._SECTION_NAMES]
+        result.extend(
+            (self._ATTRIBUTE_SECTION_PREFIX + name, values)
+            for (name, values) in sorted(self.attributes.iteritems())
+        )
+        result.extend(
+            (self._EDGE_ATTRIBUTE_SECTION_PREFIX + name, values)
+            for (name, values) in sorted(self.edge_attributes.iteritems())
+        )
+        for (name, table) in sorted(self.string_tables.iteritems()):
+            (data, offsets) = table.arrays()
+            result.append((self._STRING_DATA_SECTION_PREFIX + name, data))
+            result.append((self._STRING_OFFSETS_SECTION_PREFIX + name, offsets))
+        return result
+
+    def has_attribute(self, name):
+        return name in self.attributes
+
+    def get_attribute(self, name, oid):
+        u"""Return (Optional[Union[int, str]]) The node attribute `name` of `oid`, `None` if not
+        available.
+        """
+        values = self.attributes.get(name)
+        i = self.index_of(oid)
+        if (values is None) or (i is None):
+            return None
+        return self._to_value(name, values[i])
+
+    def iter_attributes(self, *names):
+        u"""Return (Iterator[Tuple]) `(oid, value, ...)` tuples with the node attributes `names`
+        of every OID, sorted by OID. Missing values are `None`.
+
+        Much faster than calling `get_attribute()` for every OID.
+        """
+        columns = [self._iter_attribute_values(name) for name in names]
+        rows = itertools.izip(*columns) if columns else itertools.repeat(())
+        for (oid_int, values) in itertools.izip(self.nodes, rows):
+            yield (p64(oid_int),) + values
+
+    def _iter_attribute_values(self, name):
+        values = self.attributes.get(name)
+        if values is None:
+            return itertools.repeat(None)
+        if name in STRING_ATTRIBUTES:
+            return (self._to_value(name, v) for v in values)
+        return iter(values)
+
+    def get_attribute_counts(self, name):
+        u"""Return (Dict[Union[int, str], int]) the number of OIDs with each value of the node
+        attribute `name`. OIDs without a value, 0 or the empty string, are not counted.
+
+        String values are counted by their index, so each string is only read once.
+        """
+        counts = collections.Counter(self.attributes.get(name, ()))
+        counts.pop(0, None)
+        if name not in STRING_ATTRIBUTES:
+            return dict(counts)
+        table = self.string_tables[name]
+        return {table[i]: count for (i, count) in counts.iteritems()}
+
+    def find_oids_by_attribute(self, name, values):
+        u"""Return (List[str]) the OIDs whose node attribute `name` is one of `values`, sorted.
+
+        String values are looked up in the string table first, then the column of indexes is
+        scanned without reading any string.
+        """
+        column = self.attributes.get(name)
+        if column is None:
+            return []
+        if name in STRING_ATTRIBUTES:
+            table = self.string_tables[name]
+            values = {table.find(v) for v in values if v}
+            values.discard(None)
+        else:
+            values = set(values)
+        nodes = self.nodes
+        return [p64(nodes[i]) for (i, v) in enumerate(column) if v in values]
+
+    def has_edge_attribute(self, name):
+        return name in self.edge_attributes
+
+    def get_edge_attribute(self, name, source, target):
+        u"""Return (Optional[Union[int, str]]) The edge attribute `name` of the reference from
+        `source` to `target`, `None` if not available.
+        """
+        values = self.edge_attributes.get(name)
+        position = None if (values is None) else self._edge_position(source, target)
+        if position is None:
+            return None
+        return self._to_value(name, values[position])
+
+    def iter_edges(self):
+        u"""Return (Iterator[Tuple[str, str]]) `(source, target)` pairs, in the order of the
+        adjacency array.
+        """
+        (nodes, offsets, adjacency) = (self.nodes, self.offsets, self.adjacency)
+        for i in xrange(len(nodes)):
+            (start, end) = (offsets[i], offsets[i + 1])
+            if start != end:
+                source = p64(nodes[i])
+                for j in adjacency[start:end]:
+                    yield (source, p64(nodes[j]))
+
+    def with_edge_attribute(self, name, values=None, updates=None):
+        u"""Return a copy of the graph with the numeric edge attribute `name` set.
+
+        Arguments:
+        values (Optional[Iterable[int]]) -- A value for every edge, in the order of `iter_edges()`.
+        updates (Optional[Mapping[Tuple[str, str], int]]) -- Values of some edges, by
+            `(source, target)` pair. Other edges keep their current value.
+
+        Return (CompactReferenceGraph)
+        """
+        typecode = EDGE_ATTRIBUTES[name]
+        if values is not None:
+            column = array(typecode, values)
+        elif name in self.edge_attributes:
+            column = _copy_array(self.edge_attributes[name], typecode)
+        else:
+            column = array(typecode, [0]) * len(self.adjacency)
+
+        for ((source, target), value) in (updates or {}).iteritems():
+            position = self._edge_position(source, target)
+            if position is not None:
+                column[position] = value
+
+        edge_attributes = dict(self.edge_attributes)
+        edge_attributes[name] = column
+        return CompactReferenceGraph(
+            self.nodes, self.offsets, self.adjacency, self.back_offsets, self.back_adjacency,
+            self.attributes, self.string_tables, edge_attributes,
+        )
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @property
+    def num_edges(self):
+        return len(self.adjacency)
+
+    @property
+    def oids(self):
+        u"""(Set[str]) Set-like view of all OIDs."""
+        return _OIDSetView(self)
+
+    @property
+    def reference_map(self):
+        u"""(Mapping[str, Set[str]]) Read-only mapping view of the forward references."""
+        return _ReferenceMapView(self, self.get_references, self.offsets)
+
+    @property
+    def back_reference_map(self):
+        u"""(Mapping[str, Set[str]]) Read-only mapping view of the back references."""
+        return _ReferenceMapView(self, self.get_back_references, self.back_offsets)
+
+    def index_of(self, oid):
+        u"""Return the node index of `oid` or `None` if it is not in the graph."""
+        return self._index_of_int(u64(oid))
+
+    def get_references(self, oid):
+        return self._get_row(oid, self.offsets, self.adjacency)
+
+    def has_reference(self, source, target):
+        u"""Return (bool) whether `source` references `target`, using a binary search."""
+        return self._edge_position(source, target) is not None
+
+    def patched(self, updates, attributes=None, edge_attributes=None):
+        u"""Return a copy of the graph with the references of some OIDs replaced.
+
+        Only the changed rows are computed in Python, the rest of the arrays is copied in large
+        slices. OIDs which are not in the graph yet are added to it.
+
+        Arguments:
+        updates (Mapping[str, Iterable[str]]) -- The new references of each changed OID.
+        attributes (Mapping[str, Mapping[str, Union[int, str]]]) -- The new node attributes of the
+            changed OIDs, by attribute name. Attributes of the graph missing here are dropped, and
+            values of OIDs which are not in the patched graph are ignored.
+        edge_attributes (Mapping[str, Mapping[str, Mapping[str, Union[int, str]]]]) -- The edge
+            attributes of the new references, by attribute name, source and target. Edge
+            attributes of the graph missing here are kept, with default values for the new
+            references.
+
+        Return (CompactReferenceGraph)
+        """
+        attributes = attributes or {}
+        edge_attributes = edge_attributes or {}
+        updated_oids = {u64(o): o for o in updates}
+        updates = {u64(o): set(u64(r) for r in refs) for (o, refs) in updates.iteritems()}
+        new_oid_ints = set(updates)
+        for refs in updates.itervalues():
+            new_oid_ints.update(refs)
+        new_oid_ints = sorted(o for o in new_oid_ints if self._index_of_int(o) is None)
+
+        # Map old node indexes to new ones, taking into account the inserted nodes.
+        insertion_points = [bisect_left(self.nodes, o) for o in new_oid_ints]
+        inserted = [p + i for (i, p) in enumerate(insertion_points)]
+        if inserted:
+            remap = array(UINT32_TYPECODE)
+            for (i, (start, end)) in enumerate(pairwise([0] + insertion_points, len(self.nodes))):
+                remap.extend(xrange(start + i, end + i))
+        else:
+            remap = None
+
+        nodes = _insert(self.nodes, insertion_points, new_oid_ints, UINT64_TYPECODE)
+
+        def new_index(oid_int):
+            return bisect_left(nodes, oid_int)
+
+        new_string_tables = {}
+
+        def get_string_table(name):
+            if name not in new_string_tables:
+                new_string_tables[name] = self.string_tables[name].copy()
+            return new_string_tables[name]
+
+        def to_int(name, value):
+            if name in STRING_ATTRIBUTES:
+                return get_string_table(name).index(value)
+            return value or 0
+
+        new_attributes = {}
+        for (name, old_values) in self.attributes.iteritems():
+            if name not in attributes:
+                continue
+            typecode = NODE_ATTRIBUTES[name]
+            values = new_attributes[name] = _insert(
+                old_values, insertion_points, [0] * len(inserted), typecode
+            )
+            for (oid, value) in attributes[name].iteritems():
+                i = new_index(u64(oid))
+                if (i < len(nodes)) and (nodes[i] == u64(oid)):
+                    values[i] = to_int(name, value)
+
+        def old_row(offsets, adjacency, oid_int):
+            i = self._index_of_int(oid_int)
+            if i is None:
+                return ()
+            row = adjacency[offsets[i]:offsets[i + 1]]
+            return [remap[j] for j in row] if remap else row
+
+        rows = {}
+        row_oids = {}
+        back_additions = {}
+        affected_targets = set()
+        for (oid_int, refs) in updates.iteritems():
+            source = new_index(oid_int)
+            rows[source] = sorted(new_index(r) for r in refs)
+            row_oids[source] = updated_oids[oid_int]
+            affected_targets.update(rows[source])
+            affected_targets.update(old_row(self.offsets, self.adjacency, oid_int))
+            for target in rows[source]:
+                back_additions.setdefault(target, []).append(source)
+
+        changed_sources = set(rows)
+        back_rows = {}
+        for target in affected_targets:
+            sources = set(old_row(self.back_offsets, self.back_adjacency, nodes[target]))
+            sources.difference_update(changed_sources)
+            sources.update(back_additions.get(target, ()))
+            back_rows[target] = sorted(sources)
+
+        new_edge_attributes = {}
+        for (name, old_values) in self.edge_attributes.iteritems():
+            values_by_source = edge_attributes.get(name, {})
+            value_rows = {}
+            for (source, row) in rows.iteritems():
+                values = values_by_source.get(row_oids[source], {})
+                value_rows[source] = [to_int(name, values.get(p64(nodes[j]))) for j in row]
+            new_edge_attributes[name] = _patch_column(
+                self.offsets, old_values, inserted, value_rows, len(nodes), EDGE_ATTRIBUTES[name]
+            )
+
+        string_tables = dict(self.string_tables)
+        string_tables.update(new_string_tables)
+
+        (offsets, adjacency) = _patch_csr(
+            self.offsets, self.adjacency, remap, inserted, rows, len(nodes)
+        )
+        (back_offsets, back_adjacency) = _patch_csr(
+            self.back_offsets, self.back_adjacency, remap, inserted, back_rows, len(nodes)
+        )
+        return CompactReferenceGraph(
+            nodes, offsets, adjacency, back_offsets, back_adjacency, new_attributes,
+            string_tables, new_edge_attributes,
+        )
+
+    def get_back_references(self, oid):
+        return self._get_row(oid, self.back_offsets, self.back_adjacency)
+
+    def iter_references(self):
+        u"""Return (Iterator[Tuple[str, Set[str]]]) `(oid, references)` pairs sorted by OID."""
+        (nodes, offsets, adjacency) = (self.nodes, self.offsets, self.adjacency)
+        for i in xrange(len(nodes)):
+            (start, end) = (offsets[i], offsets[i + 1])
+            if start != end:
+                yield (p64(nodes[i]), frozenset(p64(nodes[j]) for j in adjacency[start:end]))
+
+    def get_unreachable(self, root_oid):
+        u"""Return (Set[str]) OIDs in the graph which are not reachable from `root_oid`."""
+        reachable = self.get_reachable_flags(root_oid)
+        nodes = self.nodes
+        return {p64(nodes[i]) for i in xrange(len(nodes)) if not reachable[i]}
+
+    def get_reachable_flags(self, root_oid):
+        u"""Return (array.array) One flag per node, true if it is reachable from `root_oid`."""
+        reachable = array('B', [0]) * len(self.nodes)
+        root = self.index_of(root_oid)
+        if root is None:
+            return reachable
+
+        (offsets, adjacency) = (self.offsets, self.adjacency)
+        reachable[root] = 1
+        stack = [root]
+        while stack:
+            i = stack.pop()
+            for j in adjacency[offsets[i]:offsets[i + 1]]:
+                if not reachable[j]:
+                    reachable[j] = 1
+                    stack.append(j)
+        return reachable
+
+    @property
+    def nbytes(self):
+        u"""(int) Approximate memory used by the graph, in bytes."""
+        return sum(a.itemsize * len(a) for (_, a) in self.sections())
+
+    def _index_of_int(self, oid_int):
+        i = bisect_left(self.nodes, oid_int)
+        return i if (i < len(self.nodes) and self.nodes[i] == oid_int) else None
+
+    def _edge_position(self, source, target):
+        (i, j) = (self.index_of(source), self.index_of(target))
+        if (i is None) or (j is None):
+            return None
+        (start, end) = (self.offsets[i], self.offsets[i + 1])
+        position = bisect_left(self.adjacency, j, start, end)
+        return position if (position < end and self.adjacency[position] == j) else None
+
+    def _to_value(self, name, value):
+        if name in STRING_ATTRIBUTES:
+            return self.string_tables[name][value] or None
+        return value
+
+    def _get_row(self, oid, offsets, adjacency):
+        i = self.index_of(oid)
+        if i is None:
+            return _EMPTY_FROZENSET
+        nodes = self.nodes
+        return frozenset(p64(nodes[j]) for j in adjacency[offsets[i]:offsets[i + 1]])
+
+
+class _OIDSetView(collections.Set):
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __len__(self):
+        return len(self._graph.nodes)
+
+    def __iter__(self):
+        return (p64(o) for o in self._graph.nodes)
+
+    def __contains__(self, oid):
+        return self._graph.index_of(oid) is not None
+
+
+class _ReferenceMapView(collections.Mapping):
+    u"""Only OIDs with at least one reference are keys, like in `ReferenceMaps`."""
+
+    def __init__(self, graph, get_row, offsets):
+        self._graph = graph
+        self._get_row = get_row
+        self._offsets = offsets
+
+    def __len__(self):
+        offsets = self._offsets
+        return sum(1 for i in xrange(len(self._graph.nodes)) if offsets[i] != offsets[i + 1])
+
+    def __iter__(self):
+        (nodes, offsets) = (self._graph.nodes, self._offsets)
+        return (p64(nodes[i]) for i in xrange(len(nodes)) if offsets[i] != offsets[i + 1])
+
+    def __getitem__(self, oid):
+        row = self._get_row(oid)
+        if not row:
+            raise KeyError(oid)
+        return row
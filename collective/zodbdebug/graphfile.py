@@ -0,0 +1,179 @@
+# coding=utf8
+u"""Binary file format for reference graphs.
+
+A graph file stores the arrays of a `.graph.CompactReferenceGraph` so it can be memory-mapped and
+queried straight away, without parsing. Opening a file takes constant time and only the pages
+which are actually touched by queries are read from disk.
+
+Layout (all integers are little-endian):
+
+    header:
+        magic (8 bytes) -- `MAGIC`.
+        version (uint32) -- `VERSION`.
+        number of sections (uint32).
+    section table, one entry per section:
+        name (16 bytes, NUL padded).
+        struct format character of the items (1 byte), followed by 7 bytes of padding.
+        number of items (uint64).
+        offset of the first item, from the start of the file (uint64).
+    section data, each one aligned to 8 bytes.
+
+Sections are identified by name, so new sections can be added without breaking old readers.
+"""
+from .graph import UINT32_TYPECODE
+from .graph import UINT64_TYPECODE
+from array import array
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = 'ZDBGREFS'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sII')
+_SECTION = struct.Struct('<16sc7xQQ')
+_ALIGNMENT = 8
+_MAX_NAME_LENGTH = 16
+
+# Struct format character for each item size. Only unsigned integers are stored.
+_FORMATS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+
+class GraphFileError(ValueError):
+    u"""The file is not a graph file or its version is not supported."""
+
+
+def is_graph_file(path):
+    u"""Return (bool) whether the file at `path` starts with the graph file magic."""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_sections(path, sections):
+    u"""Write arrays to a graph file.
+
+    The file is written to a temporary path first and then renamed, so readers never see a
+    partially written file.
+
+    Arguments:
+    path (str) -- Path of the file.
+    sections (Sequence[Tuple[str, array.array]]) -- `(name, array)` pairs.
+    """
+    sections = [(name, _as_array(a)) for (name, a) in sections]
+    offset = _align(_HEADER.size + _SECTION.size * len(sections))
+    table = []
+    for (name, a) in sections:
+        if len(name) > _MAX_NAME_LENGTH:
+            raise ValueError('Section name longer than {} bytes: {}'.format(
+                _MAX_NAME_LENGTH, name))
+        table.append((name, _FORMATS[a.itemsize], len(a), offset))
+        offset = _align(offset + a.itemsize * len(a))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(sections)))
+        for entry in table:
+            f.write(_SECTION.pack(*entry))
+        for ((name, a), (_, _, _, offset)) in zip(sections, table):
+            f.write('\0' * (offset - f.tell()))
+            if sys.byteorder != 'little':
+                a = array(a.typecode, a)
+                a.byteswap()
+            a.tofile(f)
+    os.rename(tmp_path, path)
+
+
+def read_sections(path):
+    u"""Memory-map a graph file.
+
+    Arguments:
+    path (str) -- Path of the file.
+
+    Return (Dict[str, MappedArray]) -- Mapping from section name to a read-only sequence of
+        integers backed by the file.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise GraphFileError('Truncated graph file: {}'.format(path))
+
+        (magic, version, num_sections) = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise GraphFileError('Not a graph file: {}'.format(path))
+        if version != VERSION:
+            raise GraphFileError(
+                'Unsupported graph file version {} (expected {}): {}'.format(
+                    version, VERSION, path)
+            )
+
+        table = [_SECTION.unpack(f.read(_SECTION.size)) for _ in xrange(num_sections)]
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return {
+        name.rstrip('\0'): MappedArray(mapped, offset, count, fmt)
+        for (name, fmt, count, offset) in table
+    }
+
+
+class MappedArray(object):
+    u"""Read-only sequence of unsigned integers stored in a memory-mapped buffer.
+
+    Supports `len()`, indexing, slicing (which returns a list) and iteration, which is enough to be
+    used in place of an `array.array` by `.graph.CompactReferenceGraph` and `bisect`.
+    """
+
+    _CHUNK = 4096
+
+    def __init__(self, buf, offset, count, fmt):
+        self._buf = buf
+        self._offset = offset
+        self._count = count
+        self._fmt = fmt
+        self._item = struct.Struct('<' + fmt)
+        self.itemsize = self._item.size
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            (start, stop, step) = i.indices(self._count)
+            if step != 1:
+                return [self[j] for j in xrange(start, stop, step)]
+            return self._read(start, stop)
+
+        if i < 0:
+            i += self._count
+        if not (0 <= i < self._count):
+            raise IndexError('MappedArray index out of range')
+        return self._item.unpack_from(self._buf, self._offset + i * self.itemsize)[0]
+
+    def __iter__(self):
+        for start in xrange(0, self._count, self._CHUNK):
+            for value in self._read(start, min(start + self._CHUNK, self._count)):
+                yield value
+
+    def tostring(self, start=0, stop=None):
+        u"""Return (str) the raw bytes of the items from `start` to `stop`, like
+        `array.array.tostring()`.
+        """
+        stop = self._count if (stop is None) else min(stop, self._count)
+        return self._buf[self._offset + start * self.itemsize:self._offset + stop * self.itemsize]
+
+    def _read(self, start, stop):
+        if stop <= start:
+            return []
+        fmt = '<{}{}'.format(stop - start, self._fmt)
+        return list(struct.unpack_from(fmt, self._buf, self._offset + start * self.itemsize))
+
+
+def _as_array(a):
+    if isinstance(a, array):
+        return a
+    typecode = {8: UINT64_TYPECODE, 4: UINT32_TYPECODE, 2: 'H', 1: 'B'}[a.itemsize]
+    return array(typecode, a)
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
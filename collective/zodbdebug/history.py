@@ -0,0 +1,480 @@
+# coding=utf8
+u"""Index of the history of the references between objects, to find when a reference was added
+or removed.
+
+The reference graph of `ZODBInfo` only holds the current revision of each object. When an object
+is missing (`POSKeyError`) the question is which transaction removed the last reference to it, or
+added a reference to an object which did not exist.
+
+The index is built in one pass over `storage.iterator()`: the references of each record are
+compared with the references of the previous revision of the object, and every added or removed
+reference is recorded as an event `(source, target, tid, added)`. Deleting an object removes all
+its references.
+
+Segments:
+    Events are stored in segments, files with the format of `.graphfile`, each one covering the
+    transactions from its first to its last tid. The index is append-only: an update reads the
+    transactions committed after the last indexed one and adds a segment, older segments are never
+    rewritten. Only small segments are merged, once there are more than `_MAX_SEGMENTS`. A pack
+    does not change the history already indexed, so the index keeps the references removed by it.
+
+    In a segment the events are sorted by source, target and tid, with a second order sorted by
+    target, source and tid, so the references of an object or the back references of an object at
+    any tid take a binary search in each segment. An event costs 29 bytes on disk.
+
+Memory:
+    While building, the references of the last revision of each object are kept in memory, packed
+    in a string per object, and the events of the current segment, at most `segment_size`.
+"""
+from .graphfile import GraphFileError
+from .graphfile import read_sections
+from .graphfile import write_sections
+from .graph import UINT32_TYPECODE
+from .graph import UINT64_TYPECODE
+from .graph import UINT8_TYPECODE
+from .transactions import close_iterator
+from .util import mkdirp
+from ZODB.serialize import referencesf
+from ZODB.utils import p64
+from ZODB.utils import tid_repr
+from ZODB.utils import u64
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from logging import getLogger
+from rbco.caseclasses import case
+import os
+import time
+
+log = getLogger(__name__)
+
+# Default maximum number of events of a segment.
+DEFAULT_SEGMENT_SIZE = 2000000
+
+# Number of segments above which the small segments are merged.
+_MAX_SEGMENTS = 16
+
+_SEGMENT_PREFIX = 'history_'
+_SECTION_NAMES = ('source', 'target', 'tid', 'added', 'by_target')
+
+_LOG_INTERVAL = 10.0
+
+
+def open_reference_history(storage, path, segment_size=DEFAULT_SEGMENT_SIZE):
+    u"""Open the reference history of `storage` stored in the directory `path`, updating it with
+    the transactions committed since it was stored.
+
+    The history is built from scratch when the storage has no transaction after the last indexed
+    one, i.e. the database was replaced.
+
+    Arguments:
+    storage (ZODB.interfaces.IStorage) -- The storage.
+    path (str) -- Directory of the segment files.
+    segment_size (int) -- Maximum number of events of a new segment.
+
+    Return (ReferenceHistory)
+    """
+    history = ReferenceHistory(_read_segments(path))
+    last_tid = history.last_tid
+    if (last_tid is not None) and (storage.lastTransaction() < last_tid):
+        log.warning('Rebuilding the reference history, the storage changed: {}'.format(path))
+        for segment in history.segments:
+            os.remove(segment.path)
+        history = ReferenceHistory()
+
+    if history.last_tid is None:
+        log.info('Building the reference history...')
+    history = _update(storage, history, path, segment_size)
+    if len(history.segments) > _MAX_SEGMENTS:
+        history = _merge_small_segments(history, path, segment_size)
+    return history
+
+
+class ReferenceHistory(object):
+    u"""The references between objects at any transaction.
+
+    Queries at a `tid` see the references after the transaction `tid` was committed. OIDs and tids
+    are given and returned as 8 byte strings.
+
+    Arguments:
+    segments (Sequence[Segment]) -- The segments, in commit order.
+    """
+
+    def __init__(self, segments=()):
+        self.segments = tuple(segments)
+
+    @property
+    def first_tid(self):
+        u"""(Optional[str]) The first indexed transaction."""
+        return self.segments[0].first_tid if self.segments else None
+
+    @property
+    def last_tid(self):
+        u"""(Optional[str]) The last indexed transaction."""
+        return self.segments[-1].last_tid if self.segments else None
+
+    def __len__(self):
+        u"""Return (int) the number of events."""
+        return sum(len(s) for s in self.segments)
+
+    def get_references(self, oid, tid=None):
+        u"""Return (Set[str]) the OIDs referenced by `oid` at `tid`, by default the last one."""
+        return self._get_state(oid, tid, 'source')
+
+    def get_back_references(self, oid, tid=None):
+        u"""Return (Set[str]) the OIDs referencing `oid` at `tid`, by default the last one."""
+        return self._get_state(oid, tid, 'target')
+
+    def get_reference_intervals(self, oid):
+        u"""Return (List[ReferenceInterval]) when `oid` referenced each object, sorted by target and
+        tid.
+        """
+        return self._get_intervals(oid, 'source', 'target')
+
+    def get_back_reference_intervals(self, oid):
+        u"""Return (List[ReferenceInterval]) when each object referenced `oid`, sorted by source and
+        tid.
+        """
+        return self._get_intervals(oid, 'target', 'source')
+
+    def get_first_reference_tid(self, source, target):
+        u"""Return (Optional[str]) the first transaction at which `source` referenced `target`,
+        `None` if it never did.
+        """
+        (source, target) = (u64(source), u64(target))
+        for segment in self.segments:
+            for (tid, added) in segment.iter_edge_events(source, target):
+                if added:
+                    return p64(tid)
+        return None
+
+    def _get_state(self, oid, tid, key):
+        (oid, tid) = (u64(oid), u64(tid) if (tid is not None) else None)
+        state = {}
+        for segment in self.segments:
+            if (tid is not None) and (u64(segment.first_tid) > tid):
+                break
+            for (other_oid, event_tid, added) in segment.iter_events(key, oid):
+                if (tid is None) or (event_tid <= tid):
+                    state[other_oid] = added
+        return {p64(o) for (o, added) in state.iteritems() if added}
+
+    def _get_intervals(self, oid, key, other):
+        oid = u64(oid)
+        # Open intervals by other OID.
+        added_tids = {}
+        intervals = []
+        for segment in self.segments:
+            for (other_oid, tid, added) in segment.iter_events(key, oid):
+                if added:
+                    added_tids[other_oid] = tid
+                elif other_oid in added_tids:
+                    intervals.append(self._make_interval(
+                        key, oid, other_oid, added_tids.pop(other_oid), tid
+                    ))
+        intervals.extend(
+            self._make_interval(key, oid, other_oid, tid, None)
+            for (other_oid, tid) in added_tids.iteritems()
+        )
+        intervals.sort(key=lambda i: (getattr(i, other), i.added_tid))
+        return intervals
+
+    def _make_interval(self, key, oid, other_oid, added_tid, removed_tid):
+        (source, target) = (oid, other_oid) if (key == 'source') else (other_oid, oid)
+        return ReferenceInterval(
+            source=p64(source),
+            target=p64(target),
+            added_tid=p64(added_tid),
+            removed_tid=p64(removed_tid) if (removed_tid is not None) else None,
+        )
+
+
+class Segment(object):
+    u"""The events of the transactions from `first_tid` to `last_tid`, see the module docstring.
+
+    Arguments:
+    path (str) -- Path of the file.
+    first_tid, last_tid (str) -- Transactions covered by the segment.
+    columns (Mapping[str, Sequence[int]]) -- The events, sorted by source, target and tid. OIDs and
+        tids are integers, `added` is 1 for an added reference and 0 for a removed one. `by_target`
+        holds the positions of the events sorted by target, source and tid.
+    """
+
+    def __init__(self, path, first_tid, last_tid, columns):
+        self.path = path
+        self.first_tid = first_tid
+        self.last_tid = last_tid
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['source'])
+
+    def iter_events(self, key, oid):
+        u"""Iterate over the events of the references from (`key == 'source'`) or to
+        (`key == 'target'`) the OID `oid`, an integer.
+
+        Return (Iterator[Tuple[int, int, int]]) -- `(other_oid, tid, added)` tuples, sorted by
+            other OID and tid.
+        """
+        columns = self.columns
+        if key == 'source':
+            (start, end) = _find_range(columns['source'], oid)
+            return iter(zip(
+                columns['target'][start:end], columns['tid'][start:end],
+                columns['added'][start:end],
+            ))
+
+        (sources, tids, added) = (columns['source'], columns['tid'], columns['added'])
+        positions = _find_range_of_positions(columns['target'], columns['by_target'], oid)
+        return ((sources[i], tids[i], added[i]) for i in positions)
+
+    def iter_edge_events(self, source, target):
+        u"""Return (Iterator[Tuple[int, int]]) the `(tid, added)` events of the reference from
+        `source` to `target`, integers, sorted by tid.
+        """
+        columns = self.columns
+        (start, end) = _find_range(columns['source'], source)
+        (start, end) = _find_range(columns['target'], target, start, end)
+        return iter(zip(columns['tid'][start:end], columns['added'][start:end]))
+
+
+def _find_range(values, value, start=0, end=None):
+    end = len(values) if (end is None) else end
+    start = bisect_left(values, value, start, end)
+    return (start, bisect_right(values, value, start, end))
+
+
+def _find_range_of_positions(values, positions, value):
+    u"""Return (List[int]) the items of `positions` pointing to `value` in `values`.
+
+    `positions` holds positions of `values` sorted by value, like an index.
+    """
+    (lo, hi) = (0, len(positions))
+    while lo < hi:
+        middle = (lo + hi) // 2
+        if values[positions[middle]] < value:
+            lo = middle + 1
+        else:
+            hi = middle
+    result = []
+    for i in xrange(lo, len(positions)):
+        position = positions[i]
+        if values[position] != value:
+            break
+        result.append(position)
+    return result
+
+
+def _update(storage, history, path, segment_size):
+    u"""Add segments with the transactions committed after the last one of `history`.
+
+    Return (ReferenceHistory)
+    """
+    last_tid = history.last_tid
+    iterator = storage.iterator(start=p64(u64(last_tid) + 1) if last_tid else None)
+    # The segments written by this update only hold objects which are in `current`.
+    old_history = history
+    # The references of the last revision of each object read, as a string of sorted OIDs.
+    current = {}
+    events = _EventBuffer()
+    start_time = last_log_time = time.time()
+    num_transactions = 0
+    try:
+        for transaction in iterator:
+            for record in transaction:
+                refs = sorted(set(referencesf(record.data))) if record.data else []
+                old_refs = current.get(record.oid)
+                if old_refs is None:
+                    # Not modified since the last update, or a new object.
+                    old_refs = sorted(old_history.get_references(record.oid))
+                else:
+                    old_refs = _unpack_oids(old_refs)
+                if refs != old_refs:
+                    events.add(record.oid, transaction.tid, old_refs, refs)
+                current[record.oid] = ''.join(refs)
+
+            events.last_tid = transaction.tid
+            if len(events) >= segment_size:
+                history = ReferenceHistory(history.segments + (events.write(path),))
+                events = _EventBuffer()
+
+            num_transactions += 1
+            now = time.time()
+            if now - last_log_time >= _LOG_INTERVAL:
+                last_log_time = now
+                log.info('Read the references of {} transactions in {:.1f}s.'.format(
+                    num_transactions, now - start_time))
+    finally:
+        close_iterator(iterator)
+
+    if events.last_tid is not None:
+        history = ReferenceHistory(history.segments + (events.write(path),))
+    return history
+
+
+def _unpack_oids(s):
+    return [s[i:i + 8] for i in xrange(0, len(s), 8)]
+
+
+class _EventBuffer(object):
+    u"""Events of the transactions read since the last segment was written."""
+
+    def __init__(self):
+        self.first_tid = None
+        self.last_tid = None
+        self.columns = {
+            'source': array(UINT64_TYPECODE),
+            'target': array(UINT64_TYPECODE),
+            'tid': array(UINT64_TYPECODE),
+            'added': array(UINT8_TYPECODE),
+        }
+
+    def __len__(self):
+        return len(self.columns['tid'])
+
+    def add(self, oid, tid, old_refs, refs):
+        u"""Add the events of a record whose references changed from `old_refs` to `refs`."""
+        if self.first_tid is None:
+            self.first_tid = tid
+        (old_refs, refs) = (set(old_refs), set(refs))
+        (source, tid) = (u64(oid), u64(tid))
+        columns = self.columns
+        for (targets, added) in [(refs - old_refs, 1), (old_refs - refs, 0)]:
+            for target in targets:
+                columns['source'].append(source)
+                columns['target'].append(u64(target))
+                columns['tid'].append(tid)
+                columns['added'].append(added)
+
+    def write(self, path):
+        u"""Sort the events and write them to a new segment file in the directory `path`.
+
+        Return (Segment) -- The segment, read from the file.
+        """
+        return _write_segment(
+            path, self.first_tid or self.last_tid, self.last_tid, self.columns, sort=True
+        )
+
+
+def _write_segment(path, first_tid, last_tid, columns, sort=False):
+    u"""Write a segment file.
+
+    Arguments:
+    path (str) -- Directory of the segment files.
+    first_tid, last_tid (str) -- Transactions covered by the segment.
+    columns (Mapping[str, array.array]) -- The events, in commit order if `sort`, otherwise sorted
+        by source, target and tid.
+    sort (bool) -- Sort the events.
+
+    Return (Segment)
+    """
+    (sources, targets) = (columns['source'], columns['target'])
+    if sort:
+        # The sort is stable and the events are in commit order, so they stay sorted by tid.
+        order = sorted(xrange(len(sources)), key=lambda i: (sources[i], targets[i]))
+        columns = {
+            name: array(values.typecode, (values[i] for i in order))
+            for (name, values) in columns.iteritems() if name != 'by_target'
+        }
+        (sources, targets) = (columns['source'], columns['target'])
+    by_target = array(
+        UINT32_TYPECODE,
+        sorted(xrange(len(sources)), key=lambda i: (targets[i], sources[i]))
+    )
+
+    mkdirp(path)
+    segment_path = os.path.join(path, '{}{:016x}_{:016x}'.format(
+        _SEGMENT_PREFIX, u64(first_tid), u64(last_tid)))
+    write_sections(
+        segment_path,
+        [(name, columns[name]) for name in _SECTION_NAMES if name != 'by_target'] +
+        [('by_target', by_target)],
+    )
+    log.info('Stored {} reference events of transactions {} to {}.'.format(
+        len(sources), tid_repr(first_tid), tid_repr(last_tid)))
+    return _read_segment(segment_path)
+
+
+def _read_segments(path):
+    u"""Return (List[Segment]) the segments stored in the directory `path`, in commit order.
+
+    Segments which cannot be read, or which overlap an earlier one (e.g. left by an interrupted
+    merge), are removed.
+    """
+    if not os.path.isdir(path):
+        return []
+
+    segments = []
+    for name in sorted(os.listdir(path)):
+        if not name.startswith(_SEGMENT_PREFIX) or name.endswith('.tmp'):
+            continue
+        segment_path = os.path.join(path, name)
+        try:
+            segment = _read_segment(segment_path)
+        except (GraphFileError, ValueError, KeyError) as e:
+            log.warning('Ignoring reference history segment: {}: {}'.format(segment_path, e))
+            continue
+        if segments and (segment.first_tid <= segments[-1].last_tid):
+            # Merged segments are written before the segments they replace are removed.
+            previous = segments.pop()
+            if segment.first_tid > previous.first_tid:
+                segments.append(previous)
+                os.remove(segment_path)
+                continue
+            os.remove(previous.path)
+        segments.append(segment)
+    return segments
+
+
+def _read_segment(path):
+    (first, last) = os.path.basename(path)[len(_SEGMENT_PREFIX):].split('_')
+    sections = read_sections(path)
+    try:
+        columns = {name: sections[name] for name in _SECTION_NAMES}
+    except KeyError as e:
+        raise GraphFileError('Not a reference history segment, missing section {}.'.format(e))
+    return Segment(path, p64(int(first, 16)), p64(int(last, 16)), columns)
+
+
+def _merge_small_segments(history, path, segment_size):
+    u"""Merge the last segments into one, as many as fit in `segment_size` events.
+
+    Return (ReferenceHistory)
+    """
+    segments = list(history.segments)
+    merged = []
+    size = 0
+    while segments and (size + len(segments[-1]) <= segment_size):
+        size += len(segments[-1])
+        merged.insert(0, segments.pop())
+    if len(merged) < 2:
+        return history
+
+    log.info('Merging {} reference history segments...'.format(len(merged)))
+    columns = {
+        name: array(typecode)
+        for (name, typecode) in [
+            ('source', UINT64_TYPECODE), ('target', UINT64_TYPECODE), ('tid', UINT64_TYPECODE),
+            ('added', UINT8_TYPECODE),
+        ]
+    }
+    # Concatenated in commit order, then sorted like the events of a new segment.
+    for segment in merged:
+        order = sorted(xrange(len(segment)), key=segment.columns['tid'].__getitem__)
+        for (name, values) in columns.iteritems():
+            segment_values = segment.columns[name]
+            values.extend(segment_values[i] for i in order)
+    segment = _write_segment(path, merged[0].first_tid, merged[-1].last_tid, columns, sort=True)
+    for old in merged:
+        os.remove(old.path)
+    return ReferenceHistory(segments + [segment])
+
+
+@case
+class ReferenceInterval(object):
+    u"""A reference from `source` to `target`, added by the transaction `added_tid` and removed by
+    the transaction `removed_tid`, `None` if it still exists.
+    """
+
+    def __init__(self, source, target, added_tid, removed_tid=None):
+        pass
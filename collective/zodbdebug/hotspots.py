@@ -0,0 +1,246 @@
+# coding=utf8
+u"""Find the objects which are written most often.
+
+Objects rewritten by many transactions cause `ConflictError`s and make the storage grow. The
+transaction log is read once, as a stream, and memory usage is bounded whatever its length:
+
+- Writes by OID and pairs of OIDs modified by the same transaction are counted in `TopK` counters,
+  which only keep the most frequent keys, with a bound of the error of each count.
+- Writes by class are counted exactly, since there are few classes.
+
+`get_subtree_hotspots()` then adds the writes of the hottest objects up the containment tree given
+by their OID paths (see `ZODBInfo.get_oid_paths()`), like `.sizes.get_subtree_sizes()` does for
+sizes.
+"""
+from .pickles import get_class_name
+from .transactions import iter_storage_transactions
+from logging import getLogger
+from rbco.caseclasses import case
+import itertools
+import time
+
+log = getLogger(__name__)
+
+_LOG_INTERVAL = 10.0
+
+
+class TopK(object):
+    u"""Approximate counts of the most frequent keys of a stream, in bounded memory.
+
+    A variant of the Space-Saving algorithm which evicts keys in batches: at most `2 * capacity`
+    keys are counted, and when there are more only the `capacity` keys with the largest counts are
+    kept. `floor` is the largest count evicted so far, which is at least the true count of any key
+    not counted. A key added after an eviction may have been counted and evicted before, so it
+    starts from `floor` and `floor` is its error: its count is overestimated by at most its error,
+    and the true count is at least `count - error`. Keys added before the first eviction have exact
+    counts.
+
+    Each key also accumulates a `size`, e.g. bytes written, of the occurrences counted since it was
+    added, i.e. of `count - error` of them.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.floor = 0
+        self._counts = {}
+
+    def add(self, key, count=1, size=0):
+        entry = self._counts.get(key)
+        if entry is None:
+            self._counts[key] = [self.floor + count, self.floor, size]
+            if len(self._counts) > 2 * self.capacity:
+                self._prune()
+        else:
+            entry[0] += count
+            entry[2] += size
+
+    def most_common(self, n=None):
+        u"""Return (List[Tuple[Any, int, int, int]]) `(key, count, error, size)` tuples, largest
+        count first.
+        """
+        items = sorted(self._counts.iteritems(), key=lambda i: (-i[1][0], i[0]))
+        return [
+            (key, count, error, size)
+            for (key, (count, error, size)) in items[:n or self.capacity]
+        ]
+
+    def _prune(self):
+        items = sorted(self._counts.iteritems(), key=lambda i: -i[1][0])
+        self.floor = max(self.floor, items[self.capacity][1][0])
+        self._counts = dict(items[:self.capacity])
+
+
+class WriteStats(object):
+    u"""Statistics of the writes of a stream of transactions.
+
+    Arguments:
+    top (int) -- Number of OIDs and pairs of OIDs kept.
+    max_transaction_size (int) -- Pairs are only counted in transactions with at most this number
+        of records, since a transaction with `n` records has `n * (n - 1) / 2` pairs. Bulk changes,
+        e.g. imports or reindexing, rarely tell anything about conflicts.
+    """
+
+    def __init__(self, top=100, max_transaction_size=100):
+        self.max_transaction_size = max_transaction_size
+        self.transactions = 0
+        self.records = 0
+        self.size = 0
+        self.first_tid = None
+        self.last_tid = None
+        self.oids = TopK(top)
+        self.pairs = TopK(top)
+        self.classes = {}
+
+    def add_transaction(self, transaction):
+        u"""Add the records of a storage transaction."""
+        self.transactions += 1
+        self.first_tid = self.first_tid or transaction.tid
+        self.last_tid = transaction.tid
+
+        oids = []
+        for record in transaction:
+            size = len(record.data or '')
+            self.records += 1
+            self.size += size
+            self.oids.add(record.oid, size=size)
+            oids.append(record.oid)
+
+            class_name = get_class_name(record.data) if record.data else ''
+            totals = self.classes.get(class_name)
+            if totals is None:
+                totals = self.classes[class_name] = [0, 0]
+            totals[0] += 1
+            totals[1] += size
+
+        if 1 < len(oids) <= self.max_transaction_size:
+            for pair in itertools.combinations(sorted(set(oids)), 2):
+                self.pairs.add(pair)
+
+    def get_oid_writes(self, n=None):
+        u"""Return (List[OIDWrites]) the most written OIDs, most writes first."""
+        return [
+            OIDWrites(oid=oid, count=count, size=size, error=error)
+            for (oid, count, error, size) in self.oids.most_common(n)
+        ]
+
+    def get_class_writes(self, n=None):
+        u"""Return (List[ClassWrites]) the writes by class, most writes first."""
+        result = [
+            ClassWrites(class_name=class_name or None, count=count, size=size)
+            for (class_name, (count, size)) in self.classes.iteritems()
+        ]
+        result.sort(key=lambda c: (-c.count, -c.size, c.class_name))
+        return result[:n]
+
+    def get_pair_writes(self, n=None):
+        u"""Return (List[PairWrites]) the pairs of OIDs most often written together."""
+        return [
+            PairWrites(oids=pair, count=count, error=error)
+            for (pair, count, error, _) in self.pairs.most_common(n)
+        ]
+
+
+def analyze_writes(storage, index, start=0, stop=None, top=100, max_transaction_size=100):
+    u"""Read the transactions `start` to `stop` and count their writes.
+
+    Arguments:
+    storage (ZODB.interfaces.IStorage) -- The storage.
+    index (TransactionIndex) -- Its transaction index, see `ZODBInfo.get_transaction_index()`.
+    start (int) -- Position of the first transaction in `index`.
+    stop (Optional[int]) -- Position after the last transaction, the end of `index` by default.
+    top (int) -- See `WriteStats`.
+    max_transaction_size (int) -- See `WriteStats`.
+
+    Return (WriteStats)
+    """
+    stats = WriteStats(top=top, max_transaction_size=max_transaction_size)
+    start_time = last_log_time = time.time()
+    for transaction in iter_storage_transactions(storage, index, start, stop):
+        stats.add_transaction(transaction)
+        now = time.time()
+        if now - last_log_time >= _LOG_INTERVAL:
+            last_log_time = now
+            log.info('Read {} transactions with {} records in {:.1f}s.'.format(
+                stats.transactions, stats.records, now - start_time))
+    return stats
+
+
+def get_subtree_hotspots(zodb_info, oid_writes, max_depth=None):
+    u"""Add the writes of objects to every object in their OID paths, most writes first.
+
+    Only the given objects are counted, usually the most written ones, with the writes they surely
+    have (`count - error`), so the totals are lower bounds.
+
+    Arguments:
+    zodb_info (ZODBInfo) -- With the reference maps built.
+    oid_writes (Iterable[OIDWrites]) -- Writes by object.
+    max_depth (Optional[int]) -- Only return subtrees up to this depth, the root has depth 0.
+
+    Return (List[SubtreeWrites])
+    """
+    oid_writes = list(oid_writes)
+    oid_paths = zodb_info.get_oid_paths(w.oid for w in oid_writes)
+    root_oid = zodb_info.root_oid
+    totals = {}
+    for w in oid_writes:
+        oid_path = oid_paths[w.oid]
+        if oid_path[-1] != root_oid:
+            continue
+
+        depth = len(oid_path) - 1
+        for (i, oid) in enumerate(oid_path):
+            total = totals.get(oid)
+            if total is None:
+                total = totals[oid] = [depth - i, 0, 0]
+            total[1] += w.count - w.error
+            total[2] += w.size
+
+    result = [
+        SubtreeWrites(oid=oid, depth=depth, count=count, size=size)
+        for (oid, (depth, count, size)) in totals.iteritems()
+        if (max_depth is None) or (depth <= max_depth)
+    ]
+    result.sort(key=lambda s: (-s.count, s.depth, s.oid))
+    return result
+
+
+@case
+class OIDWrites(object):
+    u"""Number of records of an object and their total size, in bytes.
+
+    `count` is overestimated by at most `error`, and `size` is the size of `count - error` records,
+    see `TopK`.
+    """
+
+    def __init__(self, oid, count, size, error=0):
+        pass
+
+
+@case
+class ClassWrites(object):
+    u"""Number of records of the objects of a class and their total size, in bytes."""
+
+    def __init__(self, class_name, count, size):
+        pass
+
+
+@case
+class PairWrites(object):
+    u"""Number of transactions which wrote both objects of a pair.
+
+    `count` is overestimated by at most `error`, see `TopK`.
+    """
+
+    def __init__(self, oids, count, error=0):
+        pass
+
+
+@case
+class SubtreeWrites(object):
+    u"""Writes of the most written objects of a subtree, including the object itself.
+
+    `depth` is the distance from the root.
+    """
+
+    def __init__(self, oid, depth, count, size):
+        pass
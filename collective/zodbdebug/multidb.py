@@ -0,0 +1,310 @@
+# coding=utf8
+u"""Reference graph of a multi-database, e.g. a Zope site with mounted catalog databases.
+
+A connection of a multi-database opens a connection to each database on demand
+(`connection.get_connection(name)`), and an object of one database can reference an object of
+another one with a cross-database reference. `referencesf()` ignores these references, so the
+graph of each database (see `.core.ZODBInfo`) only holds them as the `xrefs` attribute of
+their source (see `.graph.encode_external_references()`).
+
+`MultiDatabaseInfo` keeps a `ZODBInfo` per database, each with its own graph, reference cache
+(keyed by the last transaction of its own storage) and result caches, since the same OID means
+different objects in different databases. Objects are identified by `(database name, OID)` keys,
+and the references and back references of a key include the cross-database ones. The graphs are
+built concurrently, one thread per database. With `workers` each thread also uses its own pool
+of worker processes (see `.parallel`).
+
+OID paths cross databases: when the path of an object in its own database does not reach the
+root of the main database, it continues from a mount point (see `find_zope_mount_points()`), or
+else from an object of another database referencing it.
+
+With the default engine each graph only holds the objects reachable from the root of its own
+database. Objects only referenced from other databases are missing from it, see
+`get_unresolved_references()`. Use `ENGINE_SCAN` to include every stored object.
+"""
+from .core import ENGINE_TRAVERSE
+from .core import ZODBInfo
+from .util import pairwise
+from ZODB.utils import oid_repr
+from ZODB.utils import repr_to_oid
+from logging import getLogger
+from multiprocessing.pool import ThreadPool
+import collections
+
+log = getLogger(__name__)
+
+# Class of the mount points of `Products.ZODBMountPoint`.
+_ZOPE_MOUNT_POINT_CLASS = 'Products.ZODBMountPoint.MountedObject.MountedObject'
+_ZOPE_APPLICATION_KEY = 'Application'
+
+
+class MultiDatabaseInfo(object):
+    u"""The reference graph of every database of a multi-database, see the module docstring.
+
+    Arguments:
+    connection -- Connection to any database of the multi-database, e.g. `app._p_jar`.
+    compact_graph, workers, engine -- See `ZODBInfo`.
+    storage_openers (Optional[Mapping[str, StorageOpener]]) -- Opener of the storage of each
+        database used by the worker processes, by database name. Not needed for FileStorage.
+    mount_points (Optional[Mapping[Tuple[str, str], Tuple[str, str]]]) -- Key of the mount point
+        by key of the mounted object, see `get_oid_path()` and `find_zope_mount_points()`.
+    """
+
+    def __init__(
+        self, connection, compact_graph=False, workers=1, engine=ENGINE_TRAVERSE,
+        storage_openers=None, mount_points=None,
+    ):
+        self.connection = connection
+        self.main_database_name = connection.db().database_name
+        self.mount_points = dict(mount_points or {})
+        storage_openers = storage_openers or {}
+
+        # The main database comes first.
+        names = sorted(connection.db().databases, key=lambda n: (n != self.main_database_name, n))
+        self.zodb_infos = collections.OrderedDict(
+            (name, ZODBInfo(
+                connection.get_connection(name), compact_graph=compact_graph, workers=workers,
+                storage_opener=storage_openers.get(name), engine=engine,
+            ))
+            for name in names
+        )
+        self._external_back_references = None
+
+    @property
+    def database_names(self):
+        u"""(List[str]) Names of the databases, the main one first."""
+        return list(self.zodb_infos)
+
+    @property
+    def root_key(self):
+        u"""(Tuple[str, str]) Key of the root object of the main database."""
+        return (self.main_database_name, self.zodb_infos[self.main_database_name].root_oid)
+
+    def key_to_repr(self, key):
+        u"""Return (str) the representation of a key, e.g. `main:0x1a2b`."""
+        (name, oid) = key
+        return '{}:{}'.format(name, oid_repr(oid))
+
+    def repr_to_key(self, key_repr):
+        u"""Inverse of `key_to_repr()`. An OID representation alone is in the main database."""
+        (name, _, oid) = key_repr.rpartition(':')
+        return (name or self.main_database_name, repr_to_oid(oid))
+
+    # References -----------------------------------------------------------------------------------
+
+    def build_reference_maps(self):
+        u"""Build the reference graph of every database, concurrently."""
+        zodb_infos = self.zodb_infos.values()
+        pool = ThreadPool(len(zodb_infos))
+        try:
+            # `map_async()` makes the wait interruptible with Ctrl+C.
+            pool.map_async(_build_reference_maps, zodb_infos).get(timeout=1e9)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        for (name, zodb_info) in self.zodb_infos.iteritems():
+            if not zodb_info.has_external_references():
+                log.warning(
+                    'The cached reference graph of database {!r} does not hold the cross-database '
+                    'references. Remove its cache directory to build it again: {}'.format(
+                        name, zodb_info._get_cache_dir())
+                )
+        self._external_back_references = self._get_external_back_references()
+        log.info('Found {} cross-database references.'.format(
+            sum(len(sources) for sources in self._external_back_references.itervalues())))
+
+    def __len__(self):
+        return sum(len(zodb_info.graph) for zodb_info in self.zodb_infos.itervalues())
+
+    def __contains__(self, key):
+        (name, oid) = key
+        zodb_info = self.zodb_infos.get(name)
+        return (zodb_info is not None) and (oid in zodb_info.oids)
+
+    def iter_keys(self):
+        u"""Return (Iterator[Tuple[str, str]]) the key of every object of every graph."""
+        for (name, zodb_info) in self.zodb_infos.iteritems():
+            for oid in zodb_info.oids:
+                yield (name, oid)
+
+    def get_references(self, key):
+        u"""Return (Set[Tuple[str, str]]) the keys of the objects referenced by `key`."""
+        (name, oid) = key
+        zodb_info = self.zodb_infos[name]
+        references = {(name, r) for r in zodb_info.get_references(oid)}
+        references.update(zodb_info.get_external_references(oid))
+        return references
+
+    def get_back_references(self, key):
+        u"""Return (Set[Tuple[str, str]]) the keys of the objects referencing `key`."""
+        (name, oid) = key
+        back_references = {(name, r) for r in self.zodb_infos[name].get_back_references(oid)}
+        back_references.update(self.get_external_back_references(key))
+        return back_references
+
+    def get_external_back_references(self, key):
+        u"""Return (Set[Tuple[str, str]]) the keys of the objects of other databases referencing
+        `key`.
+        """
+        if self._external_back_references is None:
+            raise RuntimeError(u'Reference map is not built. Call `build_reference_maps()`.')
+        return self._external_back_references.get(key, set())
+
+    def get_external_reference_counts(self):
+        u"""Return (Dict[Tuple[str, str], int]) the number of cross-database references by
+        `(source database name, target database name)`.
+        """
+        if self._external_back_references is None:
+            raise RuntimeError(u'Reference map is not built. Call `build_reference_maps()`.')
+        counts = collections.Counter()
+        for ((target_name, _), sources) in self._external_back_references.iteritems():
+            for (source_name, _) in sources:
+                counts[(source_name, target_name)] += 1
+        return dict(counts)
+
+    def get_unresolved_references(self):
+        u"""Get the cross-database references whose target is not in the graph of its database,
+        either because the database is not part of the multi-database or because the target is
+        only reachable through cross-database references, see the module docstring.
+
+        Return (List[Tuple[Tuple[str, str], Tuple[str, str]]]) -- `(source, target)` key pairs,
+        sorted.
+        """
+        if self._external_back_references is None:
+            raise RuntimeError(u'Reference map is not built. Call `build_reference_maps()`.')
+        return sorted(
+            (source, target)
+            for (target, sources) in self._external_back_references.iteritems()
+            if target not in self for source in sources
+        )
+
+    def _get_external_back_references(self):
+        back_references = {}
+        for (name, zodb_info) in self.zodb_infos.iteritems():
+            if not zodb_info.has_external_references():
+                continue
+            for (oid, value) in zodb_info.graph.iter_attributes('xrefs'):
+                if not value:
+                    continue
+                for target in zodb_info.get_external_references(oid):
+                    back_references.setdefault(target, set()).add((name, oid))
+        return back_references
+
+    # Paths ----------------------------------------------------------------------------------------
+
+    def get_oid_path(self, key):
+        u"""Given a `key` return its path of keys, from `key` to the root of the main database.
+
+        The OID path of the object in its own database is followed (see `ZODBInfo.get_oid_path()`)
+        up to the first mounted object in `mount_points`, which is replaced by its mount point, or
+        up to the root of the database. From there the path continues in the database of the mount
+        point, or from the first object of another database which references the last object of
+        the path. Each database is crossed at most once.
+
+        Return (Tuple[Tuple[str, str]])
+        """
+        path = []
+        visited_names = set()
+        (name, oid) = key
+        while True:
+            visited_names.add(name)
+            oid_path = self.zodb_infos[name].get_oid_path(oid)
+            mount_point = None
+            for (i, path_oid) in enumerate(oid_path):
+                mount_point = self.mount_points.get((name, path_oid))
+                if mount_point is not None:
+                    oid_path = oid_path[:i + 1]
+                    break
+            path.extend((name, o) for o in oid_path)
+            if path[-1] == self.root_key:
+                break
+
+            if mount_point is not None:
+                # The mounted object replaces its mount point.
+                (name, mount_point_oid) = mount_point
+                oid_path = self.zodb_infos[name].get_oid_path(mount_point_oid)
+                if len(oid_path) < 2:
+                    break
+                oid = oid_path[1]
+            else:
+                sources = sorted(
+                    s for s in self.get_external_back_references(path[-1])
+                    if s[0] not in visited_names
+                )
+                if not sources:
+                    break
+                (name, oid) = sources[0]
+
+            if name in visited_names:
+                break
+        return tuple(path)
+
+    def get_id_path(self, key):
+        u"""Given a `key` return an ID path, see `get_oid_path()` and `ZODBInfo.get_id_path()`.
+
+        At a mount point the id of the mounted object is used, and across a cross-database
+        reference only the id of the referenced object, since its attribute name is unknown.
+
+        Return (Tuple[str])
+        """
+        result = []
+        for ((name, oid), parent) in pairwise(self.get_oid_path(key), (None, None)):
+            (parent_name, parent_oid) = parent
+            zodb_info = self.zodb_infos[name]
+            if parent_name in (name, None):
+                result.append(zodb_info.get_id_or_attr_name(oid, parent_oid=parent_oid))
+            else:
+                result.append(zodb_info.get_id(oid))
+        return tuple(result)
+
+
+def find_zope_mount_points(multidb_info):
+    u"""Find the mount points of `Products.ZODBMountPoint` in the graphs, for
+    `MultiDatabaseInfo.mount_points`.
+
+    A mount point stores the path of the mounted object, which is at the same path from the
+    `Application` object at the root of the mounted database. The database of each path is read
+    from the Zope configuration, so this only works in a Zope process, e.g. a `zopectl` command.
+    The mount points and the objects on the paths are loaded.
+
+    Return (Dict[Tuple[str, str], Tuple[str, str]]) -- Key of the mount point by key of the
+        mounted object.
+    """
+    try:
+        from App.config import getConfiguration
+        dbtab = getConfiguration().dbtab
+    except (ImportError, AttributeError):
+        log.info('Not running in Zope, no mount points.')
+        return {}
+
+    result = {}
+    for (name, zodb_info) in multidb_info.zodb_infos.iteritems():
+        if not zodb_info.graph.has_attribute('class_name'):
+            continue
+        for (oid, class_name) in zodb_info.graph.iter_attributes('class_name'):
+            if class_name != _ZOPE_MOUNT_POINT_CLASS:
+                continue
+            try:
+                path = zodb_info.get_obj(oid)._path
+                mounted_name = dbtab.getName(path)
+                mounted_info = multidb_info.zodb_infos[mounted_name]
+                root = mounted_info.connection.root()[_ZOPE_APPLICATION_KEY]
+                mounted = _traverse(root, path)
+            except Exception as e:  # noqa
+                log.warning('Cannot resolve the mount point {}: {}'.format(
+                    multidb_info.key_to_repr((name, oid)), e))
+                continue
+            result[(mounted_name, mounted._p_oid)] = (name, oid)
+    return result
+
+
+def _traverse(obj, path):
+    for name in filter(None, path.split('/')):
+        get_object = getattr(obj, '_getOb', None)
+        obj = get_object(name) if get_object else obj[name]
+    return obj
+
+
+def _build_reference_maps(zodb_info):
+    zodb_info.build_reference_maps()
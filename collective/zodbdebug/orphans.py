@@ -0,0 +1,179 @@
+# coding=utf8
+u"""Find the objects which are stored but not reachable from the root.
+
+The reference maps only contain unreachable objects when they are built with the `scan` engine (see
+`.core.ENGINE_SCAN`), since the default engine only visits objects reachable from the root.
+
+`get_orphaned_blobs()` finds the blob files of objects which are deleted or unreachable, and the
+old revisions of the blobs of the other objects, with either engine.
+"""
+from rbco.caseclasses import case
+import itertools
+import os
+
+# Reasons of an `OrphanedBlob`.
+BLOB_DELETED = 'deleted'
+BLOB_UNREACHABLE = 'unreachable'
+BLOB_OLD_REVISION = 'old revision'
+
+
+def get_unreachable_objects(zodb_info, oids=None):
+    u"""Get the unreachable objects, largest first.
+
+    Arguments:
+    zodb_info (ZODBInfo) -- With the reference maps built.
+    oids (Optional[Iterable[str]]) -- Unreachable OIDs, if already known.
+
+    Return (List[UnreachableObject])
+    """
+    if oids is None:
+        oids = zodb_info.get_unreachable_oids()
+
+    result = [
+        UnreachableObject(
+            oid=oid,
+            class_name=zodb_info.get_class_name(oid),
+            size=zodb_info.get_record_size(oid),
+        )
+        for oid in oids
+    ]
+    result.sort(key=lambda o: (-(o.size or 0), o.oid))
+    return result
+
+
+def get_unreachable_subgraphs(zodb_info, oids=None):
+    u"""Group the unreachable objects in subgraphs, largest first.
+
+    A subgraph is a set of unreachable objects connected by references, in any direction. Removing
+    the references to an object usually makes a whole subgraph unreachable, e.g. a deleted folder
+    together with its contents.
+
+    Arguments:
+    zodb_info (ZODBInfo) -- With the reference maps built.
+    oids (Optional[Iterable[str]]) -- Unreachable OIDs, if already known.
+
+    Return (List[UnreachableSubgraph])
+    """
+    if oids is None:
+        oids = zodb_info.get_unreachable_oids()
+
+    # Union-find over the references between unreachable objects.
+    parents = {oid: oid for oid in oids}
+
+    def find(oid):
+        root = oid
+        while parents[root] != root:
+            root = parents[root]
+        while parents[oid] != root:
+            (parents[oid], oid) = (root, parents[oid])
+        return root
+
+    for oid in parents:
+        for ref in zodb_info.get_references(oid):
+            if ref in parents:
+                (a, b) = (find(oid), find(ref))
+                if a != b:
+                    parents[max(a, b)] = min(a, b)
+
+    groups = {}
+    for oid in parents:
+        groups.setdefault(find(oid), []).append(oid)
+
+    result = []
+    for members in groups.itervalues():
+        members.sort()
+        member_set = set(members)
+        entry_oids = tuple(
+            oid for oid in members
+            if member_set.isdisjoint(zodb_info.get_back_references(oid))
+        )
+        result.append(UnreachableSubgraph(
+            oids=tuple(members),
+            size=sum(zodb_info.get_record_size(oid) or 0 for oid in members),
+            entry_oids=entry_oids or (members[0],),
+        ))
+    result.sort(key=lambda g: (-g.size, g.oids[0]))
+    return result
+
+
+def get_orphaned_blobs(zodb_info, blob_paths=None):
+    u"""Get the blob files whose object has no current record or is not reachable from the root,
+    and the files of the other objects which are not their current revision, largest first. These
+    files are removed by the next pack.
+
+    Only the objects which are not in the reference maps are loaded, to tell deleted objects from
+    unreachable ones, and the objects with several blob files, to find their current revision.
+
+    Arguments:
+    zodb_info (ZODBInfo) -- With the reference maps built.
+    blob_paths (Optional[Iterable[str]]) -- Paths of the blob files, all by default. The files of
+        an object must be consecutive, as in the blob directory.
+
+    Return (List[OrphanedBlob])
+    """
+    if blob_paths is None:
+        blob_paths = zodb_info.iter_blob_paths()
+
+    oids = zodb_info.oids
+    unreachable_oids = zodb_info.get_unreachable_oids()
+    result = []
+    for (oid, paths) in itertools.groupby(blob_paths, zodb_info.blob_path_to_oid):
+        paths = list(paths)
+        record_size = zodb_info.get_record_size(oid)
+        if (oid in oids) and (oid not in unreachable_oids) and record_size:
+            if len(paths) == 1:
+                continue
+            tid = zodb_info.get_record_tid(oid)
+            paths = [p for p in paths if zodb_info.blob_path_to_tid(p) != tid]
+            reason = BLOB_OLD_REVISION
+        else:
+            # Objects deleted in transactions applied incrementally are kept in the maps with
+            # size 0.
+            reason = BLOB_UNREACHABLE if record_size else BLOB_DELETED
+
+        for path in paths:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            result.append(OrphanedBlob(path=path, oid=oid, size=size, reason=reason))
+
+    result.sort(key=lambda b: (-b.size, b.path))
+    return result
+
+
+@case
+class UnreachableObject(object):
+    u"""An object which is stored but not reachable from the root.
+
+    `size` is the size of the pickle of its current record, in bytes.
+    """
+
+    def __init__(self, oid, class_name=None, size=None):
+        pass
+
+
+@case
+class UnreachableSubgraph(object):
+    u"""A set of unreachable objects connected by references.
+
+    `size` is the sum of the record sizes. `entry_oids` are the members not referenced by other
+    members, usually the object whose reference was removed. If every member is referenced by
+    another one (a cycle), the smallest OID is used.
+    """
+
+    def __init__(self, oids, size, entry_oids):
+        pass
+
+
+@case
+class OrphanedBlob(object):
+    u"""A blob file whose object is deleted or unreachable, or which is an old revision of the blob
+    of its object.
+
+    `size` is the size of the file, in bytes, and `reason` is `BLOB_DELETED`, `BLOB_UNREACHABLE` or
+    `BLOB_OLD_REVISION`.
+    """
+
+    def __init__(self, path, oid, size, reason):
+        pass
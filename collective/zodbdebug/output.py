@@ -0,0 +1,84 @@
+# coding=utf8
+u"""Machine-readable output of the scripts, one record per line.
+
+- `FORMAT_JSONL`: a JSON object per record (JSON Lines).
+- `FORMAT_CSV`: comma-separated values, with a header line.
+
+Each record is written as soon as it is produced, and the scripts call `flush()` after each batch,
+so the output can be processed while the script is running, and reports with millions of records
+are never held in memory. `FORMAT_TEXT` is the free-form text output of each script.
+"""
+import collections
+import csv
+import json
+import sys
+
+FORMAT_TEXT = 'text'
+FORMAT_JSONL = 'jsonl'
+FORMAT_CSV = 'csv'
+FORMATS = (FORMAT_TEXT, FORMAT_JSONL, FORMAT_CSV)
+
+
+def make_record_writer(output_format, fields, stream=None):
+    u"""Create a writer of records.
+
+    Arguments:
+    output_format (str) -- `FORMAT_JSONL` or `FORMAT_CSV`.
+    fields (Sequence[str]) -- Names of the fields of the records, in order.
+    stream (Optional[file]) -- Where the records are written, by default `sys.stdout`.
+
+    Return (Union[JSONLinesWriter, CSVWriter])
+    """
+    writers = {FORMAT_JSONL: JSONLinesWriter, FORMAT_CSV: CSVWriter}
+    if output_format not in writers:
+        raise ValueError('Unknown output format: {}'.format(output_format))
+    return writers[output_format](fields, stream or sys.stdout)
+
+
+class JSONLinesWriter(object):
+    u"""Write records as JSON objects, one per line. Missing fields are `null`."""
+
+    def __init__(self, fields, stream):
+        self.fields = fields
+        self.stream = stream
+
+    def write(self, record):
+        u"""Write a record, a mapping of field names to strings, numbers or `None`."""
+        data = collections.OrderedDict((f, _to_text(record.get(f))) for f in self.fields)
+        self.stream.write(json.dumps(data) + '\n')
+
+    def flush(self):
+        self.stream.flush()
+
+
+class CSVWriter(object):
+    u"""Write records as CSV lines, after a header line. Missing fields are empty."""
+
+    def __init__(self, fields, stream):
+        self.fields = fields
+        self.stream = stream
+        self._writer = csv.writer(stream)
+        self._writer.writerow(fields)
+
+    def write(self, record):
+        u"""Write a record, a mapping of field names to strings, numbers or `None`."""
+        self._writer.writerow([_to_csv(record.get(f)) for f in self.fields])
+
+    def flush(self):
+        self.stream.flush()
+
+
+def _to_text(value):
+    # Ids and object representations are byte strings which JSON can only encode if they are valid
+    # UTF-8.
+    if isinstance(value, str):
+        return value.decode('utf8', 'replace')
+    return value
+
+
+def _to_csv(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    return value
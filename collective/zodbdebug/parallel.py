@@ -0,0 +1,246 @@
+# coding=utf8
+u"""Build the reference graph using a pool of worker processes.
+
+Each worker opens its own read-only storage (see `StorageOpener`) and receives batches of OIDs. For
+each OID it loads the current record and reads the referenced OIDs, the class name, the id and
+the attribute names without unpickling it (see `.pickles`). The results are sent back to the
+coordinator as a byte string, where they are added to the graph builder and new OIDs are scheduled.
+
+`find_missing_records()` checks which OIDs have no current record the same way, each worker
+receiving a range of OIDs.
+"""
+from .graph import encode_external_references
+from .pickles import get_class_name
+from .pickles import get_state_info
+from ZODB.POSException import POSKeyError
+from logging import getLogger
+import collections
+import marshal
+import multiprocessing
+import time
+
+log = getLogger(__name__)
+
+# Storage opened by `_init_worker()` in each worker process.
+_worker_storage = None
+
+
+class StorageOpener(object):
+    u"""Picklable callable which opens a read-only storage in a worker process.
+
+    Arguments:
+    config (Optional[str]) -- ZConfig storage section, e.g. `<filestorage>`, `<zeoclient>` or
+        `<relstorage>`. It should be configured as read-only.
+    file_name (Optional[str]) -- Path of a `Data.fs` file, used when no `config` is given.
+    """
+
+    def __init__(self, config=None, file_name=None):
+        if not (config or file_name):
+            raise ValueError('Either a storage configuration or a file name is needed.')
+        self.config = config
+        self.file_name = file_name
+
+    @classmethod
+    def for_storage(cls, storage):
+        u"""Return (StorageOpener) an opener for a read-only copy of `storage`.
+
+        Only `FileStorage` can be detected automatically. For other storages a `StorageOpener` must
+        be created with an explicit configuration.
+        """
+        file_name = getattr(storage, '_file_name', None)
+        if not file_name:
+            raise ValueError(
+                'Cannot open {} in worker processes. Pass a storage configuration.'.format(
+                    type(storage).__name__)
+            )
+        return cls(file_name=file_name)
+
+    def __call__(self):
+        if self.config:
+            from ZODB.config import storageFromString
+            return storageFromString(self.config)
+
+        from ZODB.FileStorage import FileStorage
+        return FileStorage(self.file_name, read_only=True)
+
+
+def build_graph_in_parallel(builder, root_oid, storage_opener, workers, batch_size=1000):
+    u"""Traverse the references starting at `root_oid` using worker processes.
+
+    Arguments:
+    builder -- A graph builder (see `.graph.make_graph_builder()`).
+    root_oid (str) -- OID where the traversal starts.
+    storage_opener (Callable[[], IStorage]) -- Picklable callable used by the workers to open the
+        storage.
+    workers (int) -- Number of worker processes.
+    batch_size (int) -- Number of OIDs sent to a worker at once.
+
+    Return (BuildStats)
+    """
+    stats = BuildStats(workers)
+    pool = multiprocessing.Pool(workers, _init_worker, (storage_opener,))
+    try:
+        visited = {root_oid}
+        pending = [root_oid]
+        in_flight = collections.deque()
+        max_in_flight = workers * 2
+
+        while pending or in_flight:
+            while pending and (len(in_flight) < max_in_flight):
+                batch = pending[-batch_size:]
+                del pending[-batch_size:]
+                in_flight.append(pool.apply_async(_load_references, (batch,)))
+
+            encoded = _get_result(in_flight.popleft())
+            stats.batches += 1
+            for item in decode_references(encoded):
+                (oid, size, class_name, identifier, refs, attr_names, xrefs) = item
+                if size is None:
+                    # A dangling reference, the OID stays in the graph without a record.
+                    stats.missing += 1
+                    continue
+                builder.add_references(
+                    oid, refs, edge_attributes={'attr_name': attr_names}, size=size,
+                    class_name=class_name, id=identifier, xrefs=xrefs,
+                )
+                stats.records += 1
+                stats.references += len(refs)
+                for r in refs:
+                    if r not in visited:
+                        visited.add(r)
+                        pending.append(r)
+
+            stats.log_progress()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    stats.log_progress(force=True)
+    return stats
+
+
+def find_missing_records(oids, storage_opener, workers, batch_size=10000):
+    u"""Find the OIDs without a current record, using worker processes.
+
+    The OIDs are sorted and split in ranges of `batch_size` consecutive OIDs, which are close to
+    each other in the storage index.
+
+    Arguments:
+    oids (Iterable[str]) -- OIDs to check.
+    storage_opener (Callable[[], IStorage]) -- See `build_graph_in_parallel()`.
+    workers (int) -- Number of worker processes.
+    batch_size (int) -- Number of OIDs sent to a worker at once.
+
+    Return (List[str]) -- The missing OIDs, sorted.
+    """
+    oids = sorted(oids)
+    pool = multiprocessing.Pool(workers, _init_worker, (storage_opener,))
+    try:
+        results = [
+            pool.apply_async(_find_missing_records, (oids[i:i + batch_size],))
+            for i in xrange(0, len(oids), batch_size)
+        ]
+        return [oid for result in results for oid in _get_result(result)]
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class BuildStats(object):
+    u"""Throughput of a reference graph build, logged periodically."""
+
+    _LOG_INTERVAL = 10.0
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.records = 0
+        self.references = 0
+        self.batches = 0
+        self.missing = 0
+        self.start_time = time.time()
+        self._last_log_time = self.start_time
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    @property
+    def records_per_second(self):
+        return self.records / max(self.elapsed, 1e-6)
+
+    def log_progress(self, force=False):
+        now = time.time()
+        if force or (now - self._last_log_time >= self._LOG_INTERVAL):
+            self._last_log_time = now
+            log.info(
+                'Loaded {} records with {} references in {:.1f}s using {} worker(s) '
+                '({:.0f} records/s, {:.0f} records/s per worker).'.format(
+                    self.records, self.references, self.elapsed, self.workers,
+                    self.records_per_second, self.records_per_second / self.workers,
+                )
+            )
+            if force and self.missing:
+                log.warning(
+                    'Found {} referenced objects without a current record, see the '
+                    'show_dangling command.'.format(self.missing)
+                )
+
+
+def encode_references(items):
+    u"""Encode `(oid, size, class_name, id, refs, attr_names, xrefs)` tuples as a byte string.
+    `xrefs` is encoded by `.graph.encode_external_references()`.
+
+    `marshal` is used since it is much faster than `pickle` for these simple types.
+    """
+    return marshal.dumps(items)
+
+
+def decode_references(data):
+    u"""Inverse of `encode_references()`.
+
+    Return (List[Tuple[str, Optional[int], str, str, List[str], Dict[str, str], str]]) -- The
+        size is `None` for OIDs without a current record.
+    """
+    return marshal.loads(data)
+
+
+def _get_result(async_result):
+    # A timeout makes the wait interruptible with Ctrl+C. Exceptions raised by the worker are
+    # re-raised here.
+    while True:
+        try:
+            return async_result.get(timeout=1)
+        except multiprocessing.TimeoutError:
+            pass
+
+
+def _init_worker(storage_opener):
+    global _worker_storage
+    _worker_storage = storage_opener()
+
+
+def _load_references(oids):
+    items = []
+    for oid in oids:
+        try:
+            (p, _) = _worker_storage.load(oid)
+        except POSKeyError:
+            items.append((oid, None, '', '', [], {}, ''))
+            continue
+        class_name = get_class_name(p)
+        (refs, identifier, attr_names, external_refs) = get_state_info(p, class_name)
+        items.append((
+            oid, len(p), class_name, identifier or '', list(set(refs)), attr_names,
+            encode_external_references(external_refs),
+        ))
+    return encode_references(items)
+
+
+def _find_missing_records(oids):
+    missing = []
+    for oid in oids:
+        try:
+            _worker_storage.load(oid)
+        except POSKeyError:
+            missing.append(oid)
+    return missing
@@ -0,0 +1,134 @@
+# coding=utf8
+u"""Read information from the pickles of ZODB records without unpickling them.
+
+A record holds two pickles: the class of the object and its state. Loading them would import the
+classes and create objects, which is slow and fails when a class is missing.
+"""
+from ZODB._compat import PersistentUnpickler
+from ZODB.utils import get_pickle_metadata
+from io import BytesIO
+
+_PROTOCOL = '\x80'
+_GLOBAL = 'c'
+_MARK_GLOBAL = '(c'
+
+# State attribute read by `ZODBInfo.get_id()`.
+_ID_ATTRIBUTE = 'id'
+
+_BTREES_MODULE_PREFIX = 'BTrees.'
+_BTREE_SUFFIXES = ('BTree', 'TreeSet')
+
+# Kinds of the persistent references to objects of other databases, with and without the class.
+_EXTERNAL_REFERENCE_KINDS = ('m', 'n')
+
+
+def get_class_name(p):
+    u"""Get the dotted name of the class of a record.
+
+    The common formats, where the class pickle starts with a `GLOBAL` opcode, are read directly
+    from the header, without copying the pickle. Other formats are handled by
+    `ZODB.utils.get_pickle_metadata()`.
+
+    Arguments:
+    p (str) -- Pickle of the record, as returned by `storage.load()`.
+
+    Return (str) -- The class name, an empty string if it is unknown.
+    """
+    start = 2 if p.startswith(_PROTOCOL) else 0
+    if p.startswith(_MARK_GLOBAL, start):
+        start += len(_MARK_GLOBAL)
+    elif p.startswith(_GLOBAL, start):
+        start += len(_GLOBAL)
+    else:
+        return str('.'.join(filter(None, get_pickle_metadata(p))))
+
+    module_end = p.find('\n', start)
+    class_end = p.find('\n', module_end + 1)
+    if (module_end < 0) or (class_end < 0):
+        return ''
+    return p[start:module_end] + '.' + p[module_end + 1:class_end]
+
+
+def get_state_info(p, class_name=None):
+    u"""Read the references of a record, the id of the object and the names of the attributes
+    holding the references.
+
+    The state is read with `noload()`, like `ZODB.serialize.referencesf()` does: no class is
+    imported and no object is created, but the containers of the state (dicts, tuples and lists)
+    are built. This gives the same information as `ZODBInfo.get_id()` and
+    `ZODBInfo.get_attr_name()`, with these exceptions:
+
+    - Only ids stored in the `id` attribute of the state are found, not ids computed by `getId()`
+      or defined on the class.
+    - Only attributes stored in the state are found, not properties or class attributes.
+
+    Arguments:
+    p (str) -- Pickle of the record.
+    class_name (Optional[str]) -- Class of the object, see `get_class_name()`.
+
+    Return (Tuple[List[str], Optional[str], Dict[str, str], List[Tuple[str, str]]]) -- The
+        referenced OIDs (like `referencesf()`), the id, the attribute name holding each referenced
+        OID and the `(database name, OID)` of the references to objects of other databases.
+    """
+    refs = []
+    external_refs = []
+
+    def load_persistent(reference):
+        # See `ZODB.serialize.ObjectReader` for the formats of the references.
+        if isinstance(reference, tuple):
+            oid = reference[0]
+        elif isinstance(reference, str):
+            oid = reference
+        else:
+            if isinstance(reference, list) and (reference[0] in _EXTERNAL_REFERENCE_KINDS):
+                (database_name, oid) = reference[1][:2]
+                external_refs.append((database_name, oid))
+            # Weak references are not followed.
+            return None
+        refs.append(oid)
+        return _Reference(oid)
+
+    unpickler = PersistentUnpickler(None, load_persistent, BytesIO(p))
+    unpickler.noload()
+    state = unpickler.noload()
+
+    identifier = None
+    attr_names = {}
+    if isinstance(state, tuple) and (len(state) == 2) and isinstance(state[1], dict):
+        # `(dict, slots)`, see `persistent.Persistent.__getstate__()`.
+        (state, slots) = (dict(state[0] or {}), state[1])
+        state.update(slots)
+
+    if isinstance(state, dict):
+        identifier = _get_id(state)
+        for (name, value) in state.iteritems():
+            if isinstance(value, _Reference) and isinstance(name, str):
+                # `ZODBInfo.get_attr_name()` returns the first name in alphabetical order.
+                if (value.oid not in attr_names) or (name < attr_names[value.oid]):
+                    attr_names[value.oid] = name
+    elif _is_btree_class(class_name):
+        # `(children, first bucket)` for trees, `(items, next bucket)` for buckets.
+        if isinstance(state, tuple) and (len(state) == 2) and isinstance(state[1], _Reference):
+            attr_names[state[1].oid] = (
+                '_firstbucket' if class_name.endswith(_BTREE_SUFFIXES) else '_next'
+            )
+
+    return (refs, identifier, attr_names, external_refs)
+
+
+class _Reference(object):
+    u"""Placeholder for a persistent reference in a state read by `get_state_info()`."""
+
+    __slots__ = ('oid',)
+
+    def __init__(self, oid):
+        self.oid = oid
+
+
+def _get_id(state):
+    value = state.get(_ID_ATTRIBUTE)
+    return value if (value and isinstance(value, basestring)) else None
+
+
+def _is_btree_class(class_name):
+    return bool(class_name) and class_name.startswith(_BTREES_MODULE_PREFIX)
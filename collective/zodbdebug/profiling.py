@@ -0,0 +1,176 @@
+# coding=utf8
+u"""Count and time the phases of a run, to tell where a slow run spends its time.
+
+The code of the package reports events with `count()` and `timer()`:
+
+- `storage.load`: loads of records by the current process, and `storage.load.bytes` their size.
+  Loads of the worker processes of a parallel build are not seen.
+- `state.read`: reading the references, ids and attribute names of records without unpickling
+  them (see `.pickles`), and `state.bytes` the size of the records read.
+- `object.activate`: objects loaded by `ZODBInfo.get_obj()`, e.g. to get their ids when the graph
+  does not hold them.
+- `attr_name.dir_scan`: scans of `dir(parent)` to find the name of the attribute holding an object.
+- `graph.build`, `graph.records`: building or opening the reference graph, which includes the
+  phases above, and the number of records added.
+- `paths.get_oid_paths`, `paths.get_oid_path`: computing OID paths.
+- `dominators.build`: computing the dominator tree and the retained sizes, see `.dominators`.
+- `dangling.check`: checking which referenced objects have no record, see `.dangling`.
+- `subgraph.extract`, `subgraph.write`: extracting and writing a subgraph, see `.subgraph`.
+- `classes.count`, `classes.find`: counting and finding the objects of each class, see `.classes`.
+- `cache.*`: reading and writing the cache files, and updating the transaction index and the
+  reference history.
+
+Profiling is off by default and `count()` and `timer()` do nothing then, besides a function call.
+`enable()` starts collecting events in a `Profile`.
+"""
+from rbco.caseclasses import case
+import collections
+import json
+import time
+
+_profile = None
+
+
+def enable():
+    u"""Start collecting events. Return (Profile)."""
+    global _profile
+    _profile = Profile()
+    return _profile
+
+
+def disable():
+    global _profile
+    _profile = None
+
+
+def get_profile():
+    u"""Return (Optional[Profile]) the current profile, `None` if profiling is off."""
+    return _profile
+
+
+def count(name, n=1):
+    u"""Add `n` to the counter `name`."""
+    if _profile is not None:
+        _profile.count(name, n)
+
+
+def timer(name):
+    u"""Return a context manager adding the time spent in it to the timer `name`."""
+    if _profile is not None:
+        return _Timer(_profile, name)
+    return _NULL_TIMER
+
+
+class Profile(object):
+    u"""Counters and timers of a run."""
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.counters = collections.defaultdict(int)
+        # Number of calls and seconds by name.
+        self.timers = collections.defaultdict(lambda: [0, 0.0])
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def add_time(self, name, seconds):
+        entry = self.timers[name]
+        entry[0] += 1
+        entry[1] += seconds
+
+    def get_report(self, caches=None):
+        u"""Return (ProfileReport) the collected events.
+
+        Arguments:
+        caches (Optional[.caches.Caches]) -- Caches whose statistics are added to the report, e.g.
+            `ZODBInfo.caches`.
+        """
+        return ProfileReport(
+            elapsed=time.time() - self.start_time,
+            counters=dict(self.counters),
+            timers={name: tuple(entry) for (name, entry) in self.timers.iteritems()},
+            caches=caches.stats() if (caches is not None) else [],
+        )
+
+
+class _Timer(object):
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        self.profile.add_time(self.name, time.time() - self.start)
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+@case
+class ProfileReport(object):
+    u"""Events collected by a `Profile`.
+
+    `elapsed` is the duration of the run, in seconds, `counters` the value of each counter,
+    `timers` the number of calls and seconds of each timer by name and `caches` a list of
+    `.caches.CacheStats`.
+    """
+
+    def __init__(self, elapsed, counters, timers, caches=()):
+        pass
+
+    def get_rates(self):
+        u"""Return (Dict[str, float]) the throughput of the main phases, by name."""
+        rates = {}
+        for (name, unit) in [('storage.load', 'loads'), ('state.read', 'records')]:
+            (calls, seconds) = self.timers.get(name, (0, 0.0))
+            if seconds:
+                rates['{}/s'.format(unit)] = calls / seconds
+        (_, build_seconds) = self.timers.get('graph.build', (0, 0.0))
+        if build_seconds and self.counters.get('graph.records'):
+            rates['graph.records/s'] = self.counters['graph.records'] / build_seconds
+        return rates
+
+    def to_json(self):
+        u"""Return (str) the report as a JSON object, e.g. to track trends between runs."""
+        return json.dumps({
+            'time': time.time(),
+            'elapsed': self.elapsed,
+            'counters': self.counters,
+            'timers': {
+                name: {'calls': calls, 'seconds': seconds}
+                for (name, (calls, seconds)) in self.timers.iteritems()
+            },
+            'rates': self.get_rates(),
+            'caches': [
+                dict(c.as_dict(), hit_rate=c.hit_rate) for c in self.caches
+            ],
+        }, sort_keys=True)
+
+    def __str__(self):
+        lines = ['Profile of {:.1f}s:'.format(self.elapsed)]
+        for (name, (calls, seconds)) in sorted(self.timers.iteritems(), key=lambda t: -t[1][1]):
+            lines.append('  {:<24} {:>10} calls {:>10.3f}s'.format(name, calls, seconds))
+        for (name, value) in sorted(self.counters.iteritems()):
+            lines.append('  {:<24} {:>10}'.format(name, value))
+        for (name, rate) in sorted(self.get_rates().iteritems()):
+            lines.append('  {:<24} {:>10.0f}'.format(name, rate))
+        if self.caches:
+            lines.append('Caches (size, hits, misses, hit rate, evictions):')
+        for c in self.caches:
+            lines.append('  {:<30} {:>8} {:>10} {:>10} {:>6} {:>8}'.format(
+                c.name, c.size, c.hits, c.misses,
+                '{:.0%}'.format(c.hit_rate) if (c.hit_rate is not None) else '-', c.evictions,
+            ))
+        return '\n'.join(lines)
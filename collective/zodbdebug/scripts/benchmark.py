@@ -0,0 +1,126 @@
+# coding=utf8
+u"""Generate synthetic databases and time the main operations on them.
+
+Each benchmark runs in a new process and reports the time of the measured operation and the peak
+resident memory of the process. Results of runs on databases generated with the same scale and
+seed are comparable, e.g. between revisions: append them to a file with `--output` and compare a
+later run with `--baseline`. See `collective.zodbdebug.benchmark`.
+
+The check command runs consistency checks on such a database instead, and exits with an error
+status when one of them fails.
+
+Usage:
+  zodbdebug-benchmark generate [options] <dir>
+  zodbdebug-benchmark run [options] <dir> [<benchmark>...]
+  zodbdebug-benchmark check [options] <dir> [<check>...]
+
+Options:
+  -h, --help                            Print this message.
+  --scale=<factor>                      Multiply the number of items, relations, blobs and
+                                        updates of the database by this factor [default: 1].
+  --seed=<n>                            Seed of the random generator [default: 0].
+  --samples=<n>                         Number of objects whose paths or references are
+                                        looked up [default: 1000].
+  --repeat=<n>                          Run each benchmark this number of times and keep the
+                                        fastest run [default: 1].
+  --label=<text>                        Label of the results, e.g. the revision.
+  --output=<path>                       Append the results to this file, as lines of JSON.
+  --baseline=<path>                     Compare with the last results of this file for the same
+                                        database parameters.
+"""
+from ..benchmark import BENCHMARKS
+from ..benchmark import CHECKS
+from ..benchmark import Scale
+from ..benchmark import generate_database
+from ..benchmark import read_parameters
+from ..benchmark import run_benchmark
+from ..benchmark import run_check
+from ..util import setup_logging
+from docopt import docopt
+import json
+import logging
+import sys
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+def main(argv=None):
+    arguments = docopt(__doc__, argv=argv)
+    setup_logging(logging.WARNING)
+    path = arguments['<dir>']
+    if arguments['generate']:
+        log.warning('Generating database in {}...'.format(path))
+        generate_database(
+            path, Scale().scaled(float(arguments['--scale'])), seed=int(arguments['--seed'])
+        )
+        return
+
+    if arguments['check']:
+        if not run_checks(path, names=arguments['<check>'] or CHECKS):
+            sys.exit(1)
+        return
+
+    run_benchmarks(
+        path,
+        names=arguments['<benchmark>'] or BENCHMARKS,
+        samples=int(arguments['--samples']),
+        repeat=int(arguments['--repeat']),
+        label=arguments['--label'],
+        output_path=arguments['--output'],
+        baseline_path=arguments['--baseline'],
+    )
+
+
+def run_benchmarks(
+    path, names=BENCHMARKS, samples=1000, repeat=1, label=None, output_path=None,
+    baseline_path=None,
+):
+    parameters = read_parameters(path)
+    parameters['samples'] = samples
+    baseline = _read_baseline(baseline_path, parameters) if baseline_path else {}
+
+    print '{:<20} {:>10} {:>10} {:>10} {:>8}'.format(
+        'Benchmark', 'Seconds', 'Peak MB', 'Baseline', 'Ratio')
+    for name in names:
+        result = min(
+            (run_benchmark(path, name, samples=samples) for _ in xrange(repeat)),
+            key=lambda r: r.seconds,
+        )
+        base = baseline.get(name)
+        print '{:<20} {:>10.3f} {:>10.1f} {:>10} {:>8}'.format(
+            name, result.seconds, result.max_rss / 1024.0,
+            '{:.3f}'.format(base['seconds']) if base else '-',
+            '{:.2f}'.format(result.seconds / base['seconds']) if base else '-',
+        )
+        if output_path:
+            with open(output_path, 'a') as f:
+                f.write(json.dumps(dict(
+                    result.as_dict(), label=label, time=time.time(), **parameters
+                ), sort_keys=True) + '\n')
+
+
+def run_checks(path, names=CHECKS):
+    u"""Print the problems found by each check. Return (bool) whether all of them passed."""
+    passed = True
+    for name in names:
+        problems = run_check(path, name)
+        print '{:<20} {}'.format(name, 'FAILED' if problems else 'ok')
+        for problem in problems:
+            print '  ' + problem
+        passed = passed and not problems
+    return passed
+
+
+def _read_baseline(path, parameters):
+    u"""Return (Dict[str, Dict[str, Any]]) the last result of each benchmark in the file `path`
+    with the same database parameters.
+    """
+    result = {}
+    with open(path, 'r') as f:
+        for line in f:
+            record = json.loads(line)
+            if all(record.get(k) == v for (k, v) in parameters.iteritems()):
+                result[record['name']] = record
+    return result
@@ -0,0 +1,196 @@
+# coding=utf8
+u"""Helpers shared by the scripts."""
+from .. import profiling
+from ..core import ENGINE_TRAVERSE
+from ..core import OID_INFO_FIELDS
+from ..core import ZODBInfo
+from ..multidb import MultiDatabaseInfo
+from ..output import FORMAT_TEXT
+from ..output import FORMATS
+from ..parallel import StorageOpener
+from ..server import GraphClient
+from ..server import ServerError
+from docopt import DocoptExit
+import atexit
+import collections
+import logging
+import os
+import sys
+
+
+log = logging.getLogger(__name__)
+
+
+def make_zodb_info(app, arguments):
+    u"""Create a `ZODBInfo` configured by the common command line options.
+
+    Arguments:
+    app -- Zope application root.
+    arguments (Mapping[str, Any]) -- Arguments parsed by `docopt`.
+
+    Return (ZODBInfo)
+    """
+    _enable_profiling(arguments)
+    storage_config_path = arguments.get('--storage-config')
+    storage_opener = None
+    if storage_config_path:
+        with open(storage_config_path, 'r') as f:
+            storage_opener = StorageOpener(config=f.read())
+
+    zodb_info = ZODBInfo(
+        app._p_jar,
+        compact_graph=arguments.get('--compact-graph', False),
+        workers=int(arguments.get('--workers') or 1),
+        storage_opener=storage_opener,
+        engine=arguments.get('--engine') or ENGINE_TRAVERSE,
+    )
+    # Registered first, so it runs last.
+    _register_profile_report(zodb_info, arguments)
+    if arguments.get('--persistent-caches'):
+        zodb_info.load_caches()
+        atexit.register(zodb_info.store_caches)
+    return zodb_info
+
+
+def make_multidb_info(app, arguments):
+    u"""Create a `MultiDatabaseInfo` for the databases of `app`, configured by the common command
+    line options. The profile reports the caches of the main database.
+
+    Return (MultiDatabaseInfo)
+    """
+    _enable_profiling(arguments)
+    multidb_info = MultiDatabaseInfo(
+        app._p_jar,
+        compact_graph=arguments.get('--compact-graph', False),
+        workers=int(arguments.get('--workers') or 1),
+        engine=arguments.get('--engine') or ENGINE_TRAVERSE,
+    )
+    _register_profile_report(multidb_info.zodb_infos.values()[0], arguments)
+    return multidb_info
+
+
+def _enable_profiling(arguments):
+    if arguments.get('--profile') or arguments.get('--profile-json'):
+        profiling.enable()
+
+
+def _register_profile_report(zodb_info, arguments):
+    if profiling.get_profile() is not None:
+        atexit.register(
+            report_profile, zodb_info, print_report=arguments.get('--profile'),
+            json_path=arguments.get('--profile-json'), stream=get_message_stream(arguments),
+        )
+
+
+def get_output_format(arguments):
+    u"""Return (str) the output format chosen with `--format`, one of `.output.FORMATS`.
+
+    Exit with the usage message if it is unknown.
+    """
+    output_format = arguments.get('--format') or FORMAT_TEXT
+    if output_format not in FORMATS:
+        raise DocoptExit('Unknown output format: {}'.format(output_format))
+    return output_format
+
+
+def get_oid_info_fields(arguments):
+    u"""Return (Tuple[str]) the `OIDInfo` fields chosen with `--fields`, in the order of
+    `OID_INFO_FIELDS`. `oid` is always included.
+
+    Exit with the usage message if a field is unknown.
+    """
+    names = arguments.get('--fields')
+    if not names:
+        return OID_INFO_FIELDS
+
+    fields = {name.strip() for name in names.split(',') if name.strip()}
+    unknown = fields.difference(OID_INFO_FIELDS)
+    if unknown:
+        raise DocoptExit('Unknown fields: {}'.format(', '.join(sorted(unknown))))
+    return tuple(f for f in OID_INFO_FIELDS if (f == 'oid') or (f in fields))
+
+
+def open_graph_client(arguments):
+    u"""Return (Optional[GraphClient]) a connection to the graph server listening on the socket
+    chosen with `--socket`, or `None` without it.
+
+    Exit with an error message if the server cannot be reached.
+    """
+    socket_path = arguments.get('--socket')
+    if not socket_path:
+        return None
+
+    try:
+        return GraphClient(os.path.expanduser(socket_path))
+    except ServerError as e:
+        sys.exit('Error: {}'.format(e))
+
+
+def iter_oid_info_dicts(zodb_info, oids, fields, client=None):
+    u"""Get the info of objects as `OIDInfo.as_str_dict()` returns it, one object at a time.
+
+    The OID paths of the objects are computed together (see `ZODBInfo.get_oid_paths()`). With a
+    `client` the info is asked to the graph server instead, so the reference graph of `zodb_info`
+    is not needed. Objects the server cannot answer for only get their OID.
+
+    Arguments:
+    zodb_info (ZODBInfo) -- With the reference maps built, unless `client` is given.
+    oids (Sequence[str]) -- OIDs.
+    fields (Tuple[str]) -- Names of the fields, of `OID_INFO_FIELDS`.
+    client (Optional[GraphClient]) -- Connection to a `.server.GraphServer` of the same database.
+
+    Return (Iterator[OrderedDict]) -- The info of each of `oids`, in order.
+    """
+    if client is None:
+        if {'oid_path', 'id_path'}.intersection(fields):
+            zodb_info.get_oid_paths(oids)
+        for oid in oids:
+            yield zodb_info.get_oid_info(oid, fields).as_str_dict(fields)
+        return
+
+    for oid in oids:
+        oid_repr = zodb_info.oid_to_repr(oid)
+        try:
+            values = client.query('info', oid_repr, fields)
+        except ServerError as e:
+            log.warning('Cannot get the info of {} from the server: {}'.format(oid_repr, e))
+            values = {'oid': oid_repr}
+        yield collections.OrderedDict((f, _to_str(values.get(f))) for f in fields)
+
+
+def format_oid_info(info):
+    u"""Return (str) the info of an object given by `iter_oid_info_dicts()`, as printed by
+    `OIDInfo.to_str()`.
+    """
+    return '\n'.join('{}: {}'.format(k, v) for (k, v) in info.iteritems())
+
+
+def _to_str(value):
+    # The server answers with JSON, so its strings are unicode.
+    return value.encode('utf8') if isinstance(value, unicode) else value
+
+
+def get_message_stream(arguments):
+    u"""Return (file) where to print logs and reports, `sys.stderr` when the records written to
+    `sys.stdout` are in a machine-readable format or when the `<output>` file is `-`.
+    """
+    if arguments.get('<output>') == '-':
+        return sys.stderr
+    return sys.stdout if (get_output_format(arguments) == FORMAT_TEXT) else sys.stderr
+
+
+def report_profile(zodb_info, print_report=True, json_path=None, stream=None):
+    u"""Print the profile of the run and append it to a file of JSON lines.
+
+    Arguments:
+    zodb_info (ZODBInfo) -- Whose cache statistics are reported.
+    print_report (bool) -- Print the report.
+    json_path (Optional[str]) -- Path of the file.
+    stream (Optional[file]) -- Where the report is printed, by default `sys.stdout`.
+    """
+    report = profiling.get_profile().get_report(caches=zodb_info.caches)
+    if print_report:
+        print >> (stream or sys.stdout), report
+    if json_path:
+        with open(json_path, 'a') as f:
+            f.write(report.to_json() + '\n')
@@ -0,0 +1,102 @@
+# coding=utf8
+u"""Write the part of the reference graph reachable from an object to a file, for offline analysis
+with other tools (e.g. NetworkX, Gephi or Cytoscape).
+
+The records are loaded while the references are followed from <root>, breadth first, until one of
+the limits is reached, without building the reference graph of the whole database. Use the
+option --back-references to write the objects which reference <root> in at most that number of
+hops instead, which needs the whole reference graph (built or loaded from its cache as usual).
+
+<root> is an OID representation (e.g. 0x1a2b) or a path from the Zope application root (e.g.
+/Plone/folder). <output> is the path of the file, or - for the standard output. See
+`collective.zodbdebug.subgraph` for the formats.
+
+Usage:
+  export_subgraph [options] <root> <output>
+
+Examples:
+  Two levels below a folder: export_subgraph --max-depth=2 /Plone/folder folder.graphml
+  What keeps an object alive: export_subgraph --back-references=3 0x1a2b referrers.graphml
+
+Options:
+  -h, --help                            Print this message.
+  --max-depth=<n>                       Maximum number of references from <root>.
+  --max-objects=<n>                     Maximum number of objects, 0 for no limit
+                                        [default: 10000].
+  --max-bytes=<n>                       Stop once the loaded records add up to this number of
+                                        bytes.
+  --back-references=<hops>              Write the objects referencing <root> in at most this
+                                        number of references instead.
+  --export-format=<name>                Format of the file: "graphml" or a tab-separated edge list
+                                        ("edgelist") [default: graphml].
+  --compact-graph                       Build the reference graph in compact arrays instead of
+                                        dicts of sets. Uses much less memory.
+  --workers=<n>                         Number of worker processes used to build the reference
+                                        graph [default: 1].
+  --storage-config=<path>               File with a ZConfig storage section (e.g. <zeoclient> or
+                                        <relstorage>) used by the worker processes to open the
+                                        storage read-only. Not needed for FileStorage.
+  --engine=<name>                       How to build the reference graph: "traverse" follows the
+                                        references from the root, "scan" reads a FileStorage
+                                        sequentially [default: traverse].
+  --profile                             Print the time spent in each phase of the run and the
+                                        statistics of the caches at exit.
+  --profile-json=<path>                 Append the profile of the run to this file, as a line of
+                                        JSON.
+"""
+from ..subgraph import FORMATS
+from ..subgraph import extract_subgraph
+from ..subgraph import get_back_reference_neighbourhood
+from ..subgraph import write_subgraph
+from ..util import get_arguments
+from ..util import setup_logging
+from .common import get_message_stream
+from .common import make_zodb_info
+from docopt import DocoptExit
+from docopt import docopt
+import logging
+import sys
+
+
+log = logging.getLogger(__name__)
+
+
+def main(app, cmd_args):
+    arguments = docopt(__doc__, argv=get_arguments(cmd_args))  # noqa
+    setup_logging(stream=get_message_stream(arguments))
+    export_format = arguments['--export-format']
+    if export_format not in FORMATS:
+        raise DocoptExit('Unknown export format: {}'.format(export_format))
+
+    root = arguments['<root>']
+    if root.startswith('/'):
+        root = app.unrestrictedTraverse(root)._p_oid
+
+    zodb_info = make_zodb_info(app, arguments)
+    hops = arguments['--back-references']
+    if hops:
+        zodb_info.build_reference_maps()
+        subgraph = get_back_reference_neighbourhood(
+            zodb_info, root, hops=int(hops), max_objects=_to_int(arguments['--max-objects'])
+        )
+    else:
+        subgraph = extract_subgraph(
+            zodb_info, root, max_depth=_to_int(arguments['--max-depth']),
+            max_objects=_to_int(arguments['--max-objects']),
+            max_bytes=_to_int(arguments['--max-bytes']),
+        )
+
+    output = arguments['<output>']
+    if output == '-':
+        write_subgraph(subgraph, sys.stdout, export_format)
+    else:
+        with open(output, 'wb') as f:
+            write_subgraph(subgraph, f, export_format)
+    log.info('Wrote {} objects and {} references{}.'.format(
+        len(subgraph), subgraph.graph.num_edges, ' (truncated)' if subgraph.truncated else ''))
+    log.info('Finish!')
+
+
+def _to_int(value):
+    u"""0 means no limit."""
+    return int(value) or None if value else None
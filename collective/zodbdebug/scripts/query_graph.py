@@ -0,0 +1,59 @@
+# coding=utf8
+u"""Query a reference graph server started with `bin/instance serve_graph`.
+
+Does not need Zope nor the database, so it answers in milliseconds.
+
+Usage:
+  zodbdebug-query [options] status
+  zodbdebug-query [options] <method> <oid>...
+
+Methods:
+  oid_path, id_path                     The OID path or ID path of the object, from the root.
+  references, back_references           The OIDs referenced by the object, or referencing it.
+  info                                  The `OIDInfo` of the object.
+  size                                  The size of the record of the object and of its subtree.
+
+Options:
+  -h, --help                            Print this message.
+  --socket=<path>                       Path of the Unix socket of the server
+                                        [default: ~/.cache/collective.zodbdebug/server.sock].
+  --json                                Print each result as a line of JSON.
+"""
+from ..server import GraphClient
+from ..server import ServerError
+from docopt import docopt
+import json
+import os
+import sys
+
+
+def main(argv=None):
+    arguments = docopt(__doc__, argv=argv)
+    if arguments['status']:
+        (method, oids) = ('status', [None])
+    else:
+        (method, oids) = (arguments['<method>'], arguments['<oid>'])
+
+    try:
+        with GraphClient(os.path.expanduser(arguments['--socket'])) as client:
+            for oid in oids:
+                result = client.query(method) if (oid is None) else client.query(method, oid)
+                if arguments['--json']:
+                    print json.dumps(result)
+                else:
+                    print _format_result(method, result).encode('utf8')
+    except ServerError as e:
+        sys.exit('Error: {}'.format(e))
+
+
+def _format_result(method, result):
+    if method in ('oid_path', 'id_path'):
+        return '/'.join(i or '?' for i in result)
+
+    if isinstance(result, dict):
+        return '\n'.join(u'{}: {}'.format(k, v) for (k, v) in sorted(result.iteritems()))
+
+    if isinstance(result, list):
+        return '\n'.join(result)
+
+    return unicode(result)
@@ -1,53 +1,242 @@
 # coding=utf8
 u"""Scan the blobs directory and print information about each blob.
 
+With --duplicates print the blobs of different objects with the same contents, grouped, the blobs
+of deleted or unreachable objects and the old revisions of the blobs instead, with the number of
+bytes which can be reclaimed.
+
+With --format=jsonl or --format=csv write a record per blob instead, with the fields of
+`BLOB_FIELDS` and the fields of the object selected with --fields, and print the logs to stderr.
+
+With --socket the info of the objects is asked to a graph server started with
+`bin/instance serve_graph` (see `collective.zodbdebug.server`) instead of building the reference
+graph, so only the blobs are read. The server must serve the same database.
+
 Usage:
   scan_blobs [options]
 
 Options:
   -h, --help                            Print this message.
+  --hash=<mode>                         What to hash: "head" hashes the first KB of each blob,
+                                        "full" hashes the whole blob [default: head].
+  --hash-algorithm=<name>               Hash function: md5, sha1, or the faster crc32 or adler32
+                                        checksums [default: md5].
+  --threads=<n>                         Number of threads reading and hashing blobs
+                                        [default: 8].
+  --ordered                             Print the blobs in the order of the blobs directory
+                                        instead of as soon as they are hashed.
+  --duplicates                          Find duplicated and orphaned blobs and old revisions of
+                                        blobs. Only blobs with the same size as another blob are
+                                        hashed, in full.
+  --format=<name>                       Output format: "text", or a record per blob in JSON
+                                        lines ("jsonl") or CSV ("csv"). Only "text" is supported
+                                        with duplicates [default: text].
+  --fields=<names>                      Comma-separated fields of the info of each object: oid,
+                                        id, obj, path, oid_path and id_path. Only the selected
+                                        ones are computed; "obj" and "path" load the objects
+                                        [default: oid,id,obj,path,oid_path,id_path].
+  --socket=<path>                       Get the info of the objects from the graph server
+                                        listening on this Unix socket, e.g.
+                                        ~/.cache/collective.zodbdebug/server.sock. Not supported
+                                        with duplicates.
+  --compact-graph                       Build the reference graph in compact arrays instead of
+                                        dicts of sets. Uses much less memory.
+  --workers=<n>                         Number of worker processes used to build the reference
+                                        graph [default: 1].
+  --storage-config=<path>               File with a ZConfig storage section (e.g. <zeoclient> or
+                                        <relstorage>) used by the worker processes to open the
+                                        storage read-only. Not needed for FileStorage.
+  --engine=<name>                       How to build the reference graph: "traverse" follows the
+                                        references from the root, "scan" reads a FileStorage
+                                        sequentially [default: traverse].
+  --persistent-caches                   Load the ids and attribute names read by activating
+                                        objects in earlier runs, and store them at exit.
+  --profile                             Print the time spent in each phase of the run and the
+                                        statistics of the caches at exit.
+  --profile-json=<path>                 Append the profile of the run to this file, as a line of
+                                        JSON.
 """
-from ..core import ZODBInfo
+from ..blobs import HASH_HEAD
+from ..blobs import ScanStats
+from ..blobs import find_duplicate_blobs
+from ..blobs import hash_blobs
+from ..orphans import BLOB_OLD_REVISION
+from ..orphans import get_orphaned_blobs
+from ..core import OID_INFO_FIELDS
+from ..output import FORMAT_TEXT
+from ..output import make_record_writer
 from ..util import get_arguments
 from ..util import setup_logging
+from .common import format_oid_info
+from .common import get_message_stream
+from .common import get_oid_info_fields
+from .common import get_output_format
+from .common import iter_oid_info_dicts
+from .common import make_zodb_info
+from .common import open_graph_client
+from ZODB.utils import tid_repr
+from docopt import DocoptExit
 from docopt import docopt
-import hashlib
+import itertools
 import logging
-import math
-import os
 
 
 log = logging.getLogger(__name__)
 
+# Number of blobs whose OID paths are computed together, see `ZODBInfo.get_oid_paths()`.
+_BATCH_SIZE = 1000
+
+# Fields of the records written with `--format`, before the fields of the `OIDInfo`.
+BLOB_FIELDS = ('blob_path', 'tid', 'size', 'hash', 'error')
+
 
 def main(app, cmd_args):
     arguments = docopt(__doc__, argv=get_arguments(cmd_args))  # noqa
-    setup_logging()
-    diagnose_blobs(app)
+    output_format = get_output_format(arguments)
+    if arguments['--duplicates'] and (output_format != FORMAT_TEXT):
+        raise DocoptExit('--format is not supported with --duplicates')
+    if arguments['--duplicates'] and arguments['--socket']:
+        raise DocoptExit('--socket is not supported with --duplicates')
+
+    setup_logging(stream=get_message_stream(arguments))
+    zodb_info = make_zodb_info(app, arguments)
+    algorithm = arguments['--hash-algorithm']
+    threads = int(arguments['--threads'])
+    if arguments['--duplicates']:
+        diagnose_duplicate_blobs(zodb_info, algorithm=algorithm, threads=threads)
+    else:
+        diagnose_blobs(
+            zodb_info, mode=arguments['--hash'], algorithm=algorithm, threads=threads,
+            ordered=arguments['--ordered'], output_format=output_format,
+            fields=get_oid_info_fields(arguments), client=open_graph_client(arguments),
+        )
     log.info('Finish!')
 
 
-def diagnose_blobs(app):
-    zodb_info = ZODBInfo(app._p_jar)
+def diagnose_blobs(
+    zodb_info, mode=HASH_HEAD, algorithm='md5', threads=8, ordered=False,
+    output_format=FORMAT_TEXT, fields=OID_INFO_FIELDS, client=None,
+):
+    u"""Print the hash and the OID info of each blob.
+
+    The blobs are printed while the blob directory is walked and hashed (see `.blobs`), in batches
+    of `_BATCH_SIZE`, so memory usage does not depend on the number of blobs. With another
+    `output_format` than `FORMAT_TEXT` a record per blob is written instead (see `.output`), and
+    flushed after each batch. Only the `fields` of the OID info are computed and printed. With a
+    `client` of a graph server they are asked to it, without building the reference graph (see
+    `.common.iter_oid_info_dicts()`).
+    """
+    if client is None:
+        zodb_info.build_reference_maps()
+    writer = None
+    if output_format != FORMAT_TEXT:
+        writer = make_record_writer(output_format, BLOB_FIELDS + tuple(fields))
+
+    stats = ScanStats()
+    blob_hashes = hash_blobs(
+        zodb_info.iter_blob_paths(), mode=mode, algorithm=algorithm, threads=threads,
+        ordered=ordered,
+    )
+    while True:
+        batch = list(itertools.islice(blob_hashes, _BATCH_SIZE))
+        if not batch:
+            break
+
+        oids = [zodb_info.blob_path_to_oid(blob_hash.path) for blob_hash in batch]
+        infos = iter_oid_info_dicts(zodb_info, oids, fields, client=client)
+        for (blob_hash, info) in itertools.izip(batch, infos):
+            stats.add(blob_hash)
+            if writer is not None:
+                writer.write(_get_blob_record(zodb_info, blob_hash, info))
+                continue
+
+            print 'Blob path: ' + blob_hash.path
+            if blob_hash.error:
+                print 'Blob error: ' + blob_hash.error
+            else:
+                print 'Blob hash: ({},{})'.format(blob_hash.digest, blob_hash.size)
+            print format_oid_info(info)
+            print
+        if writer is not None:
+            writer.flush()
+        stats.log_progress()
+
+    stats.log_progress(force=True)
+    if writer is None:
+        print 'Number of blobs: {}'.format(stats.blobs)
+    else:
+        log.info('Number of blobs: {}'.format(stats.blobs))
+
+
+def _get_blob_record(zodb_info, blob_hash, record):
+    record.update(
+        blob_path=blob_hash.path,
+        tid=tid_repr(zodb_info.blob_path_to_tid(blob_hash.path)),
+        size=blob_hash.size,
+        hash=blob_hash.digest,
+        error=blob_hash.error,
+    )
+    return record
+
+
+def diagnose_duplicate_blobs(zodb_info, algorithm='md5', threads=8):
+    u"""Print the groups of blobs of different objects with the same contents, the orphaned blobs
+    and the old revisions of the blobs, largest first, and the number of bytes which can be
+    reclaimed.
+
+    Only the current revisions of the blobs of live objects are compared, so the revisions of a
+    blob which did not change are not duplicates.
+    """
     zodb_info.build_reference_maps()
 
-    blob_paths = sorted(zodb_info.iter_blob_paths())
-    num_blobs = len(blob_paths)
-    print 'Number of blobs: {}'.format(num_blobs)
-    print
+    log.info('Finding orphaned blobs...')
+    orphans = get_orphaned_blobs(zodb_info)
+    orphan_paths = {o.path for o in orphans}
+    old_revisions = [o for o in orphans if o.reason == BLOB_OLD_REVISION]
+    orphans = [o for o in orphans if o.reason != BLOB_OLD_REVISION]
+
+    log.info('Finding duplicate blobs...')
+    duplicates = find_duplicate_blobs(
+        (p for p in zodb_info.iter_blob_paths() if p not in orphan_paths),
+        algorithm=algorithm, threads=threads, get_owner=zodb_info.blob_path_to_oid,
+    )
+
+    log.info('Computing OID paths...')
+    zodb_info.get_oid_paths(
+        zodb_info.blob_path_to_oid(path) for d in duplicates for path in d.paths
+    )
 
-    for (i, path) in enumerate(blob_paths):
-        num = i + 1
-        percent = int(math.ceil((float(num) / num_blobs) * 100.))
-        log.info('Processing blob {} of {} ({}%)...'.format(num, num_blobs, percent))
-        print 'Blob path: ' + path
-        print 'Blob hash: ' + hash_file(path)
-        oid = zodb_info.blob_path_to_oid(path)
-        print zodb_info.get_oid_info(oid)
+    print 'Number of duplicate groups: {}'.format(len(duplicates))
+    print 'Number of duplicate blobs: {}'.format(sum(len(d.paths) for d in duplicates))
+    print
+    for d in duplicates:
+        print 'Size: {} bytes'.format(d.size)
+        print 'Hash: {}'.format(d.digest)
+        for path in d.paths:
+            oid = zodb_info.blob_path_to_oid(path)
+            id_path = '/'.join(str(i) for i in reversed(zodb_info.get_id_path(oid)))
+            print 'Blob: {} {} {}'.format(zodb_info.oid_to_repr(oid), id_path, path)
         print
 
+    for (title, blobs) in (('orphaned blobs', orphans), ('old blob revisions', old_revisions)):
+        print 'Number of {}: {}'.format(title, len(blobs))
+        print
+        for o in blobs:
+            print 'Blob: {} {} {} bytes {}'.format(
+                zodb_info.oid_to_repr(o.oid), o.reason, o.size, o.path
+            )
+        if blobs:
+            print
 
-def hash_file(path):
-    with open(path, 'r') as f:
-        data = f.read(1024)
-    return '({},{})'.format(hashlib.md5(data).hexdigest(), os.path.getsize(path))
+    # Orphaned blobs and old revisions are removed by a pack, each group of duplicates keeps one
+    # of its blobs.
+    orphaned_size = sum(o.size for o in orphans)
+    old_revisions_size = sum(o.size for o in old_revisions)
+    duplicated_size = sum(d.reclaimable_size for d in duplicates)
+    print 'Reclaimable by removing duplicates: {} bytes'.format(duplicated_size)
+    print 'Reclaimable by packing: {} bytes ({} bytes of old revisions)'.format(
+        orphaned_size + old_revisions_size, old_revisions_size
+    )
+    print 'Total reclaimable: {} bytes'.format(
+        duplicated_size + orphaned_size + old_revisions_size
+    )
@@ -0,0 +1,53 @@
+# coding=utf8
+u"""Keep the reference graph in memory and answer queries about it over a Unix socket.
+
+The graph is built (or opened from the cache) once and kept up to date with the new transactions.
+Query it with the `zodbdebug-query` command, see `collective.zodbdebug.server`.
+
+Usage:
+  serve_graph [options]
+
+Options:
+  -h, --help                            Print this message.
+  --socket=<path>                       Path of the Unix socket
+                                        [default: ~/.cache/collective.zodbdebug/server.sock].
+  --poll-interval=<seconds>             Seconds between checks for new transactions [default: 5].
+  --compact-graph                       Build the reference graph in compact arrays instead of
+                                        dicts of sets. Uses much less memory.
+  --workers=<n>                         Number of worker processes used to build the reference
+                                        graph [default: 1].
+  --storage-config=<path>               File with a ZConfig storage section (e.g. <zeoclient> or
+                                        <relstorage>) used by the worker processes to open the
+                                        storage read-only. Not needed for FileStorage.
+  --engine=<name>                       How to build the reference graph: "traverse" follows the
+                                        references from the root, "scan" reads a FileStorage
+                                        sequentially [default: traverse].
+"""
+from ..server import GraphServer
+from ..util import get_arguments
+from ..util import mkdirp
+from ..util import setup_logging
+from .common import make_zodb_info
+from docopt import docopt
+import logging
+import os
+
+
+log = logging.getLogger(__name__)
+
+
+def main(app, cmd_args):
+    arguments = docopt(__doc__, argv=get_arguments(cmd_args))  # noqa
+    setup_logging()
+    socket_path = os.path.expanduser(arguments['--socket'])
+    mkdirp(os.path.dirname(socket_path))
+    server = GraphServer(
+        lambda: make_zodb_info(app, arguments),
+        socket_path,
+        poll_interval=float(arguments['--poll-interval']),
+    )
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    log.info('Finish!')
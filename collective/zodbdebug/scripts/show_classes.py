@@ -0,0 +1,139 @@
+# coding=utf8
+u"""Print the number of objects of each class or, given class names, the objects of these classes.
+
+Classes are read from the reference graph (see `collective.zodbdebug.classes`), so no object is
+loaded unless the "obj" or "path" field is selected.
+
+With --format=jsonl or --format=csv write a record per object instead, with the fields of
+`CLASS_FIELDS` and the fields of the object selected with --fields, and print the logs to stderr.
+
+Usage:
+  show_classes [options] [<class>...]
+
+Examples:
+  Objects by class: show_classes
+  Relations: show_classes "*.RelationValue"
+
+Options:
+  -h, --help                            Print this message.
+  --limit=<n>                           Maximum number of classes or objects printed, 0 prints
+                                        all of them [default: 0].
+  --format=<name>                       Output format: "text", or a record per object in JSON
+                                        lines ("jsonl") or CSV ("csv") [default: text].
+  --fields=<names>                      Comma-separated fields of the info of each object: oid,
+                                        id, obj, path, oid_path and id_path. Only the selected
+                                        ones are computed; "obj" and "path" load the objects
+                                        [default: oid,id,oid_path,id_path].
+  --compact-graph                       Build the reference graph in compact arrays instead of
+                                        dicts of sets. Uses much less memory.
+  --workers=<n>                         Number of worker processes used to build the reference
+                                        graph [default: 1].
+  --storage-config=<path>               File with a ZConfig storage section (e.g. <zeoclient> or
+                                        <relstorage>) used by the worker processes to open the
+                                        storage read-only. Not needed for FileStorage.
+  --engine=<name>                       How to build the reference graph: "traverse" follows the
+                                        references from the root, "scan" reads a FileStorage
+                                        sequentially and also counts unreachable objects
+                                        [default: traverse].
+  --persistent-caches                   Load the ids and attribute names read by activating
+                                        objects in earlier runs, and store them at exit.
+  --profile                             Print the time spent in each phase of the run and the
+                                        statistics of the caches at exit.
+  --profile-json=<path>                 Append the profile of the run to this file, as a line of
+                                        JSON.
+"""
+from ..classes import find_oids_by_class
+from ..classes import get_class_counts
+from ..core import OID_INFO_FIELDS
+from ..output import FORMAT_TEXT
+from ..output import make_record_writer
+from ..util import get_arguments
+from ..util import setup_logging
+from .common import get_message_stream
+from .common import get_oid_info_fields
+from .common import get_output_format
+from .common import make_zodb_info
+from docopt import docopt
+import logging
+
+
+log = logging.getLogger(__name__)
+
+# Number of objects whose OID paths are computed together, see `ZODBInfo.get_oid_paths()`.
+_BATCH_SIZE = 1000
+
+# Fields of the records written with `--format`, before the fields of the `OIDInfo`.
+CLASS_FIELDS = ('class_name', 'size')
+
+
+def main(app, cmd_args):
+    arguments = docopt(__doc__, argv=get_arguments(cmd_args))  # noqa
+    output_format = get_output_format(arguments)
+    setup_logging(stream=get_message_stream(arguments))
+    diagnose_classes(
+        make_zodb_info(app, arguments), arguments['<class>'], limit=int(arguments['--limit']),
+        output_format=output_format, fields=get_oid_info_fields(arguments),
+    )
+    log.info('Finish!')
+
+
+def diagnose_classes(
+    zodb_info, patterns=(), limit=0, output_format=FORMAT_TEXT, fields=OID_INFO_FIELDS,
+):
+    u"""Print the number of objects of each class, most common first, or the objects of the
+    classes matching `patterns` (see `.classes.find_oids_by_class()`).
+
+    With another `output_format` than `FORMAT_TEXT` a record per object is written instead (see
+    `.output`), and flushed after each batch. Only the `fields` of the OID info are computed.
+    """
+    zodb_info.build_reference_maps()
+    if not patterns:
+        counts = sorted(
+            get_class_counts(zodb_info).iteritems(), key=lambda item: (-item[1], item[0])
+        )
+        if output_format != FORMAT_TEXT:
+            writer = make_record_writer(output_format, ('class_name', 'count'))
+            for (class_name, count) in counts[:limit or None]:
+                writer.write({'class_name': class_name, 'count': count})
+            writer.flush()
+            return
+
+        print 'Number of classes: {}'.format(len(counts))
+        print 'Number of objects: {}'.format(sum(n for (_, n) in counts))
+        print
+        print 'Objects by class (count, class):'
+        for (class_name, count) in counts[:limit or None]:
+            print '{}\t{}'.format(count, class_name)
+        return
+
+    oids = find_oids_by_class(zodb_info, patterns)
+    writer = None
+    if output_format != FORMAT_TEXT:
+        writer = make_record_writer(output_format, CLASS_FIELDS + tuple(fields))
+    else:
+        print 'Number of objects: {}'.format(len(oids))
+        print
+
+    with_paths = bool({'oid_path', 'id_path'}.intersection(fields))
+    selected = oids[:limit or None]
+    for start in xrange(0, len(selected), _BATCH_SIZE):
+        batch = selected[start:start + _BATCH_SIZE]
+        if with_paths:
+            zodb_info.get_oid_paths(batch)
+        for oid in batch:
+            info = zodb_info.get_oid_info(oid, fields)
+            class_name = zodb_info.get_class_name(oid)
+            size = zodb_info.get_record_size(oid)
+            if writer is not None:
+                record = info.as_str_dict(fields)
+                record.update(class_name=class_name, size=size)
+                writer.write(record)
+                continue
+
+            print 'Class: {} ({} bytes)'.format(class_name, size)
+            print info.to_str(fields)
+            print
+        if writer is not None:
+            writer.flush()
+    if writer is not None:
+        log.info('Number of objects: {}'.format(len(oids)))
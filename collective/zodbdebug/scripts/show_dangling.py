@@ -0,0 +1,130 @@
+# coding=utf8
+u"""Print the references to objects which have no current record, which raise a POSKeyError when
+they are loaded.
+
+The reference graph is built as usual and the objects referenced without a record in it are
+checked (see `collective.zodbdebug.dangling`). Each dangling reference is printed with the class
+and the id path of the object holding it.
+
+With --format=jsonl or --format=csv write a record per dangling reference instead, with the fields
+of `DANGLING_FIELDS`, and print the logs to stderr.
+
+Usage:
+  show_dangling [options]
+
+Options:
+  -h, --help                            Print this message.
+  --all                                 Check the record of every object of the graph, not only
+                                        the objects referenced without a record. Use it when the
+                                        cached graph may be stale, e.g. after a pack.
+  --history                             Print the first transaction in which each dangling
+                                        reference was made, from the reference history. The
+                                        history is built on first use.
+  --format=<name>                       Output format: "text", or a record per dangling reference
+                                        in JSON lines ("jsonl") or CSV ("csv") [default: text].
+  --compact-graph                       Build the reference graph in compact arrays instead of
+                                        dicts of sets. Uses much less memory.
+  --workers=<n>                         Number of worker processes used to build the reference
+                                        graph and to check the records [default: 1].
+  --storage-config=<path>               File with a ZConfig storage section (e.g. <zeoclient> or
+                                        <relstorage>) used by the worker processes to open the
+                                        storage read-only. Not needed for FileStorage.
+  --engine=<name>                       How to build the reference graph: "traverse" follows the
+                                        references from the root, "scan" reads a FileStorage
+                                        sequentially and also finds the dangling references of
+                                        unreachable objects [default: traverse].
+  --persistent-caches                   Load the ids and attribute names read by activating
+                                        objects in earlier runs, and store them at exit.
+  --profile                             Print the time spent in each phase of the run and the
+                                        statistics of the caches at exit.
+  --profile-json=<path>                 Append the profile of the run to this file, as a line of
+                                        JSON.
+"""
+from ..dangling import get_dangling_references
+from ..output import FORMAT_TEXT
+from ..output import make_record_writer
+from ..transactions import TransactionInfo
+from ..util import get_arguments
+from ..util import setup_logging
+from .common import get_message_stream
+from .common import get_output_format
+from .common import make_zodb_info
+from ZODB.utils import tid_repr
+from docopt import docopt
+import logging
+
+
+log = logging.getLogger(__name__)
+
+# Fields of the records written with `--format`.
+DANGLING_FIELDS = ('target', 'source', 'class_name', 'attr_name', 'id_path', 'first_tid')
+
+
+def main(app, cmd_args):
+    arguments = docopt(__doc__, argv=get_arguments(cmd_args))  # noqa
+    output_format = get_output_format(arguments)
+    setup_logging(stream=get_message_stream(arguments))
+    diagnose_dangling(
+        make_zodb_info(app, arguments), check_all=arguments['--all'],
+        with_history=arguments['--history'], output_format=output_format,
+    )
+    log.info('Finish!')
+
+
+def diagnose_dangling(zodb_info, check_all=False, with_history=False, output_format=FORMAT_TEXT):
+    u"""Print the dangling references, grouped by missing object.
+
+    With another `output_format` than `FORMAT_TEXT` a record per reference is written instead (see
+    `.output`).
+    """
+    zodb_info.build_reference_maps()
+    references = get_dangling_references(
+        zodb_info, check_all=check_all, with_history=with_history
+    )
+    zodb_info.get_oid_paths({r.source for r in references})
+    records = [_get_record(zodb_info, r) for r in references]
+
+    if output_format != FORMAT_TEXT:
+        writer = make_record_writer(output_format, DANGLING_FIELDS)
+        for record in records:
+            writer.write(record)
+        writer.flush()
+        log.info('Number of dangling references: {}'.format(len(records)))
+        return
+
+    print 'Number of missing objects: {}'.format(len({r.target for r in references}))
+    print 'Number of dangling references: {}'.format(len(references))
+    print
+
+    target = None
+    for (reference, record) in zip(references, records):
+        if record['target'] != target:
+            if target is not None:
+                print
+            target = record['target']
+            print 'Missing OID: {}'.format(target)
+        print '  Referenced by: {} ({})'.format(record['source'], record['class_name'] or '?')
+        print '    Id path: {}'.format(record['id_path'])
+        print '    Attribute: {}'.format(record['attr_name'] or '?')
+        if with_history:
+            print '    First transaction: {}'.format(_format_tid(reference.first_tid))
+    if records:
+        print
+
+
+def _get_record(zodb_info, reference):
+    return {
+        'target': zodb_info.oid_to_repr(reference.target),
+        'source': zodb_info.oid_to_repr(reference.source),
+        'class_name': reference.class_name,
+        'attr_name': reference.attr_name,
+        'id_path': '/'.join(str(i) for i in reversed(zodb_info.get_id_path(reference.source))),
+        'first_tid': tid_repr(reference.first_tid) if reference.first_tid else None,
+    }
+
+
+def _format_tid(tid):
+    if not tid:
+        return '?'
+    info = TransactionInfo(tid=tid)
+    return '{} ({})'.format(info.tid_repr, info.time_str)
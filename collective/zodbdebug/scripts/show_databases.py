@@ -0,0 +1,92 @@
+# coding=utf8
+u"""Print the reference graph of every database of a multi-database, e.g. a site with mounted
+catalog databases, and the references between databases.
+
+The graphs of the databases are built concurrently, each one with its own reference cache. The
+mount points of Products.ZODBMountPoint are found in the graphs, so the paths of the objects of
+mounted databases start at the root of the main database. See `collective.zodbdebug.multidb`.
+
+Objects are given as `<database name>:<oid>`, or as an OID of the main database.
+
+Usage:
+  show_databases [options] [<oid>...]
+
+Examples:
+  Summary of the databases: show_databases
+  Path of an object of the "catalog" database: show_databases catalog:0x1a2b
+
+Options:
+  -h, --help                            Print this message.
+  --limit=<n>                           Maximum number of unresolved cross-database references
+                                        printed, 0 prints all of them [default: 20].
+  --compact-graph                       Build the reference graph in compact arrays instead of
+                                        dicts of sets. Uses much less memory.
+  --workers=<n>                         Number of worker processes used to build the reference
+                                        graph of each database [default: 1].
+  --engine=<name>                       How to build the reference graph: "traverse" follows the
+                                        references from the root, "scan" reads a FileStorage
+                                        sequentially [default: traverse].
+  --profile                             Print the time spent in each phase of the run and the
+                                        statistics of the caches at exit.
+  --profile-json=<path>                 Append the profile of the run to this file, as a line of
+                                        JSON.
+"""
+from ..multidb import find_zope_mount_points
+from ..util import get_arguments
+from ..util import setup_logging
+from .common import make_multidb_info
+from docopt import docopt
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+def main(app, cmd_args):
+    arguments = docopt(__doc__, argv=get_arguments(cmd_args))  # noqa
+    setup_logging()
+    diagnose_databases(
+        make_multidb_info(app, arguments), arguments['<oid>'], limit=int(arguments['--limit'])
+    )
+    log.info('Finish!')
+
+
+def diagnose_databases(multidb_info, key_reprs=(), limit=20):
+    u"""Print the size of the graph of each database, the number of references between them and
+    the mount points, then the paths of the objects `key_reprs`.
+    """
+    multidb_info.build_reference_maps()
+    multidb_info.mount_points.update(find_zope_mount_points(multidb_info))
+    key_to_repr = multidb_info.key_to_repr
+
+    counts = multidb_info.get_external_reference_counts()
+    for (name, zodb_info) in multidb_info.zodb_infos.iteritems():
+        print 'Database: {}'.format(name)
+        print '  Objects: {}'.format(len(zodb_info.graph))
+        print '  References: {}'.format(zodb_info.graph.num_edges)
+        for ((source_name, target_name), count) in sorted(counts.iteritems()):
+            if source_name == name:
+                print '  References to {}: {}'.format(target_name, count)
+    print
+
+    print 'Mount points: {}'.format(len(multidb_info.mount_points))
+    for (mounted, mount_point) in sorted(multidb_info.mount_points.iteritems()):
+        print '  {} mounted on {}'.format(key_to_repr(mounted), key_to_repr(mount_point))
+    print
+
+    unresolved = multidb_info.get_unresolved_references()
+    print 'Unresolved cross-database references: {}'.format(len(unresolved))
+    for (source, target) in unresolved[:limit or None]:
+        print '  {} -> {}'.format(key_to_repr(source), key_to_repr(target))
+    print
+
+    for key_repr in key_reprs:
+        key = multidb_info.repr_to_key(key_repr)
+        print 'OID: {}'.format(key_to_repr(key))
+        print 'OID path: {}'.format(
+            '/'.join(key_to_repr(k) for k in reversed(multidb_info.get_oid_path(key)))
+        )
+        print 'ID path: {}'.format(
+            '/'.join(str(i) for i in reversed(multidb_info.get_id_path(key)))
+        )
+        print
@@ -0,0 +1,130 @@
+# coding=utf8
+u"""Print the objects, subtrees and classes which are written most often, and the pairs of objects
+most often written by the same transaction.
+
+Objects written by many transactions cause conflict errors and make the storage grow. Writes are
+counted in bounded memory, so the counts of objects and pairs are approximate (see
+`collective.zodbdebug.hotspots`).
+
+Usage:
+  show_hotspots [options]
+
+Options:
+  -h, --help                            Print this message.
+  --from=<time>                         Only read the transactions committed from this time, in
+                                        UTC, as YYYY-MM-DD, YYYY-MM-DDTHH:MM or
+                                        YYYY-MM-DDTHH:MM:SS.
+  --to=<time>                           Only read the transactions committed before this time.
+  --limit=<n>                           Maximum number of objects, subtrees, pairs and classes
+                                        printed [default: 20].
+  --top=<n>                             Number of objects and pairs counted. Larger values give
+                                        better counts but use more memory [default: 1000].
+  --max-transaction-size=<n>            Skip transactions with more records when counting pairs
+                                        [default: 100].
+  --max-depth=<n>                       Only print subtrees up to this depth below the root
+                                        [default: 3].
+  --compact-graph                       Build the reference graph in compact arrays instead of
+                                        dicts of sets. Uses much less memory.
+  --workers=<n>                         Number of worker processes used to build the reference
+                                        graph [default: 1].
+  --storage-config=<path>               File with a ZConfig storage section (e.g. <zeoclient> or
+                                        <relstorage>) used by the worker processes to open the
+                                        storage read-only. Not needed for FileStorage.
+  --engine=<name>                       How to build the reference graph: "traverse" follows the
+                                        references from the root, "scan" reads a FileStorage
+                                        sequentially [default: traverse].
+  --persistent-caches                   Load the ids and attribute names read by activating
+                                        objects in earlier runs, and store them at exit.
+  --profile                             Print the time spent in each phase of the run and the
+                                        statistics of the caches at exit.
+  --profile-json=<path>                 Append the profile of the run to this file, as a line of
+                                        JSON.
+"""
+from ..hotspots import analyze_writes
+from ..hotspots import get_subtree_hotspots
+from ..transactions import parse_time
+from ..transactions import time_to_tid
+from ..util import get_arguments
+from ..util import setup_logging
+from .common import make_zodb_info
+from ZODB.utils import tid_repr
+from docopt import docopt
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+def main(app, cmd_args):
+    arguments = docopt(__doc__, argv=get_arguments(cmd_args))  # noqa
+    setup_logging()
+    diagnose_hotspots(
+        make_zodb_info(app, arguments),
+        start_time=parse_time(arguments['--from']) if arguments['--from'] else None,
+        stop_time=parse_time(arguments['--to']) if arguments['--to'] else None,
+        limit=int(arguments['--limit']),
+        top=int(arguments['--top']),
+        max_transaction_size=int(arguments['--max-transaction-size']),
+        max_depth=int(arguments['--max-depth']),
+    )
+    log.info('Finish!')
+
+
+def diagnose_hotspots(
+    zodb_info, start_time=None, stop_time=None, limit=20, top=1000, max_transaction_size=100,
+    max_depth=3,
+):
+    index = zodb_info.get_transaction_index()
+    start = index.bisect(time_to_tid(start_time)) if (start_time is not None) else 0
+    stop = index.bisect(time_to_tid(stop_time)) if (stop_time is not None) else len(index)
+
+    log.info('Reading {} transactions...'.format(max(stop - start, 0)))
+    stats = analyze_writes(
+        zodb_info.storage, index, start, stop, top=top, max_transaction_size=max_transaction_size
+    )
+    zodb_info.build_reference_maps()
+
+    print 'Number of transactions: {}'.format(stats.transactions)
+    if stats.transactions:
+        print 'First transaction: {}'.format(tid_repr(stats.first_tid))
+        print 'Last transaction: {}'.format(tid_repr(stats.last_tid))
+    print 'Number of records: {}'.format(stats.records)
+    print 'Size of records: {} bytes'.format(stats.size)
+    print
+
+    oid_writes = stats.get_oid_writes()
+    log.info('Computing OID paths...')
+    zodb_info.get_oid_paths(w.oid for w in oid_writes[:limit or None])
+
+    print 'Most written objects (writes, error, bytes, path):'
+    if stats.oids.floor:
+        print '(writes may be high by up to the error, bytes are of the writes minus the error)'
+    for w in oid_writes[:limit or None]:
+        print '{}\t{}\t{}\t{}'.format(w.count, w.error, w.size, _format_path(zodb_info, w.oid))
+    print
+
+    print 'Most written subtrees (writes, bytes, path):'
+    subtrees = get_subtree_hotspots(zodb_info, oid_writes, max_depth=max_depth)
+    for s in subtrees[:limit or None]:
+        print '{}\t{}\t{}'.format(s.count, s.size, _format_path(zodb_info, s.oid))
+    print
+
+    print 'Objects most often written together (transactions, error, paths):'
+    if stats.pairs.floor:
+        print '(transactions may be high by up to the error)'
+    for p in stats.get_pair_writes(limit or None):
+        print '{}\t{}\t{}\t{}'.format(
+            p.count, p.error, _format_path(zodb_info, p.oids[0]),
+            _format_path(zodb_info, p.oids[1]),
+        )
+    print
+
+    print 'Most written classes (writes, bytes, class):'
+    for c in stats.get_class_writes(limit or None):
+        print '{}\t{}\t{}'.format(c.count, c.size, c.class_name)
+
+
+def _format_path(zodb_info, oid):
+    id_path = zodb_info.get_id_path(oid)
+    path = '/'.join(i or '?' for i in reversed(id_path))
+    return '{} ({})'.format(path, zodb_info.oid_to_repr(oid))
@@ -0,0 +1,85 @@
+# coding=utf8
+u"""Print the history of the references from and to an object: which transactions added and
+removed each one. Helps to find the transaction which broke a reference, e.g. when loading an
+object raises a POSKeyError.
+
+The history of every reference is indexed in the cache directory on the first run, reading every
+record of the storage once, and updated with the new transactions on the next runs.
+
+Usage:
+  show_reference_history [options] <oid>
+
+Examples:
+  References from and to an object: show_reference_history 0x1a2b
+  References at a transaction: show_reference_history --tid=0x03d2... 0x1a2b
+
+Options:
+  -h, --help                            Print this message.
+  --tid=<tid>                           Print the references at this transaction instead of the
+                                        last one.
+  --profile                             Print the time spent in each phase of the run and the
+                                        statistics of the caches at exit.
+  --profile-json=<path>                 Append the profile of the run to this file, as a line of
+                                        JSON.
+"""
+from ..transactions import TransactionInfo
+from ..util import get_arguments
+from ..util import setup_logging
+from .common import make_zodb_info
+from ZODB.utils import repr_to_oid
+from docopt import docopt
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+def main(app, cmd_args):
+    arguments = docopt(__doc__, argv=get_arguments(cmd_args))  # noqa
+    setup_logging()
+    diagnose_reference_history(
+        make_zodb_info(app, arguments),
+        arguments['<oid>'],
+        tid=repr_to_oid(arguments['--tid']) if arguments['--tid'] else None,
+    )
+    log.info('Finish!')
+
+
+def diagnose_reference_history(zodb_info, oid, tid=None):
+    u"""Print the references from and to `oid` at the transaction `tid`, by default the last one,
+    and when each reference was added and removed.
+    """
+    oid = zodb_info.oid_or_repr_to_oid(oid)
+    history = zodb_info.get_reference_history()
+    at = 'transaction {}'.format(_format_tid(tid)) if tid else 'the last transaction'
+
+    print 'OID: {}'.format(zodb_info.oid_to_repr(oid))
+    print 'Class: {}'.format(zodb_info.get_class_name(oid) or '(deleted)')
+    print
+    print 'References at {}:'.format(at)
+    for ref in sorted(history.get_references(oid, tid)):
+        print '  {}'.format(zodb_info.oid_to_repr(ref))
+    print 'Back references at {}:'.format(at)
+    for ref in sorted(history.get_back_references(oid, tid)):
+        print '  {}'.format(zodb_info.oid_to_repr(ref))
+    print
+
+    print 'History of the references (target, added by, removed by):'
+    for interval in history.get_reference_intervals(oid):
+        _print_interval(zodb_info, interval.target, interval)
+    print 'History of the back references (source, added by, removed by):'
+    for interval in history.get_back_reference_intervals(oid):
+        _print_interval(zodb_info, interval.source, interval)
+
+
+def _print_interval(zodb_info, oid, interval):
+    print '  {}\t{}\t{}'.format(
+        zodb_info.oid_to_repr(oid),
+        _format_tid(interval.added_tid),
+        _format_tid(interval.removed_tid) if interval.removed_tid else '-',
+    )
+
+
+def _format_tid(tid):
+    info = TransactionInfo(tid=tid)
+    return '{} ({})'.format(info.tid_repr, info.time_str)
@@ -0,0 +1,68 @@
+# coding=utf8
+u"""Print the objects which keep the most bytes alive: the size of the records which would become
+unreachable, and be removed by the next pack, if each object was removed.
+
+Sizes are the sizes of the pickles of the current records, old revisions are not accounted.
+
+Usage:
+  show_retained [options]
+
+Options:
+  -h, --help                            Print this message.
+  --limit=<n>                           Maximum number of objects printed [default: 50].
+  --compact-graph                       Build the reference graph in compact arrays instead of
+                                        dicts of sets. Uses much less memory.
+  --workers=<n>                         Number of worker processes used to build the reference
+                                        graph [default: 1].
+  --storage-config=<path>               File with a ZConfig storage section (e.g. <zeoclient> or
+                                        <relstorage>) used by the worker processes to open the
+                                        storage read-only. Not needed for FileStorage.
+  --engine=<name>                       How to build the reference graph: "traverse" follows the
+                                        references from the root, "scan" reads a FileStorage
+                                        sequentially [default: traverse].
+  --persistent-caches                   Load the ids and attribute names read by activating
+                                        objects in earlier runs, and store them at exit.
+  --profile                             Print the time spent in each phase of the run and the
+                                        statistics of the caches at exit.
+  --profile-json=<path>                 Append the profile of the run to this file, as a line of
+                                        JSON.
+"""
+from ..dominators import get_dominator_tree
+from ..util import get_arguments
+from ..util import setup_logging
+from .common import make_zodb_info
+from docopt import docopt
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+def main(app, cmd_args):
+    arguments = docopt(__doc__, argv=get_arguments(cmd_args))  # noqa
+    setup_logging()
+    diagnose_retained(make_zodb_info(app, arguments), limit=int(arguments['--limit']))
+    log.info('Finish!')
+
+
+def diagnose_retained(zodb_info, limit=50):
+    zodb_info.build_reference_maps()
+
+    tree = get_dominator_tree(zodb_info)
+    retainers = tree.get_top_retainers(limit)
+    log.info('Computing OID paths...')
+    zodb_info.get_oid_paths(r.oid for r in retainers)
+
+    print 'Number of reachable objects: {}'.format(len(tree))
+    print 'Size of reachable objects: {} bytes'.format(
+        tree.get_retained_size(zodb_info.root_oid).retained_size
+    )
+    print
+    print 'Largest retainers (retained bytes, objects, own bytes, path, dominator):'
+    for r in retainers:
+        id_path = zodb_info.get_id_path(r.oid)
+        path = '/'.join(i or '?' for i in reversed(id_path))
+        print '{}\t{}\t{}\t{} ({})\t{}'.format(
+            r.retained_size, r.retained_count, r.size, path, zodb_info.oid_to_repr(r.oid),
+            zodb_info.oid_to_repr(r.dominator_oid),
+        )
@@ -0,0 +1,77 @@
+# coding=utf8
+u"""Print where the bytes of the database are: the size of each subtree of the containment tree,
+like `du`, and the size of each class.
+
+Sizes are the sizes of the pickles of the current records, old revisions are not accounted.
+
+Usage:
+  show_sizes [options]
+
+Options:
+  -h, --help                            Print this message.
+  --max-depth=<n>                       Only print subtrees up to this depth below the root
+                                        [default: 3].
+  --limit=<n>                           Maximum number of subtrees and classes printed, 0 prints
+                                        all of them [default: 50].
+  --top=<n>                             Number of largest objects printed for each class
+                                        [default: 5].
+  --compact-graph                       Build the reference graph in compact arrays instead of
+                                        dicts of sets. Uses much less memory.
+  --workers=<n>                         Number of worker processes used to build the reference
+                                        graph [default: 1].
+  --storage-config=<path>               File with a ZConfig storage section (e.g. <zeoclient> or
+                                        <relstorage>) used by the worker processes to open the
+                                        storage read-only. Not needed for FileStorage.
+  --engine=<name>                       How to build the reference graph: "traverse" follows the
+                                        references from the root, "scan" reads a FileStorage
+                                        sequentially [default: traverse].
+  --persistent-caches                   Load the ids and attribute names read by activating
+                                        objects in earlier runs, and store them at exit.
+  --profile                             Print the time spent in each phase of the run and the
+                                        statistics of the caches at exit.
+  --profile-json=<path>                 Append the profile of the run to this file, as a line of
+                                        JSON.
+"""
+from ..sizes import get_class_sizes
+from ..sizes import get_subtree_sizes
+from ..util import get_arguments
+from ..util import setup_logging
+from .common import make_zodb_info
+from docopt import docopt
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+def main(app, cmd_args):
+    arguments = docopt(__doc__, argv=get_arguments(cmd_args))  # noqa
+    setup_logging()
+    diagnose_sizes(
+        make_zodb_info(app, arguments),
+        max_depth=int(arguments['--max-depth']),
+        limit=int(arguments['--limit']),
+        top=int(arguments['--top']),
+    )
+    log.info('Finish!')
+
+
+def diagnose_sizes(zodb_info, max_depth=3, limit=50, top=5):
+    zodb_info.build_reference_maps()
+
+    print 'Largest subtrees (bytes, objects, path):'
+    for subtree in get_subtree_sizes(zodb_info, max_depth=max_depth)[:limit or None]:
+        id_path = zodb_info.get_id_path(subtree.oid)
+        path = '/'.join(i or '?' for i in reversed(id_path))
+        print '{}\t{}\t{} ({})'.format(
+            subtree.size, subtree.count, path, zodb_info.oid_to_repr(subtree.oid)
+        )
+    print
+
+    for class_size in get_class_sizes(zodb_info, top=top)[:limit or None]:
+        print 'Class: {}'.format(class_size.class_name)
+        print 'Objects: {}'.format(class_size.count)
+        print 'Size: {} bytes'.format(class_size.size)
+        for (oid, size) in class_size.largest:
+            print 'Largest: {} ({} bytes)'.format(zodb_info.oid_to_repr(oid), size)
+        print
@@ -3,21 +3,73 @@ u"""Print information about the ZODB transactions.
 
 Usage:
   show_transactions [options] <start> <count>
+  show_transactions [options] --tid=<tid>
+  show_transactions [options] --from=<time> [--to=<time>]
 
 Arguments:
   Arguments are interpreted as if the transactions are represented by a list, where 0 is the index
   of the most recent transaction. The selected transactions will be transactions[start:start+count].
 
+  Times are in UTC, written as YYYY-MM-DD, YYYY-MM-DDTHH:MM or YYYY-MM-DDTHH:MM:SS.
+
+  With --format=jsonl or --format=csv a record is written per object modified by each transaction,
+  with the fields of `TRANSACTION_FIELDS` and the fields of the object selected with --fields, and
+  the logs are printed to stderr.
+
+  With --socket the info of the objects is asked to a graph server started with
+  `bin/instance serve_graph` (see `collective.zodbdebug.server`) instead of building the reference
+  graph. The server must serve the same database.
+
 Examples:
   Most recent transaction: show_transactions 0 1
   Five transactions starting at the third most recent transaction: show_transactions 2 5
+  Transactions of a day: show_transactions --from=2019-07-03 --to=2019-07-04
 
 Options:
   -h, --help                            Print this message.
+  --tid=<tid>                           Show the transaction with this id, e.g. 0x03d2...
+  --from=<time>                         Show the transactions committed from this time.
+  --to=<time>                           Show the transactions committed before this time.
+  --format=<name>                       Output format: "text", or a record per modified object in
+                                        JSON lines ("jsonl") or CSV ("csv") [default: text].
+  --fields=<names>                      Comma-separated fields of the info of each object: oid,
+                                        id, obj, path, oid_path and id_path. Only the selected
+                                        ones are computed; "obj" and "path" load the objects
+                                        [default: oid,id,obj,path,oid_path,id_path].
+  --socket=<path>                       Get the info of the objects from the graph server
+                                        listening on this Unix socket, e.g.
+                                        ~/.cache/collective.zodbdebug/server.sock.
+  --compact-graph                       Build the reference graph in compact arrays instead of
+                                        dicts of sets. Uses much less memory.
+  --workers=<n>                         Number of worker processes used to build the reference
+                                        graph [default: 1].
+  --storage-config=<path>               File with a ZConfig storage section (e.g. <zeoclient> or
+                                        <relstorage>) used by the worker processes to open the
+                                        storage read-only. Not needed for FileStorage.
+  --engine=<name>                       How to build the reference graph: "traverse" follows the
+                                        references from the root, "scan" reads a FileStorage
+                                        sequentially [default: traverse].
+  --persistent-caches                   Load the ids and attribute names read by activating
+                                        objects in earlier runs, and store them at exit.
+  --profile                             Print the time spent in each phase of the run and the
+                                        statistics of the caches at exit.
+  --profile-json=<path>                 Append the profile of the run to this file, as a line of
+                                        JSON.
 """
-from ..core import ZODBInfo
+from ..core import OID_INFO_FIELDS
+from ..output import FORMAT_TEXT
+from ..output import make_record_writer
 from ..util import get_arguments
 from ..util import setup_logging
+from ..transactions import parse_time
+from .common import format_oid_info
+from .common import get_message_stream
+from .common import get_oid_info_fields
+from .common import get_output_format
+from .common import iter_oid_info_dicts
+from .common import make_zodb_info
+from .common import open_graph_client
+from ZODB.utils import repr_to_oid
 from docopt import docopt
 import itertools
 import logging
@@ -25,32 +77,139 @@ import logging
 
 log = logging.getLogger(__name__)
 
+# Fields of the records written with `--format`, before the fields of the `OIDInfo`.
+TRANSACTION_FIELDS = ('tid', 'time', 'user', 'description', 'record_size', 'class_name')
+
 
 def main(app, cmd_args):
     arguments = docopt(__doc__, argv=get_arguments(cmd_args))  # noqa
-    setup_logging()
-
-    start = int(arguments['<start>'])
-    count = int(arguments['<count>'])
+    output_format = get_output_format(arguments)
+    fields = get_oid_info_fields(arguments)
+    setup_logging(stream=get_message_stream(arguments))
 
-    diagnose_transactions(app, start, count)
+    zodb_info = make_zodb_info(app, arguments)
+    client = open_graph_client(arguments)
+    if arguments['--tid']:
+        diagnose_transaction(
+            zodb_info, repr_to_oid(arguments['--tid']), output_format=output_format,
+            fields=fields, client=client,
+        )
+    elif arguments['--from']:
+        diagnose_transactions_by_time(
+            zodb_info,
+            parse_time(arguments['--from']),
+            parse_time(arguments['--to']) if arguments['--to'] else None,
+            output_format=output_format, fields=fields, client=client,
+        )
+    else:
+        start = int(arguments['<start>'])
+        count = int(arguments['<count>'])
+        diagnose_transactions(
+            zodb_info, start, count, output_format=output_format, fields=fields, client=client,
+        )
     log.info('Finish!')
 
 
-def diagnose_transactions(app, start, count):
-    zodb_info = ZODBInfo(app._p_jar)
-    zodb_info.build_reference_maps()
+def diagnose_transactions(
+    zodb_info, start, count, output_format=FORMAT_TEXT, fields=OID_INFO_FIELDS, client=None,
+):
+    u"""Print the transactions `start` to `start + count`, counting from the most recent one.
+
+    The transactions are found in the transaction index, so only them are read from the storage.
+    With another `output_format` than `FORMAT_TEXT` a record per modified object is written
+    instead (see `.output`), and flushed after each transaction. Only the `fields` of the OID
+    info of the objects are computed and printed. With a `client` of a graph server they are
+    asked to it, without building the reference graph (see `.common.iter_oid_info_dicts()`).
+    """
+    index = zodb_info.get_transaction_index()
+    stop = len(index) - start
+    transactions = reversed(index.get_range(stop - count, stop))
+    _print_transactions(zodb_info, transactions, start, output_format, fields, client)
+
+
+def diagnose_transaction(
+    zodb_info, tid, output_format=FORMAT_TEXT, fields=OID_INFO_FIELDS, client=None,
+):
+    u"""Print the transaction `tid`."""
+    index = zodb_info.get_transaction_index()
+    i = index.find(tid)
+    if i is None:
+        if output_format == FORMAT_TEXT:
+            print 'Transaction not found.'
+        else:
+            log.warning('Transaction not found.')
+        return
+    _print_transactions(
+        zodb_info, [index[i]], len(index) - 1 - i, output_format, fields, client
+    )
+
 
-    transactions = reversed(list(zodb_info.iter_oids_modified_by_each_transaction()))
-    transactions = itertools.islice(transactions, start, start + count)
-    for (i, oids) in enumerate(transactions):
+def diagnose_transactions_by_time(
+    zodb_info, start_time, stop_time=None, output_format=FORMAT_TEXT, fields=OID_INFO_FIELDS,
+    client=None,
+):
+    u"""Print the transactions committed from `start_time` to `stop_time` (Unix times), most
+    recent first.
+    """
+    index = zodb_info.get_transaction_index()
+    transactions = index.get_time_range(start_time, stop_time)
+    position = len(index) - index.bisect(transactions[-1].tid) - 1 if transactions else 0
+    _print_transactions(
+        zodb_info, reversed(transactions), position, output_format, fields, client
+    )
+
+
+def _print_transactions(
+    zodb_info, transactions, start, output_format=FORMAT_TEXT, fields=OID_INFO_FIELDS,
+    client=None,
+):
+    if client is None:
+        zodb_info.build_reference_maps()
+
+    transactions = [
+        (t, zodb_info.get_oids_modified_by_transaction(t)) for t in transactions
+    ]
+
+    if (client is None) and {'oid_path', 'id_path'}.intersection(fields):
+        log.info('Computing OID paths...')
+        zodb_info.get_oid_paths(
+            itertools.chain.from_iterable(oids for (_, oids) in transactions)
+        )
+
+    if output_format != FORMAT_TEXT:
+        _write_transactions(zodb_info, transactions, output_format, fields, client)
+        return
+
+    for (i, (transaction_info, oids)) in enumerate(transactions):
         print 'Transaction {}'.format(start + i)
+        print 'Transaction id: {}'.format(transaction_info.tid_repr)
+        print 'Time: {}'.format(transaction_info.time_str)
+        print 'User: {}'.format(transaction_info.user)
+        print 'Description: {}'.format(transaction_info.description)
+        print 'Size: {} bytes'.format(transaction_info.size)
         print 'Number of modified objects: {}'.format(len(oids))
-        for oid in oids:
+        for oid_info in iter_oid_info_dicts(zodb_info, oids, fields, client=client):
             print
-            print zodb_info.get_oid_info(oid)
+            print format_oid_info(oid_info)
         print '-' * 80
 
 
+def _write_transactions(zodb_info, transactions, output_format, fields, client=None):
+    writer = make_record_writer(output_format, TRANSACTION_FIELDS + tuple(fields))
+    for (transaction_info, oids) in transactions:
+        oid_infos = iter_oid_info_dicts(zodb_info, oids, fields, client=client)
+        for (oid, record) in itertools.izip(oids, oid_infos):
+            record.update(
+                tid=transaction_info.tid_repr,
+                time=transaction_info.time_str,
+                user=transaction_info.user,
+                description=transaction_info.description,
+                record_size=zodb_info.get_record_size(oid),
+                class_name=zodb_info.get_class_name(oid),
+            )
+            writer.write(record)
+        writer.flush()
+
+
 def _str_to_int_or_none(s):
     return None if ((not s) or (s.lower() == 'none')) else int(s)
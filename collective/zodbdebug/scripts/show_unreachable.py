@@ -0,0 +1,67 @@
+# coding=utf8
+u"""Print the objects which are stored but not reachable from the root.
+
+These objects are removed by the next pack, so the report estimates how much space a pack reclaims
+(only current revisions are accounted). The reference graph is always built with the "scan" engine,
+which requires a FileStorage.
+
+Usage:
+  show_unreachable [options]
+
+Options:
+  -h, --help                            Print this message.
+  --limit=<n>                           Maximum number of subgraphs and objects printed, 0 prints
+                                        all of them [default: 20].
+  --compact-graph                       Build the reference graph in compact arrays instead of
+                                        dicts of sets. Uses much less memory.
+  --profile                             Print the time spent in each phase of the run and the
+                                        statistics of the caches at exit.
+  --profile-json=<path>                 Append the profile of the run to this file, as a line of
+                                        JSON.
+"""
+from ..core import ENGINE_SCAN
+from ..orphans import get_unreachable_objects
+from ..orphans import get_unreachable_subgraphs
+from ..util import get_arguments
+from ..util import setup_logging
+from .common import make_zodb_info
+from docopt import docopt
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+def main(app, cmd_args):
+    arguments = docopt(__doc__, argv=get_arguments(cmd_args))  # noqa
+    setup_logging()
+    arguments['--engine'] = ENGINE_SCAN
+    diagnose_unreachable(make_zodb_info(app, arguments), limit=int(arguments['--limit']))
+    log.info('Finish!')
+
+
+def diagnose_unreachable(zodb_info, limit=20):
+    zodb_info.build_reference_maps()
+
+    oids = zodb_info.get_unreachable_oids()
+    objects = get_unreachable_objects(zodb_info, oids)
+    subgraphs = get_unreachable_subgraphs(zodb_info, oids)
+    class_names = {o.oid: o.class_name for o in objects}
+
+    print 'Number of unreachable objects: {}'.format(len(objects))
+    print 'Size of unreachable objects: {} bytes'.format(sum(o.size or 0 for o in objects))
+    print 'Number of unreachable subgraphs: {}'.format(len(subgraphs))
+    print
+
+    for subgraph in subgraphs[:limit or None]:
+        print 'Subgraph size: {} bytes'.format(subgraph.size)
+        print 'Subgraph objects: {}'.format(len(subgraph.oids))
+        for oid in subgraph.entry_oids:
+            print 'Entry: {} ({})'.format(zodb_info.oid_to_repr(oid), class_names[oid])
+        print
+
+    for o in objects[:limit or None]:
+        print 'OID: {}'.format(zodb_info.oid_to_repr(o.oid))
+        print 'Class: {}'.format(o.class_name)
+        print 'Size: {} bytes'.format(o.size)
+        print
@@ -0,0 +1,295 @@
+# coding=utf8
+u"""Answer queries about the reference graph from a long-running process, over a Unix socket.
+
+Every run of a script creates a `ZODBInfo`, opens (or builds) the reference graph and computes
+OID paths, then throws everything away. `GraphServer` keeps a `ZODBInfo` with its graph and its
+caches in memory and answers queries from local clients, see `query()`.
+
+Protocol:
+    One JSON object per line, in both directions. A request is
+    `{"method": "oid_path", "args": ["0x1234"]}` and its response is `{"result": ...}` or
+    `{"error": "..."}`. A connection can send any number of requests. OIDs are sent as OID
+    representations. See `GraphServer.METHODS` for the methods.
+
+New transactions:
+    Every `poll_interval` seconds the server looks for transactions committed after its graph was
+    built. When there are new ones a new `ZODBInfo` is created and its graph built, which only
+    replays the new transactions on the cached graph (see `ZODBInfo.build_reference_maps()`), and
+    then it replaces the old one, with its caches. If the new graph cannot be built, e.g. because
+    the storage cannot be reached, the error is logged and the old graph is still served until the
+    next poll.
+
+Queries are answered one at a time, since a ZODB connection must not be used by many threads at
+once, but idle connections do not block other clients.
+"""
+from .config import PACKAGE_NAME
+from .sizes import get_subtree_sizes
+from ZODB.POSException import POSError
+from ZODB.utils import tid_repr
+from logging import getLogger
+import SocketServer
+import errno
+import json
+import os
+import socket
+import threading
+import time
+
+log = getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = os.path.join('~', '.cache', PACKAGE_NAME, 'server.sock')
+
+
+class ServerError(Exception):
+    u"""Error answered by the server, or the server could not be reached."""
+
+
+class GraphServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    u"""Serve queries about the reference graph of a database.
+
+    Arguments:
+    make_zodb_info (Callable[[], ZODBInfo]) -- Create a new `ZODBInfo` for the database. Called
+        once at startup and again when there are new transactions.
+    socket_path (str) -- Path of the Unix socket. Only the owner can connect to it.
+    poll_interval (float) -- Seconds between checks for new transactions.
+    """
+
+    METHODS = (
+        'status', 'oid_path', 'id_path', 'references', 'back_references', 'info', 'size',
+    )
+
+    daemon_threads = True
+
+    def __init__(self, make_zodb_info, socket_path, poll_interval=5.0):
+        self.make_zodb_info = make_zodb_info
+        self.socket_path = socket_path
+        self.poll_interval = poll_interval
+        self.timeout = poll_interval
+        self.zodb_info = None
+        self.last_transaction = None
+        self.queries = 0
+        self._lock = threading.Lock()
+        self._subtree_sizes = None
+        self._running = False
+
+        _remove_stale_socket(socket_path)
+        old_umask = os.umask(0o077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def serve(self):
+        u"""Build the graph, then answer queries until `shutdown()` is called."""
+        self.refresh()
+        log.info('Listening on {}'.format(self.socket_path))
+        self._running = True
+        last_poll_time = time.time()
+        try:
+            while self._running:
+                self.handle_request()
+                now = time.time()
+                if now - last_poll_time >= self.poll_interval:
+                    last_poll_time = now
+                    self._try_refresh()
+        finally:
+            self.server_close()
+
+    def shutdown(self):
+        self._running = False
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def refresh(self):
+        u"""Rebuild the graph if there are new transactions."""
+        with self._lock:
+            if self.zodb_info is not None:
+                # Ending the transaction of the connection makes it see the new transactions.
+                self.zodb_info.connection.transaction_manager.abort()
+                last_transaction = self.zodb_info.connection.db().lastTransaction()
+                if last_transaction == self.last_transaction:
+                    return
+                log.info('New transactions, last one is {}.'.format(tid_repr(last_transaction)))
+
+            zodb_info = self.make_zodb_info()
+            zodb_info.build_reference_maps()
+            self.zodb_info = zodb_info
+            self.last_transaction = zodb_info.connection.db().lastTransaction()
+            self._subtree_sizes = None
+            log.info('Serving the graph of transaction {}.'.format(
+                tid_repr(self.last_transaction)))
+
+    def _try_refresh(self):
+        u"""Like `refresh()`, but keep serving the current graph if the new one cannot be built. It
+        is tried again at the next poll.
+        """
+        try:
+            self.refresh()
+        except Exception:  # noqa
+            log.exception(
+                'Cannot update the graph, still serving the graph of transaction {}.'.format(
+                    tid_repr(self.last_transaction)))
+
+    def answer(self, request):
+        u"""Return (Dict[str, Any]) the response to a request, see the module docstring."""
+        try:
+            method = request.get('method')
+            args = request.get('args') or []
+            if method not in self.METHODS:
+                raise ServerError('Unknown method: {}'.format(method))
+
+            with self._lock:
+                self.queries += 1
+                result = getattr(self, '_query_' + method)(*args)
+            return {'result': result}
+        except (ServerError, POSError, TypeError, AttributeError, ValueError, KeyError) as e:
+            return {'error': '{}: {}'.format(type(e).__name__, e)}
+
+    # Methods --------------------------------------------------------------------------------------
+
+    def _query_status(self):
+        graph = self.zodb_info.graph
+        return {
+            'last_transaction': tid_repr(self.last_transaction),
+            'oids': len(graph),
+            'references': graph.num_edges,
+            'queries': self.queries,
+        }
+
+    def _query_oid_path(self, oid):
+        oid_path = self.zodb_info.get_oid_path(self._get_oid(oid))
+        return [self.zodb_info.oid_to_repr(i) for i in reversed(oid_path)]
+
+    def _query_id_path(self, oid):
+        return [_to_text(i) for i in reversed(self.zodb_info.get_id_path(self._get_oid(oid)))]
+
+    def _query_references(self, oid):
+        references = self.zodb_info.get_references(self._get_oid(oid))
+        return sorted(self.zodb_info.oid_to_repr(i) for i in references)
+
+    def _query_back_references(self, oid):
+        back_references = self.zodb_info.get_back_references(self._get_oid(oid))
+        return sorted(self.zodb_info.oid_to_repr(i) for i in back_references)
+
+    def _query_info(self, oid, fields=None):
+        # Like `ZODBInfo.get_oid_info()`, any object has an info, e.g. the owner of an orphaned
+        # blob, which is not in the graph.
+        info = self.zodb_info.get_oid_info(self._get_oid(oid, in_graph=False), fields)
+        return {k: _to_text(v) for (k, v) in info.as_str_dict(fields).iteritems()}
+
+    def _query_size(self, oid):
+        oid = self._get_oid(oid)
+        if self._subtree_sizes is None:
+            self._subtree_sizes = dict(
+                (s.oid, (s.size, s.count)) for s in get_subtree_sizes(self.zodb_info)
+            )
+        (subtree_size, subtree_count) = self._subtree_sizes.get(oid, (None, None))
+        return {
+            'size': self.zodb_info.get_record_size(oid),
+            'class_name': self.zodb_info.get_class_name(oid),
+            'subtree_size': subtree_size,
+            'subtree_count': subtree_count,
+        }
+
+    def _get_oid(self, oid_repr, in_graph=True):
+        if not isinstance(oid_repr, basestring) or not oid_repr.startswith('0x'):
+            raise ValueError('Expected an OID representation, got {!r}'.format(oid_repr))
+        oid = self.zodb_info.repr_to_oid(str(oid_repr))
+        if in_graph and (oid not in self.zodb_info.oids):
+            raise ServerError('OID not in the reference graph: {}'.format(oid_repr))
+        return oid
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('Expected a JSON object')
+            except ValueError as e:
+                response = {'error': 'Bad request: {}'.format(e)}
+            else:
+                response = self.server.answer(request)
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+
+def query(socket_path, method, *args):
+    u"""Send a single request to a `GraphServer`.
+
+    Arguments:
+    socket_path (str) -- Path of the socket of the server.
+    method (str) -- One of `GraphServer.METHODS`.
+    args -- Arguments of the method.
+
+    Return (Any) -- The result, decoded from JSON.
+    Raise (ServerError) -- If the server answers with an error or cannot be reached.
+    """
+    with GraphClient(socket_path) as client:
+        return client.query(method, *args)
+
+
+class GraphClient(object):
+    u"""Connection to a `GraphServer`, which can send many requests."""
+
+    def __init__(self, socket_path):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(socket_path)
+        except socket.error as e:
+            self._socket.close()
+            raise ServerError('Cannot connect to {}: {}'.format(socket_path, e))
+        self._file = self._socket.makefile('r+b')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def query(self, method, *args):
+        u"""See `query()`."""
+        self._file.write(json.dumps({'method': method, 'args': args}) + '\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ServerError('Connection closed by the server')
+
+        response = json.loads(line)
+        if 'error' in response:
+            raise ServerError(response['error'])
+        return response['result']
+
+
+def _remove_stale_socket(socket_path):
+    u"""Remove the socket file left by a server which is not running anymore."""
+    if not os.path.exists(socket_path):
+        return
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(socket_path)
+    except socket.error as e:
+        if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+            raise
+        os.remove(socket_path)
+    else:
+        raise ServerError('A server is already listening on {}'.format(socket_path))
+    finally:
+        s.close()
+
+
+def _to_text(value):
+    # Ids are byte strings which JSON can only encode if they are valid UTF-8.
+    if isinstance(value, str):
+        return value.decode('utf8', 'replace')
+    return value
@@ -0,0 +1,156 @@
+# coding=utf8
+u"""Find where the bytes of a database are.
+
+The size and the class of each record are stored in the reference graph while it is built (see
+`.graph.NODE_ATTRIBUTES`), so the reports below do not load any record when the graph has them.
+
+- `get_subtree_sizes()`: like `du`, the size of each object together with everything it
+  contains. Sizes are rolled up the containment tree given by the best back reference of each
+  object, the next OID in its OID path (see `ZODBInfo.get_parent_indexes()`), so each object is
+  counted once, in its most likely container.
+
+- `get_class_sizes()`: number of objects and total size by class, with the largest objects of
+  each class.
+"""
+from .graph import UINT64_TYPECODE
+from array import array
+from rbco.caseclasses import case
+import heapq
+import itertools
+
+
+def get_subtree_sizes(zodb_info, max_depth=None):
+    u"""Get the size of the subtree of each reachable object, largest first.
+
+    The parent of every object is found in one pass (see `ZODBInfo.get_parent_indexes()`), then
+    the subtrees are added to their parents deepest first, so each one is complete when it is
+    added. Objects whose parents do not lead to the root, e.g. because they form a cycle, are left
+    out.
+
+    Arguments:
+    zodb_info (ZODBInfo) -- With the reference maps built.
+    max_depth (Optional[int]) -- Only return subtrees up to this depth, the root has depth 0.
+
+    Return (List[SubtreeSize])
+    """
+    oids = []
+    sizes = array(UINT64_TYPECODE)
+    for (oid, size) in zodb_info.graph.iter_attributes('size'):
+        oids.append(oid)
+        sizes.append(size if (size is not None) else (zodb_info.get_record_size(oid) or 0))
+
+    (nodes, indexes, parents) = zodb_info.get_parent_indexes(oids)
+    del oids
+    sizes.extend(zodb_info.get_record_size(oid) or 0 for oid in nodes[len(sizes):])
+    depths = _get_depths(parents, indexes.get(zodb_info.root_oid))
+    del indexes
+
+    counts = array(UINT64_TYPECODE, [1]) * len(nodes)
+    for i in sorted(xrange(len(nodes)), key=depths.__getitem__, reverse=True):
+        if depths[i] > 0:
+            parent = parents[i]
+            sizes[parent] += sizes[i]
+            counts[parent] += counts[i]
+
+    result = [
+        SubtreeSize(oid=oid, depth=depth, size=size, count=count)
+        for (oid, depth, size, count) in itertools.izip(nodes, depths, sizes, counts)
+        if (depth >= 0) and ((max_depth is None) or (depth <= max_depth))
+    ]
+    result.sort(key=lambda s: (-s.size, s.oid))
+    return result
+
+
+def _get_depths(parents, root):
+    u"""Return (array) the depth of each object in the tree given by the indexes of their `parents`
+    below the index `root`, -1 for the objects whose parents do not lead to it.
+    """
+    (unknown, visiting) = (-2, -3)
+    depths = array('l', [unknown]) * len(parents)
+    if root is not None:
+        depths[root] = 0
+
+    for start in xrange(len(parents)):
+        # Follow the parents up to an object whose depth is known, then set the depths down.
+        chain = []
+        i = start
+        while (i >= 0) and (depths[i] == unknown):
+            depths[i] = visiting
+            chain.append(i)
+            i = parents[i]
+
+        depth = depths[i] if (i >= 0) and (depths[i] >= 0) else -1
+        for j in reversed(chain):
+            if depth >= 0:
+                depth += 1
+            depths[j] = depth
+    return depths
+
+
+def get_class_sizes(zodb_info, top=10):
+    u"""Get the number of objects and the total size of each class, largest first.
+
+    Every object in the reference maps is included, reachable or not.
+
+    Arguments:
+    zodb_info (ZODBInfo) -- With the reference maps built.
+    top (int) -- Number of largest objects kept for each class.
+
+    Return (List[ClassSize])
+    """
+    totals = {}
+    for (oid, size, class_name) in zodb_info.graph.iter_attributes('size', 'class_name'):
+        if size is None:
+            size = zodb_info.get_record_size(oid)
+        if class_name is None:
+            class_name = zodb_info.get_class_name(oid)
+        if (size is None) and (class_name is None):
+            # No record, e.g. a reference to a missing object.
+            continue
+
+        total = totals.get(class_name)
+        if total is None:
+            total = totals[class_name] = [0, 0, []]
+        total[0] += 1
+        total[1] += size or 0
+
+        largest = total[2]
+        if len(largest) < top:
+            heapq.heappush(largest, (size or 0, oid))
+        elif top:
+            heapq.heappushpop(largest, (size or 0, oid))
+
+    result = [
+        ClassSize(
+            class_name=class_name,
+            count=count,
+            size=size,
+            largest=tuple((oid, s) for (s, oid) in sorted(largest, reverse=True)),
+        )
+        for (class_name, (count, size, largest)) in totals.iteritems()
+    ]
+    result.sort(key=lambda c: (-c.size, c.class_name))
+    return result
+
+
+@case
+class SubtreeSize(object):
+    u"""Size of an object together with the objects it contains.
+
+    `depth` is the distance from the root, `size` the total size of the records, in bytes, and
+    `count` the number of objects, including the object itself.
+    """
+
+    def __init__(self, oid, depth, size, count):
+        pass
+
+
+@case
+class ClassSize(object):
+    u"""Number of objects and total size of the records of a class.
+
+    `largest` holds the largest objects of the class as `(oid, size)` pairs, largest first.
+    """
+
+    def __init__(self, class_name, count, size, largest=()):
+        pass
@@ -0,0 +1,280 @@
+# coding=utf8
+u"""Extract a part of the reference graph and export it for other tools.
+
+- `extract_subgraph()`: the objects reachable from an object, up to a depth, a number of objects
+  or a number of bytes. The records are loaded from the storage while the references are
+  followed, breadth first, and the search stops as soon as a limit is reached, so the reference
+  graph of the whole database is neither built nor cached.
+
+- `get_back_reference_neighbourhood()`: the objects from which an object can be reached in at most
+  `hops` references, e.g. to see what keeps it alive. Finding back references needs the whole
+  graph, see `ZODBInfo.build_reference_maps()`.
+
+Both return a `Subgraph`, which is written by `write_subgraph()`:
+
+- `FORMAT_EDGELIST`: tab-separated values, a line per reference with the class and the size of
+  its source and target, after a header line. Objects without references are written with an
+  empty target.
+- `FORMAT_GRAPHML`: GraphML (http://graphml.graphdrawing.org/), read by e.g. NetworkX, Gephi or
+  Cytoscape, with the class, size and id of each object and the attribute name of each reference.
+
+OIDs are written as OID representations, e.g. `0x1a2b`.
+"""
+from . import profiling
+from .core import get_record_info
+from .graph import make_graph_builder
+from ZODB.POSException import POSKeyError
+from ZODB.utils import oid_repr
+from logging import getLogger
+from rbco.caseclasses import case
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+import collections
+import csv
+import re
+
+log = getLogger(__name__)
+
+FORMAT_EDGELIST = 'edgelist'
+FORMAT_GRAPHML = 'graphml'
+FORMATS = (FORMAT_EDGELIST, FORMAT_GRAPHML)
+
+EDGELIST_FIELDS = (
+    'source', 'target', 'attr_name', 'source_class', 'source_size', 'target_class', 'target_size',
+)
+
+# `(id, target, name, type)` of the GraphML attributes.
+_GRAPHML_KEYS = (
+    ('d0', 'node', 'class_name', 'string'),
+    ('d1', 'node', 'size', 'long'),
+    ('d2', 'node', 'id', 'string'),
+    ('d3', 'node', 'state', 'string'),
+    ('d4', 'edge', 'attr_name', 'string'),
+)
+
+# States of the objects of a `Subgraph`.
+STATE_LOADED = 'loaded'
+STATE_FRONTIER = 'frontier'
+STATE_MISSING = 'missing'
+
+# Characters which are not allowed in XML 1.0.
+_INVALID_XML_CHARS = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def extract_subgraph(zodb_info, root_oid, max_depth=None, max_objects=None, max_bytes=None):
+    u"""Extract the objects reachable from `root_oid`, loading their records breadth first until a
+    limit is reached. The reference maps of `zodb_info` are not needed.
+
+    The referenced objects which were not loaded, since a limit was reached, are in the subgraph
+    as its frontier, without attributes.
+
+    Arguments:
+    zodb_info (ZODBInfo) -- The database.
+    root_oid (str) -- OID or OID representation of the first object.
+    max_depth (Optional[int]) -- Maximum number of references from `root_oid`.
+    max_objects (Optional[int]) -- Maximum number of records loaded.
+    max_bytes (Optional[int]) -- Stop once this number of bytes of records are loaded.
+
+    Return (Subgraph)
+    """
+    root_oid = zodb_info.oid_or_repr_to_oid(root_oid)
+    builder = make_graph_builder()
+    storage = zodb_info.storage
+    depths = {root_oid: 0}
+    queue = collections.deque([root_oid])
+    missing = set()
+    num_objects = 0
+    num_bytes = 0
+
+    with profiling.timer('subgraph.extract'):
+        while queue:
+            if ((max_objects is not None) and (num_objects >= max_objects)) or (
+                (max_bytes is not None) and (num_bytes >= max_bytes)
+            ):
+                break
+
+            oid = queue.popleft()
+            try:
+                (p, _) = storage.load(oid)
+            except POSKeyError:
+                missing.add(oid)
+                continue
+
+            (refs, attributes, attr_names) = get_record_info(p)
+            builder.add_references(
+                oid, refs, edge_attributes={'attr_name': attr_names}, **attributes
+            )
+            num_objects += 1
+            num_bytes += attributes['size']
+
+            depth = depths[oid] + 1
+            if (max_depth is not None) and (depth > max_depth):
+                continue
+            for r in sorted(refs):
+                if r not in depths:
+                    depths[r] = depth
+                    queue.append(r)
+
+    truncated = bool(queue)
+    log.info('Extracted {} objects, {} bytes{}.'.format(
+        num_objects, num_bytes, ' (truncated)' if truncated else ''))
+    return Subgraph(root_oid, builder.build(), missing=missing, truncated=truncated)
+
+
+def get_back_reference_neighbourhood(zodb_info, oid, hops=1, max_objects=None):
+    u"""Get the objects which reach `oid` in at most `hops` references, and the references between
+    them.
+
+    Arguments:
+    zodb_info (ZODBInfo) -- With the reference maps built.
+    oid (str) -- OID or OID representation.
+    hops (int) -- Maximum number of references to `oid`.
+    max_objects (Optional[int]) -- Stop once this number of objects are found.
+
+    Return (Subgraph) -- Its root is `oid`, although the references go towards it.
+    """
+    oid = zodb_info.oid_or_repr_to_oid(oid)
+    depths = {oid: 0}
+    queue = collections.deque([oid])
+    truncated = False
+    with profiling.timer('subgraph.extract'):
+        while queue:
+            current_oid = queue.popleft()
+            depth = depths[current_oid] + 1
+            if depth > hops:
+                continue
+            for br in sorted(zodb_info.get_back_references(current_oid)):
+                if br in depths:
+                    continue
+                if (max_objects is not None) and (len(depths) >= max_objects):
+                    truncated = True
+                    queue.clear()
+                    break
+                depths[br] = depth
+                queue.append(br)
+
+        builder = make_graph_builder()
+        graph = zodb_info.graph
+        missing = set()
+        for current_oid in sorted(depths):
+            size = zodb_info.get_record_size(current_oid)
+            if not size:
+                missing.add(current_oid)
+            refs = [r for r in zodb_info.get_references(current_oid) if r in depths]
+            # Attribute names are only taken from the graph, looking them up loads the objects.
+            attr_names = {r: graph.get_edge_attribute('attr_name', current_oid, r) for r in refs}
+            builder.add_references(
+                current_oid, refs, edge_attributes={'attr_name': attr_names}, size=size or 0,
+                class_name=zodb_info.get_class_name(current_oid) or '',
+                id=graph.get_attribute('id', current_oid) or '',
+            )
+
+    return Subgraph(oid, builder.build(), missing=missing, truncated=truncated)
+
+
+@case
+class Subgraph(object):
+    u"""A part of the reference graph.
+
+    `graph` holds the references of the objects whose record was loaded, and their attributes
+    (see `.graph.ReferenceMaps`). Referenced objects which were not loaded are in its `oids`, and
+    `get_state()` tells why. `truncated` is true when the extraction stopped at a limit of objects
+    or bytes, rather than after every object up to the maximum depth.
+    """
+
+    def __init__(self, root_oid, graph, missing=frozenset(), truncated=False):
+        pass
+
+    def __len__(self):
+        return len(self.graph)
+
+    def get_state(self, oid):
+        u"""Return (str) `STATE_LOADED`, `STATE_MISSING` if `oid` has no current record, or
+        `STATE_FRONTIER` if its record was not loaded.
+        """
+        if oid in self.missing:
+            return STATE_MISSING
+        if oid in self.graph.reference_map or self.graph.get_attribute('class_name', oid):
+            return STATE_LOADED
+        return STATE_FRONTIER
+
+
+def write_subgraph(subgraph, stream, output_format=FORMAT_GRAPHML):
+    u"""Write a subgraph in one of `FORMATS`, see the module docstring.
+
+    Arguments:
+    subgraph (Subgraph) -- The subgraph.
+    stream (file) -- Where it is written.
+    output_format (str) -- One of `FORMATS`.
+    """
+    writers = {FORMAT_EDGELIST: _write_edge_list, FORMAT_GRAPHML: _write_graphml}
+    if output_format not in writers:
+        raise ValueError('Unknown export format: {}'.format(output_format))
+    with profiling.timer('subgraph.write'):
+        writers[output_format](subgraph, stream)
+
+
+def _write_edge_list(subgraph, stream):
+    graph = subgraph.graph
+    writer = csv.writer(stream, dialect='excel-tab', lineterminator='\n')
+    writer.writerow(EDGELIST_FIELDS)
+
+    def node_columns(oid):
+        return (graph.get_attribute('class_name', oid) or '', graph.get_attribute('size', oid))
+
+    for oid in sorted(graph.oids):
+        refs = sorted(graph.get_references(oid))
+        if not refs:
+            if not graph.get_back_references(oid):
+                writer.writerow((oid_repr(oid), '', '') + node_columns(oid) + ('', ''))
+            continue
+        for r in refs:
+            writer.writerow(
+                (oid_repr(oid), oid_repr(r), graph.get_edge_attribute('attr_name', oid, r) or '')
+                + node_columns(oid) + node_columns(r)
+            )
+
+
+def _write_graphml(subgraph, stream):
+    graph = subgraph.graph
+    write = stream.write
+    write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+    for (key_id, target, name, key_type) in _GRAPHML_KEYS:
+        write('  <key id="{}" for="{}" attr.name="{}" attr.type="{}"/>\n'.format(
+            key_id, target, name, key_type))
+    write('  <graph id={} edgedefault="directed">\n'.format(
+        quoteattr(oid_repr(subgraph.root_oid))))
+
+    for oid in sorted(graph.oids):
+        write('    <node id={}>'.format(quoteattr(oid_repr(oid))))
+        values = (
+            ('d0', graph.get_attribute('class_name', oid)),
+            ('d1', graph.get_attribute('size', oid)),
+            ('d2', graph.get_attribute('id', oid)),
+            ('d3', subgraph.get_state(oid)),
+        )
+        for (key_id, value) in values:
+            if value is not None:
+                write('<data key="{}">{}</data>'.format(key_id, _to_xml_text(value)))
+        write('</node>\n')
+
+    for oid in sorted(graph.oids):
+        for r in sorted(graph.get_references(oid)):
+            write('    <edge source={} target={}>'.format(
+                quoteattr(oid_repr(oid)), quoteattr(oid_repr(r))))
+            attr_name = graph.get_edge_attribute('attr_name', oid, r)
+            if attr_name:
+                write('<data key="d4">{}</data>'.format(_to_xml_text(attr_name)))
+            write('</edge>\n')
+
+    write('  </graph>\n')
+    write('</graphml>\n')
+
+
+def _to_xml_text(value):
+    u"""Return (str) `value` as escaped UTF-8 XML text. Ids are byte strings of any encoding."""
+    if isinstance(value, str):
+        value = value.decode('utf8', 'replace')
+    text = _INVALID_XML_CHARS.sub(u'\ufffd', unicode(value))
+    return escape(text).encode('utf8')
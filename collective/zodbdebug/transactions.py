@@ -0,0 +1,514 @@
+# coding=utf8
+u"""Index of the transactions of a storage, for random access to the transaction log.
+
+Storages can only iterate over their transactions from a given transaction id, and finding it may
+mean reading the whole history. The index keeps, for every transaction in commit order, its id, its
+position in `Data.fs`, the user and description, its size and its number of records. It is stored
+in a file with the format of `.graphfile`, which is memory-mapped, so getting the `n`-th last
+transaction, or the transactions in a range of ids or times, takes a binary search at most.
+
+The index is updated incrementally: only the transactions committed after the last indexed one
+are read. For a `FileStorage` only the headers are read (see `.fsscan.iter_transaction_headers()`).
+Other storages are read with `storage.iterator()` and have no positions.
+
+Segments:
+    The index is append-only, like `.history`: each update writes the new transactions to a new
+    segment file, older segments are never rewritten, so an update takes a time proportional to
+    the number of new transactions. Small segments are merged as they accumulate: the last two
+    segments are merged while the older one is not larger than the newer one, up to
+    `_SEGMENT_SIZE` transactions, so there are few segments and each transaction is copied a
+    logarithmic number of times.
+"""
+from .fsscan import is_file_storage
+from .fsscan import iter_transaction_headers
+from .fsscan import read_transaction_id
+from .graph import StringTable
+from .graph import UINT32_TYPECODE
+from .graph import UINT64_TYPECODE
+from .graphfile import GraphFileError
+from .graphfile import read_sections
+from .graphfile import write_sections
+from .util import mkdirp
+from ZODB.FileStorage.FileStorage import FileIterator
+from ZODB.utils import p64
+from ZODB.utils import tid_repr
+from ZODB.utils import u64
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from logging import getLogger
+from persistent.TimeStamp import TimeStamp
+from rbco.caseclasses import case
+import calendar
+import itertools
+import os
+import time
+
+log = getLogger(__name__)
+
+# Name and array typecode of each column.
+_COLUMNS = (
+    ('tid', UINT64_TYPECODE),
+    ('offset', UINT64_TYPECODE),  # 0 when the storage is not a FileStorage.
+    ('size', UINT64_TYPECODE),
+    ('records', UINT32_TYPECODE),
+    ('user', UINT32_TYPECODE),  # Index in the `user` string table.
+    ('description', UINT32_TYPECODE),  # Index in the `description` string table.
+)
+_STRING_COLUMNS = ('user', 'description')
+
+_COLUMN_SECTION_PREFIX = 'tx.'
+_STRING_DATA_SECTION_PREFIX = 'sd.'
+_STRING_OFFSETS_SECTION_PREFIX = 'so.'
+
+_SEGMENT_PREFIX = 'transactions_'
+
+# Maximum number of transactions of a merged segment.
+_SEGMENT_SIZE = 1000000
+
+_LOG_INTERVAL = 10.0
+
+
+def open_transaction_index(storage, path):
+    u"""Open the transaction index of `storage` stored in the directory `path`, updating it with
+    the transactions committed since it was stored.
+
+    The index is built from scratch when there is no segment, or when the last indexed transaction
+    is no longer in the storage (e.g. after a pack moved the transactions in `Data.fs`, or when the
+    database was replaced).
+
+    Arguments:
+    storage (ZODB.interfaces.IStorage) -- The storage.
+    path (str) -- Directory of the segment files.
+
+    Return (TransactionIndex)
+    """
+    if os.path.isfile(path):
+        _upgrade_index_file(path)
+
+    index = TransactionIndex(_read_segments(path))
+    if not _is_valid(index, storage):
+        log.warning('Rebuilding the transaction index, the storage changed: {}'.format(path))
+        for segment in index.segments:
+            os.remove(segment.path)
+        index = TransactionIndex()
+
+    if not len(index):
+        log.info('Building the transaction index...')
+    segment = TransactionSegment.from_transactions(_iter_new_transactions(storage, index))
+    if not len(segment):
+        return index
+
+    log.info('Storing {} transactions in the transaction index...'.format(len(segment)))
+    segments = _merge_small_segments(list(index.segments) + [segment.write(path)], path)
+    return TransactionIndex(segments)
+
+
+def _is_valid(index, storage):
+    if not len(index):
+        return True
+
+    last = index[-1]
+    if is_file_storage(storage):
+        return (last.offset is not None) and (
+            read_transaction_id(storage, last.offset) == last.tid
+        )
+    return (last.offset is None) and has_transaction(storage, last.tid)
+
+
+def _read_segments(path):
+    u"""Return (List[TransactionSegment]) the segments stored in the directory `path`, in commit
+    order.
+
+    Segments which cannot be read, or which overlap an earlier one (e.g. left by an interrupted
+    merge), are removed.
+    """
+    if not os.path.isdir(path):
+        return []
+
+    segments = []
+    for name in sorted(os.listdir(path)):
+        if not name.startswith(_SEGMENT_PREFIX) or name.endswith('.tmp'):
+            continue
+        segment_path = os.path.join(path, name)
+        try:
+            segment = TransactionSegment.from_sections(read_sections(segment_path), segment_path)
+        except GraphFileError as e:
+            log.warning('Ignoring transaction index segment: {}: {}'.format(segment_path, e))
+            os.remove(segment_path)
+            continue
+        if segments and (segment.first_tid <= segments[-1].last_tid):
+            # Merged segments are written before the segments they replace are removed.
+            previous = segments.pop()
+            if segment.first_tid > previous.first_tid:
+                segments.append(previous)
+                os.remove(segment_path)
+                continue
+            os.remove(previous.path)
+        segments.append(segment)
+    return segments
+
+
+def _upgrade_index_file(path):
+    u"""Move the index stored in the file `path` by older versions to a segment in the directory
+    `path`.
+    """
+    old_path = path + '.old'
+    os.rename(path, old_path)
+    try:
+        segment = TransactionSegment.from_sections(read_sections(old_path))
+    except GraphFileError as e:
+        log.warning('Ignoring transaction index file: {}'.format(e))
+        os.remove(old_path)
+        return
+    if len(segment):
+        mkdirp(path)
+        os.rename(old_path, _get_segment_path(path, segment.first_tid, segment.last_tid))
+    else:
+        os.remove(old_path)
+
+
+def _merge_small_segments(segments, path):
+    u"""Merge the last two segments while the older one is not larger than the newer one, up to
+    `_SEGMENT_SIZE` transactions.
+
+    Return (List[TransactionSegment])
+    """
+    while (len(segments) > 1) and (len(segments[-2]) <= len(segments[-1])) and (
+        len(segments[-2]) + len(segments[-1]) <= _SEGMENT_SIZE
+    ):
+        merged = segments[-2:]
+        segment = TransactionSegment.from_transactions(
+            s[i] for s in merged for i in xrange(len(s))
+        ).write(path)
+        for old in merged:
+            os.remove(old.path)
+        segments[-2:] = [segment]
+    return segments
+
+
+def _get_segment_path(path, first_tid, last_tid):
+    return os.path.join(path, '{}{:016x}_{:016x}'.format(
+        _SEGMENT_PREFIX, u64(first_tid), u64(last_tid)))
+
+
+def has_transaction(storage, tid):
+    u"""Return (bool) whether `storage` has a transaction with id `tid`."""
+    iterator = storage.iterator(tid, tid)
+    try:
+        return any(transaction.tid == tid for transaction in iterator)
+    finally:
+        close_iterator(iterator)
+
+
+def _iter_new_transactions(storage, index):
+    u"""Return (Iterator[TransactionInfo]) the transactions committed after the last one of
+    `index`.
+    """
+    last = index[-1] if len(index) else None
+    start_time = last_log_time = time.time()
+    num_transactions = 0
+    for info in _iter_transactions(storage, last):
+        yield info
+        num_transactions += 1
+        now = time.time()
+        if now - last_log_time >= _LOG_INTERVAL:
+            last_log_time = now
+            log.info('Indexed {} transactions in {:.1f}s.'.format(
+                num_transactions, now - start_time))
+
+
+def _iter_transactions(storage, last):
+    if is_file_storage(storage):
+        pos = (last.offset + last.size + 8) if last else None
+        for (pos, tid, size, user, description, num_records) in iter_transaction_headers(
+            storage, pos
+        ):
+            yield TransactionInfo(
+                tid=tid, offset=pos, size=size, records=num_records, user=user,
+                description=description,
+            )
+        return
+
+    iterator = storage.iterator(start=p64(u64(last.tid) + 1) if last else None)
+    try:
+        for transaction in iterator:
+            records = [len(r.data or '') for r in transaction]
+            yield TransactionInfo(
+                tid=transaction.tid, size=sum(records), records=len(records),
+                user=transaction.user, description=transaction.description,
+            )
+    finally:
+        close_iterator(iterator)
+
+
+def get_transaction_oids(storage, info):
+    u"""Return (List[str]) the OIDs modified by a transaction.
+
+    For a `FileStorage` the transaction is read straight from its position.
+
+    Arguments:
+    storage (ZODB.interfaces.IStorage) -- The storage.
+    info (TransactionInfo) -- The transaction, from a `TransactionIndex`.
+    """
+    if (info.offset is not None) and is_file_storage(storage):
+        iterator = FileIterator(storage._file_name, pos=info.offset)
+    else:
+        iterator = storage.iterator(info.tid, info.tid)
+
+    try:
+        for transaction in iterator:
+            if transaction.tid != info.tid:
+                raise ValueError('Transaction {} not found at the indexed position.'.format(
+                    info.tid_repr))
+            return [r.oid for r in transaction]
+        return []
+    finally:
+        close_iterator(iterator)
+
+
+def iter_storage_transactions(storage, index, start=0, stop=None):
+    u"""Iterate over the transactions `start` to `stop` of `index`, read from the storage.
+
+    For a `FileStorage` the reading starts straight at the position of the first transaction.
+
+    Arguments:
+    storage (ZODB.interfaces.IStorage) -- The storage.
+    index (TransactionIndex) -- Its transaction index.
+    start (int) -- Position of the first transaction in `index`.
+    stop (Optional[int]) -- Position after the last transaction, the end of `index` by default.
+
+    Return (Iterator[ZODB.interfaces.IStorageTransactionInformation])
+    """
+    stop = len(index) if (stop is None) else min(stop, len(index))
+    if start >= stop:
+        return
+
+    first = index[start]
+    if (first.offset is not None) and is_file_storage(storage):
+        iterator = FileIterator(storage._file_name, pos=first.offset)
+    else:
+        iterator = storage.iterator(first.tid, index[stop - 1].tid)
+
+    try:
+        for transaction in itertools.islice(iterator, stop - start):
+            yield transaction
+    finally:
+        close_iterator(iterator)
+
+
+def close_iterator(iterator):
+    close = getattr(iterator, 'close', None)
+    if close:
+        close()
+
+
+def time_to_tid(t):
+    u"""Return (str) the smallest transaction id at or after the Unix time `t`."""
+    (year, month, day, hour, minute, second) = time.gmtime(t)[:6]
+    return TimeStamp(year, month, day, hour, minute, second + (t % 1)).raw()
+
+
+def parse_time(s):
+    u"""Return (float) the Unix time of an UTC time written as `YYYY-MM-DD`, `YYYY-MM-DDTHH:MM`
+    or `YYYY-MM-DDTHH:MM:SS`.
+    """
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return float(calendar.timegm(time.strptime(s, fmt)))
+        except ValueError:
+            pass
+    raise ValueError('Invalid time: {}'.format(s))
+
+
+class TransactionIndex(object):
+    u"""The transactions of a storage, in commit order.
+
+    Supports `len()` and indexing with an integer (negative from the end), which returns a
+    `TransactionInfo`.
+
+    Arguments:
+    segments (Sequence[TransactionSegment]) -- The segments, in commit order, none empty.
+    """
+
+    def __init__(self, segments=()):
+        self.segments = tuple(segments)
+        # Position of the first transaction of each segment, and the end.
+        self._starts = [0]
+        for segment in self.segments:
+            self._starts.append(self._starts[-1] + len(segment))
+        self._last_tids = [u64(segment.last_tid) for segment in self.segments]
+
+    def __len__(self):
+        return self._starts[-1]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not (0 <= i < len(self)):
+            raise IndexError('Transaction index out of range')
+
+        k = bisect_right(self._starts, i) - 1
+        return self.segments[k][i - self._starts[k]]
+
+    def find(self, tid):
+        u"""Return (Optional[int]) the position of the transaction `tid`, `None` if not found."""
+        i = self.bisect(tid)
+        return i if (i < len(self)) and (self[i].tid == tid) else None
+
+    def bisect(self, tid):
+        u"""Return (int) the position of the first transaction at or after `tid`."""
+        k = bisect_left(self._last_tids, u64(tid))
+        if k == len(self.segments):
+            return len(self)
+        return self._starts[k] + self.segments[k].bisect(tid)
+
+    def get_range(self, start, stop):
+        u"""Return (List[TransactionInfo]) the transactions from `start` to `stop`, like slicing a
+        list, but negative positions are not supported.
+        """
+        return [self[i] for i in xrange(max(start, 0), min(stop, len(self)))]
+
+    def get_tid_range(self, start_tid=None, stop_tid=None):
+        u"""Return (List[TransactionInfo]) the transactions with `start_tid <= tid < stop_tid`.
+        Missing limits are unbounded.
+        """
+        start = self.bisect(start_tid) if start_tid else 0
+        stop = self.bisect(stop_tid) if stop_tid else len(self)
+        return self.get_range(start, stop)
+
+    def get_time_range(self, start_time=None, stop_time=None):
+        u"""Return (List[TransactionInfo]) the transactions committed from `start_time` (included)
+        to `stop_time` (excluded), as Unix times. Missing limits are unbounded.
+        """
+        return self.get_tid_range(
+            time_to_tid(start_time) if (start_time is not None) else None,
+            time_to_tid(stop_time) if (stop_time is not None) else None,
+        )
+
+
+class TransactionSegment(object):
+    u"""Consecutive transactions of a `TransactionIndex`, stored in a file.
+
+    Arguments:
+    columns (Optional[Mapping[str, Sequence[int]]]) -- One sequence by column name, see `_COLUMNS`.
+    string_tables (Optional[Mapping[str, StringTable]]) -- Users and descriptions.
+    path (Optional[str]) -- Path of the file, `None` if the segment is not stored.
+    """
+
+    def __init__(self, columns=None, string_tables=None, path=None):
+        self.columns = columns or {name: array(typecode) for (name, typecode) in _COLUMNS}
+        self.string_tables = string_tables or {name: StringTable() for name in _STRING_COLUMNS}
+        self.path = path
+
+    @classmethod
+    def from_sections(cls, sections, path=None):
+        u"""Create a segment from the arrays returned by `sections()`."""
+        try:
+            columns = {name: sections[_COLUMN_SECTION_PREFIX + name] for (name, _) in _COLUMNS}
+            string_tables = {
+                name: StringTable(
+                    sections[_STRING_DATA_SECTION_PREFIX + name],
+                    sections[_STRING_OFFSETS_SECTION_PREFIX + name],
+                )
+                for name in _STRING_COLUMNS
+            }
+        except KeyError as e:
+            raise GraphFileError('Not a transaction index, missing section {}.'.format(e))
+        return cls(columns, string_tables, path)
+
+    @classmethod
+    def from_transactions(cls, transactions):
+        u"""Create a segment in memory.
+
+        Arguments:
+        transactions (Iterable[TransactionInfo]) -- Transactions in commit order.
+
+        Return (TransactionSegment)
+        """
+        segment = cls()
+        (columns, string_tables) = (segment.columns, segment.string_tables)
+        for info in transactions:
+            columns['tid'].append(u64(info.tid))
+            columns['offset'].append(info.offset or 0)
+            columns['size'].append(info.size)
+            columns['records'].append(info.records)
+            for name in _STRING_COLUMNS:
+                columns[name].append(string_tables[name].index(getattr(info, name)))
+        return segment
+
+    def sections(self):
+        u"""Return (List[Tuple[str, array.array]]) the arrays of the segment, by section name."""
+        result = [
+            (_COLUMN_SECTION_PREFIX + name, self.columns[name]) for (name, _) in _COLUMNS
+        ]
+        for name in _STRING_COLUMNS:
+            (data, offsets) = self.string_tables[name].arrays()
+            result.append((_STRING_DATA_SECTION_PREFIX + name, data))
+            result.append((_STRING_OFFSETS_SECTION_PREFIX + name, offsets))
+        return result
+
+    def write(self, path):
+        u"""Write the segment to a new file in the directory `path`.
+
+        Return (TransactionSegment) -- The segment, read from the file.
+        """
+        mkdirp(path)
+        segment_path = _get_segment_path(path, self.first_tid, self.last_tid)
+        write_sections(segment_path, self.sections())
+        return TransactionSegment.from_sections(read_sections(segment_path), segment_path)
+
+    @property
+    def first_tid(self):
+        return p64(self.columns['tid'][0])
+
+    @property
+    def last_tid(self):
+        return p64(self.columns['tid'][-1])
+
+    def __len__(self):
+        return len(self.columns['tid'])
+
+    def __getitem__(self, i):
+        columns = self.columns
+        return TransactionInfo(
+            tid=p64(columns['tid'][i]),
+            offset=columns['offset'][i] or None,
+            size=columns['size'][i],
+            records=columns['records'][i],
+            user=self.string_tables['user'][columns['user'][i]],
+            description=self.string_tables['description'][columns['description'][i]],
+        )
+
+    def bisect(self, tid):
+        u"""Return (int) the position of the first transaction at or after `tid`."""
+        return bisect_left(self.columns['tid'], u64(tid))
+
+
+@case
+class TransactionInfo(object):
+    u"""A transaction of a `TransactionIndex`.
+
+    `offset` is the position of the transaction in `Data.fs`, `None` for other storages. `size` is
+    the length of the transaction in bytes (for other storages, the sum of the pickle sizes) and
+    `records` the number of data records.
+    """
+
+    def __init__(self, tid, offset=None, size=0, records=0, user='', description=''):
+        pass
+
+    @property
+    def tid_repr(self):
+        u"""(str) The transaction id as a hexadecimal string."""
+        return tid_repr(self.tid)
+
+    @property
+    def time(self):
+        u"""(float) Commit time, as a Unix time."""
+        return TimeStamp(self.tid).timeTime()
+
+    @property
+    def time_str(self):
+        u"""(str) Commit time, in UTC, as an ISO 8601 string."""
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(self.time))
+
@@ -80,11 +80,11 @@ def cache_get_oid_path(f):
     return new_f
 
 
-def setup_logging(level=logging.INFO):
-    u"""Setup logging for use in CLI scripts."""
+def setup_logging(level=logging.INFO, stream=None):
+    u"""Setup logging for use in CLI scripts. Log to `stream`, by default `sys.stdout`."""
     root_logger = logging.getLogger()
     root_logger.setLevel(level)
-    handler = logging.StreamHandler(sys.stdout)
+    handler = logging.StreamHandler(stream or sys.stdout)
     formatter = logging.Formatter(
         '%(levelname)-7s [%(asctime)s] %(name)s: %(message)s',
         '%H:%M:%S'
@@ -36,7 +36,6 @@ setup(
     install_requires=[
         'ZODB3',
         'docopt',
-        'plone.memoize',
         'rbco.caseclasses',
         'setuptools',
         'walkdir',
@@ -45,6 +44,20 @@ setup(
         'zopectl.command': [
             'scan_blobs = collective.zodbdebug.scripts.scan_blobs:main',
             'show_transactions = collective.zodbdebug.scripts.show_transactions:main',
-        ]
+            'show_unreachable = collective.zodbdebug.scripts.show_unreachable:main',
+            'show_sizes = collective.zodbdebug.scripts.show_sizes:main',
+            'show_hotspots = collective.zodbdebug.scripts.show_hotspots:main',
+            'show_retained = collective.zodbdebug.scripts.show_retained:main',
+            'show_reference_history = collective.zodbdebug.scripts.show_reference_history:main',
+            'show_dangling = collective.zodbdebug.scripts.show_dangling:main',
+            'show_databases = collective.zodbdebug.scripts.show_databases:main',
+            'export_subgraph = collective.zodbdebug.scripts.export_subgraph:main',
+            'show_classes = collective.zodbdebug.scripts.show_classes:main',
+            'serve_graph = collective.zodbdebug.scripts.serve_graph:main',
+        ],
+        'console_scripts': [
+            'zodbdebug-query = collective.zodbdebug.scripts.query_graph:main',
+            'zodbdebug-benchmark = collective.zodbdebug.scripts.benchmark:main',
+        ],
     },
 )